@@ -1,28 +1,265 @@
 from __future__ import annotations
 
-from typing import Any, Callable, TypeVar
+from typing import Any, Callable, Optional, TypeVar
 
+import bisect
+import json
 import logging
+import threading
+import time
+from collections import deque
 from concurrent.futures import Future
-from concurrent.futures.thread import ThreadPoolExecutor
+from dataclasses import dataclass
+from enum import Enum
+
+from pajbot.managers.redis import RedisManager
+from pajbot.managers.schedule import ScheduleManager
+from pajbot.streamhelper import StreamHelper
 
 _T = TypeVar("_T")
 
 log = logging.getLogger(__name__)
 
+# Upper bounds (in seconds) of the buckets of the wait and run time histograms
+HISTOGRAM_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
 
-# This implementation is functionally identical to using the ThreadPoolExecutor directly,
-# but it adds the callback, to log uncaught exceptions.
-class ActionQueue:
+# How often the bot publishes the action queue stats to redis for the web interface, in seconds
+STATS_PUBLISH_INTERVAL = 10
+
+# Published stats expire if the bot stops publishing them, in seconds
+STATS_TTL = 60
+
+
+class ActionQueueFull(Exception):
+    pass
+
+
+class ShedPolicy(Enum):
+    # Tasks submitted to a full pool are rejected
+    REJECT_NEW = "reject_new"
+    # The task that has been waiting the longest is dropped to make room for the new task
+    SHED_OLDEST = "shed_oldest"
+
+
+@dataclass
+class PoolOptions:
+    max_workers: int
+    max_queued: int
+    shed_policy: ShedPolicy
+
+
+ACTION_POOLS: dict[str, PoolOptions] = {
+    # Everything that doesn't pick a pool
+    "default": PoolOptions(max_workers=10, max_queued=1000, shed_policy=ShedPolicy.REJECT_NEW),
+    # Tasks a chatter is waiting on, e.g. followage lookups. A chatter cares more about a fresh task than about one
+    # that has been waiting for a long time
+    "interactive": PoolOptions(max_workers=8, max_queued=200, shed_policy=ShedPolicy.SHED_OLDEST),
+    # Deep link checks. These must never be dropped silently, or flooding chat with links would get links past the
+    # link checker. Link checks that don't fit are rejected, and the link checker handles the message right away
+    "link_check": PoolOptions(max_workers=8, max_queued=200, shed_policy=ShedPolicy.REJECT_NEW),
+    # Slow periodic refreshes, e.g. of the chatters, moderators and emotes. If they pile up, the next refresh catches up
+    "background": PoolOptions(max_workers=3, max_queued=20, shed_policy=ShedPolicy.REJECT_NEW),
+}
+
+
+def get_stats_key() -> str:
+    return f"{StreamHelper.get_streamer()}:action_queue:stats"
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = HISTOGRAM_BUCKETS) -> None:
+        self.buckets = buckets
+        # The last count is of the values that are larger than every bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def jsonify(self) -> dict[str, Any]:
+        return {
+            "buckets": [[le, count] for le, count in zip(list(self.buckets) + ["+Inf"], self.counts)],
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+        }
+
+
+class TaskStats:
     def __init__(self) -> None:
-        self.thread_pool_executor = ThreadPoolExecutor()
+        self.submitted = 0
+        self.rejected = 0
+        self.shed = 0
+        self.failed = 0
+        self.wait_time = Histogram()
+        self.run_time = Histogram()
+
+    def jsonify(self) -> dict[str, Any]:
+        return {
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "shed": self.shed,
+            "failed": self.failed,
+            "wait_time": self.wait_time.jsonify(),
+            "run_time": self.run_time.jsonify(),
+        }
+
+
+class _Task:
+    def __init__(
+        self, future: Future[Any], function: Callable[..., Any], args: Any, kwargs: Any, task_type: str
+    ) -> None:
+        self.future = future
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.task_type = task_type
+        self.submitted_at = time.monotonic()
+
+
+class ActionPool:
+    """
+    Runs tasks on up to max_workers threads. At most max_queued tasks wait for a thread, the shed policy decides
+    what happens to tasks submitted to a full pool. Tasks that are dropped fail with ActionQueueFull.
+    """
+
+    def __init__(self, name: str, options: PoolOptions) -> None:
+        self.name = name
+        self.max_workers = options.max_workers
+        self.max_queued = options.max_queued
+        self.shed_policy = options.shed_policy
+
+        self.queue: deque[_Task] = deque()
+        self.condition = threading.Condition()
+        self.num_workers = 0
+        self.idle_workers = 0
+
+        # Function name -> stats
+        self.stats: dict[str, TaskStats] = {}
+
+    def submit(self, function: Callable[..., _T], args: Any, kwargs: Any) -> Future[_T]:
+        future: Future[_T] = Future()
+        task_type = getattr(function, "__qualname__", repr(function))
+        shed_task: Optional[_Task] = None
+
+        with self.condition:
+            stats = self._get_stats(task_type)
+            stats.submitted += 1
+
+            if len(self.queue) >= self.max_queued:
+                if self.shed_policy is ShedPolicy.SHED_OLDEST:
+                    shed_task = self.queue.popleft()
+                    self._get_stats(shed_task.task_type).shed += 1
+                else:
+                    stats.rejected += 1
+                    log.warning(f"The {self.name} action pool is full, rejected {task_type}")
+                    future.set_exception(ActionQueueFull(f"The {self.name} action pool is full"))
+                    return future
+
+            self.queue.append(_Task(future, function, args, kwargs, task_type))
+            if len(self.queue) > self.idle_workers and self.num_workers < self.max_workers:
+                self.num_workers += 1
+                threading.Thread(
+                    target=self._work, name=f"ActionPool-{self.name}-{self.num_workers}", daemon=True
+                ).start()
+            else:
+                self.condition.notify()
+
+        if shed_task is not None:
+            log.warning(f"The {self.name} action pool is full, dropped the oldest waiting {shed_task.task_type}")
+            shed_task.future.set_exception(ActionQueueFull(f"Dropped from the full {self.name} action pool"))
+
+        return future
+
+    def _work(self) -> None:
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.idle_workers += 1
+                    self.condition.wait()
+                    self.idle_workers -= 1
+
+                task = self.queue.popleft()
+
+            if not task.future.set_running_or_notify_cancel():
+                continue
+
+            started_at = time.monotonic()
+            failed = False
+            try:
+                result = task.function(*task.args, **task.kwargs)
+            except BaseException as e:
+                failed = True
+                task.future.set_exception(e)
+            else:
+                task.future.set_result(result)
+
+            finished_at = time.monotonic()
+            with self.condition:
+                stats = self._get_stats(task.task_type)
+                stats.wait_time.observe(started_at - task.submitted_at)
+                stats.run_time.observe(finished_at - started_at)
+                if failed:
+                    stats.failed += 1
+
+    def _get_stats(self, task_type: str) -> TaskStats:
+        # Must be called with self.condition held
+        stats = self.stats.get(task_type)
+        if stats is None:
+            stats = self.stats[task_type] = TaskStats()
+        return stats
+
+    def jsonify(self) -> dict[str, Any]:
+        with self.condition:
+            return {
+                "max_workers": self.max_workers,
+                "workers": self.num_workers,
+                "busy_workers": self.num_workers - self.idle_workers,
+                "max_queued": self.max_queued,
+                "queued": len(self.queue),
+                "shed_policy": self.shed_policy.value,
+                "tasks": {task_type: stats.jsonify() for task_type, stats in self.stats.items()},
+            }
+
+
+class ActionQueue:
+    """
+    Runs tasks on named thread pools, so slow background work can't hold up the tasks chatters are waiting for.
+    Uncaught exceptions of tasks are logged.
+    """
+
+    def __init__(self, pools: dict[str, PoolOptions] = ACTION_POOLS) -> None:
+        self.pools = {name: ActionPool(name, options) for name, options in pools.items()}
 
     def submit(self, function: Callable[..., _T], *args: Any, **kwargs: Any) -> Future[_T]:
-        future = self.thread_pool_executor.submit(function, *args, **kwargs)
+        return self.submit_to("default", function, *args, **kwargs)
+
+    def submit_to(self, pool_name: str, function: Callable[..., _T], *args: Any, **kwargs: Any) -> Future[_T]:
+        future = self.pools[pool_name].submit(function, args, kwargs)
         future.add_done_callback(self._on_future_done)
         return future
 
     def _on_future_done(self, future: Future) -> None:
+        if future.cancelled():
+            return
+
         exc = future.exception()
-        if exc is not None:
+        if exc is not None and not isinstance(exc, ActionQueueFull):
             log.exception("Logging an uncaught exception (ActionQueue)", exc_info=exc)
+
+    def get_stats(self) -> dict[str, Any]:
+        return {name: pool.jsonify() for name, pool in self.pools.items()}
+
+    def publish_stats(self) -> None:
+        """Makes the stats available to the web interface, together with the lag and run times of scheduled jobs"""
+        data = {
+            "published_at": time.time(),
+            "pools": self.get_stats(),
+            "scheduled_jobs": ScheduleManager.scheduler.get_stats(),
+        }
+        RedisManager.get().set(get_stats_key(), json.dumps(data), ex=STATS_TTL)
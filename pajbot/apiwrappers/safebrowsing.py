@@ -1,43 +1,191 @@
+from __future__ import annotations
+
+from typing import Any, Callable, Iterable, Optional
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
 from pajbot import constants
 from pajbot.apiwrappers.base import BaseAPI
 
+log = logging.getLogger(__name__)
+
+# The Safe Browsing API accepts up to 500 threat entries per threatMatches:find request
+MAX_ENTRIES_PER_REQUEST = 500
+
+# Lookups made within this many seconds of each other are sent to the API in one request
+BATCH_WINDOW = 0.05
+
+# Number of verdicts kept in memory
+VERDICT_CACHE_SIZE = 10000
+
+# The API only says how long a match can be cached. URLs that didn't match are looked up again after this many seconds
+SAFE_VERDICT_CACHE_DURATION = 300
+
+THREAT_TYPES = [
+    "THREAT_TYPE_UNSPECIFIED",
+    "MALWARE",
+    "SOCIAL_ENGINEERING",
+    "UNWANTED_SOFTWARE",
+    "POTENTIALLY_HARMFUL_APPLICATION",
+]
+
+PLATFORM_TYPES = [
+    "PLATFORM_TYPE_UNSPECIFIED",
+    "WINDOWS",
+    "LINUX",
+    "ANDROID",
+    "OSX",
+    "IOS",
+    "ANY_PLATFORM",
+    "ALL_PLATFORMS",
+    "CHROME",
+]
+
+THREAT_ENTRY_TYPES = ["THREAT_ENTRY_TYPE_UNSPECIFIED", "URL", "EXECUTABLE"]
+
+
+def parse_cache_duration(value: Any) -> Optional[float]:
+    """Parses a protobuf Duration string like "300s" or "1.5s" into seconds"""
+    if not isinstance(value, str) or not value.endswith("s"):
+        return None
+
+    try:
+        return float(value[:-1])
+    except ValueError:
+        return None
+
 
 class SafeBrowsingAPI(BaseAPI):
-    def __init__(self, api_key):
-        super().__init__(base_url="https://safebrowsing.googleapis.com/v4/")
+    """
+    Looks up URLs with the Safe Browsing Lookup API.
+    Lookups from concurrent link checks are collected for a short moment and sent in one request, and verdicts are
+    cached (bad URLs for as long as the API allows).
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str = "https://safebrowsing.googleapis.com/v4/",
+        batch_window: float = BATCH_WINDOW,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        super().__init__(base_url=base_url)
         self.session.params["key"] = api_key
+        self.batch_window = batch_window
+        self.clock = clock
+
+        # url -> (expires at, bad)
+        self.verdict_cache: OrderedDict[str, tuple[float, bool]] = OrderedDict()
+        # Lookups waiting to be sent in the next batch
+        self.pending: dict[str, Future[bool]] = {}
+        self.batch_scheduled = False
+        self.lock = threading.Lock()
 
-    def is_url_bad(self, url):
+    def is_url_bad(self, url: str, timeout: Optional[float] = None) -> bool:
+        """
+        Returns True if the API lists the URL. Waits at most `timeout` seconds for the verdict, and raises
+        concurrent.futures.TimeoutError if it doesn't arrive in time.
+        """
+        cached = self._get_cached(url)
+        if cached is not None:
+            return cached
+
+        with self.lock:
+            future = self.pending.get(url)
+            if future is None:
+                future = self.pending[url] = Future()
+
+            # The first lookup of a batch waits for more lookups to come in, and then sends the whole batch.
+            # The batch is sent from its own thread, so no lookup waits on the request for longer than it wants to
+            sends_batch = not self.batch_scheduled
+            self.batch_scheduled = True
+
+        if sends_batch:
+            timer = threading.Timer(self.batch_window, self._send_batch)
+            timer.daemon = True
+            timer.start()
+
+        max_wait = self.timeout * 2 + self.batch_window
+        return future.result(timeout=max_wait if timeout is None else min(timeout, max_wait))
+
+    def _send_batch(self) -> None:
+        with self.lock:
+            batch, self.pending = self.pending, {}
+            self.batch_scheduled = False
+
+        urls = list(batch)
+        for i in range(0, len(urls), MAX_ENTRIES_PER_REQUEST):
+            chunk = urls[i : i + MAX_ENTRIES_PER_REQUEST]
+            try:
+                bad_urls = self.find_bad_urls(chunk)
+            except Exception as e:
+                for url in chunk:
+                    batch[url].set_exception(e)
+                continue
+
+            for url in chunk:
+                batch[url].set_result(url in bad_urls)
+
+    def find_bad_urls(self, urls: Iterable[str]) -> set[str]:
+        """Looks up the given URLs (at most MAX_ENTRIES_PER_REQUEST) in one request, and returns the bad ones"""
+        urls = list(urls)
         resp = self.post(
             "/threatMatches:find",
             json={
                 "client": {"clientId": "pajbot1", "clientVersion": constants.VERSION},
                 "threatInfo": {
-                    "threatTypes": [
-                        "THREAT_TYPE_UNSPECIFIED",
-                        "MALWARE",
-                        "SOCIAL_ENGINEERING",
-                        "UNWANTED_SOFTWARE",
-                        "POTENTIALLY_HARMFUL_APPLICATION",
-                    ],
-                    "platformTypes": [
-                        "PLATFORM_TYPE_UNSPECIFIED",
-                        "WINDOWS",
-                        "LINUX",
-                        "ANDROID",
-                        "OSX",
-                        "IOS",
-                        "ANY_PLATFORM",
-                        "ALL_PLATFORMS",
-                        "CHROME",
-                    ],
-                    "threatEntryTypes": ["THREAT_ENTRY_TYPE_UNSPECIFIED", "URL", "EXECUTABLE"],
-                    "threatEntries": [{"url": url}],
+                    "threatTypes": THREAT_TYPES,
+                    "platformTypes": PLATFORM_TYPES,
+                    "threatEntryTypes": THREAT_ENTRY_TYPES,
+                    "threatEntries": [{"url": url} for url in urls],
                 },
             },
         )
 
         # good response: {} or {"matches":[]}
-        # bad response: {"matches":[{ ... }]}
+        # bad response: {"matches":[{"threat": {"url": ...}, "cacheDuration": "300s", ...}]}
+        bad_urls: dict[str, float] = {}
+        for match in resp.get("matches", []):
+            url = match.get("threat", {}).get("url")
+            if url is None:
+                continue
+
+            cache_duration = parse_cache_duration(match.get("cacheDuration")) or 0.0
+            # A URL can match several threats, it may be cached for as long as its shortest match allows
+            bad_urls[url] = min(cache_duration, bad_urls.get(url, cache_duration))
+
+        for url in urls:
+            if url in bad_urls:
+                self._set_cached(url, True, bad_urls[url])
+            else:
+                self._set_cached(url, False, SAFE_VERDICT_CACHE_DURATION)
+
+        return set(bad_urls)
+
+    def _get_cached(self, url: str) -> Optional[bool]:
+        with self.lock:
+            entry = self.verdict_cache.get(url)
+            if entry is None:
+                return None
+
+            expires_at, bad = entry
+            if expires_at <= self.clock():
+                del self.verdict_cache[url]
+                return None
+
+            self.verdict_cache.move_to_end(url)
+            return bad
+
+    def _set_cached(self, url: str, bad: bool, duration: float) -> None:
+        if duration <= 0:
+            return
 
-        return len(resp.get("matches", [])) > 0
+        with self.lock:
+            self.verdict_cache[url] = (self.clock() + duration, bad)
+            self.verdict_cache.move_to_end(url)
+            while len(self.verdict_cache) > VERDICT_CACHE_SIZE:
+                self.verdict_cache.popitem(last=False)
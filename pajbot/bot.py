@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Any, Callable, Optional, cast
+from typing import TYPE_CHECKING, Any, Callable, Iterator, Optional, cast
 
 import cgi
 import datetime
@@ -10,19 +10,20 @@ import re
 import sys
 import threading
 import urllib
+from contextlib import contextmanager
 
 import pajbot.config as cfg
 import pajbot.migration_revisions.db
 import pajbot.migration_revisions.redis
 from pajbot import utils
-from pajbot.action_queue import ActionQueue
+from pajbot.action_queue import STATS_PUBLISH_INTERVAL, ActionQueue
 from pajbot.apiwrappers.authentication.access_token import UserAccessToken
 from pajbot.apiwrappers.authentication.client_credentials import ClientCredentials
 from pajbot.apiwrappers.authentication.token_manager import AppAccessTokenManager, UserAccessTokenManager
 from pajbot.apiwrappers.twitch.helix import TwitchHelixAPI
 from pajbot.apiwrappers.twitch.id import TwitchIDAPI
 from pajbot.constants import VERSION
-from pajbot.eventloop import SafeDefaultScheduler
+from pajbot.eventloop import ReactorScheduler
 from pajbot.managers.command import CommandManager
 from pajbot.managers.db import DBManager
 from pajbot.managers.deck import DeckManager
@@ -30,8 +31,13 @@ from pajbot.managers.emote import EcountManager, EmoteManager, EpmManager
 from pajbot.managers.handler import HandlerManager
 from pajbot.managers.irc import IRCManager
 from pajbot.managers.kvi import KVIManager, parse_kvi_arguments
+from pajbot.managers.message_filter import MessageFilterManager
+from pajbot.managers.moderation import ModerationQueue
+from pajbot.managers.recent_chatters import PRUNE_INTERVAL, RecentChattersIndex
 from pajbot.managers.redis import RedisManager
-from pajbot.managers.schedule import ScheduleManager
+from pajbot.managers.schedule import ScheduledJob, ScheduleManager, seconds_until
+from pajbot.managers.urlfetch import URLFetcher
+from pajbot.managers.user_cache import UserCache
 from pajbot.managers.user_ranks_refresh import UserRanksRefreshManager
 from pajbot.managers.websocket import WebSocketManager
 from pajbot.migration.db import DatabaseMigratable
@@ -41,12 +47,12 @@ from pajbot.models.action import ActionParser, SubstitutionFilter
 from pajbot.models.banphrase import BanphraseManager
 from pajbot.models.moderation_action import Ban, Timeout, Unban, Untimeout, new_message_processing_scope
 from pajbot.models.module import ModuleManager
-from pajbot.models.sock import SocketManager
+from pajbot.models.sock import SocketClientManager, SocketManager
 from pajbot.models.stream import StreamManager
 from pajbot.models.timer import TimerManager
 from pajbot.models.user import User, UserBasics
 from pajbot.streamhelper import StreamHelper
-from pajbot.tmi import CHARACTER_LIMIT, TMIRateLimits, WhisperOutputMode
+from pajbot.tmi import CHARACTER_LIMIT, SendPriority, TMIRateLimits, WhisperOutputMode
 
 import irc.client
 import requests
@@ -174,8 +180,9 @@ class Bot:
         redis_migration = Migration(redis_migratable, pajbot.migration_revisions.redis, self)
         redis_migration.run()
 
-        # Thread pool executor for async actions
+        # Thread pools for async actions
         self.action_queue = ActionQueue()
+        ScheduleManager.execute_every(STATS_PUBLISH_INTERVAL, self.action_queue.publish_stats)
 
         # refresh points_rank and num_lines_rank regularly
 
@@ -191,24 +198,30 @@ class Bot:
             log.error(f"Invalid rank refresh mode {rank_refresh_mode}, valid options are: 0, 1, or 2")
 
         self.reactor = irc.client.Reactor()
-        # SafeDefaultScheduler makes the bot not exit on exception in the main thread
-        # e.g. on actions via bot.execute_now, etc.
-        self.reactor.scheduler_class = SafeDefaultScheduler
-        self.reactor.scheduler = SafeDefaultScheduler()
+        # Jobs scheduled with bot.execute_now etc. are timed by the ScheduleManager and run on the reactor thread.
+        # Exceptions raised by them are logged instead of making the bot exit
+        self.reactor.scheduler = ReactorScheduler(ScheduleManager.scheduler)
 
         self.start_time = utils.now()
         ActionParser.bot = self
 
         HandlerManager.init_handlers()
+        HandlerManager.add_handler(
+            "on_message", MessageFilterManager.on_message, priority=150, run_if_propagation_stopped=True
+        )
 
         self.socket_manager = SocketManager(self.streamer.login, self.execute_now)
+        # Lets the web interface know about changes made through chat commands
+        SocketClientManager.init(self.streamer.login)
         self.stream_manager = StreamManager(self)
         StreamHelper.init_stream_manager(self.stream_manager)
 
         self.decks = DeckManager()
         self.banphrase_manager = BanphraseManager(self).load()
         self.timer_manager = TimerManager(self).load()
-        self.kvi = KVIManager()
+        # Counters that are changed so often that their changes are only written to redis once per second
+        kvi_coalesced_ids = [kvi_id.strip() for kvi_id in config["main"].get("kvi_coalesced_keys", "").split(",")]
+        self.kvi = KVIManager([kvi_id for kvi_id in kvi_coalesced_ids if kvi_id])
 
         # bot access token
         if "password" in config["main"]:
@@ -238,9 +251,25 @@ class Bot:
                 user_id=self.bot_user.id,
             )
 
+        # Executes bans/timeouts/message deletions off the IRC thread
+        self.moderation_queue = ModerationQueue(self)
+        ScheduleManager.execute_every(STATS_PUBLISH_INTERVAL, self.moderation_queue.publish_stats)
+
         self.emote_manager = EmoteManager(self.twitch_helix_api, self.action_queue)
         self.epm_manager = EpmManager()
-        self.ecount_manager = EcountManager()
+        try:
+            ecount_retention_days = int(config["main"].get("emote_count_retention_days", "0"))
+        except ValueError:
+            log.exception("Bad emote_count_retention_days in your config")
+            ecount_retention_days = 0
+
+        try:
+            ecount_retention_min_count = int(config["main"].get("emote_count_retention_min_count", "5"))
+        except ValueError:
+            log.exception("Bad emote_count_retention_min_count in your config")
+            ecount_retention_min_count = 5
+
+        self.ecount_manager = EcountManager(ecount_retention_days, ecount_retention_min_count)
         self.twitter_manager = cfg.load_twitter_manager(config)(self)
         self.module_manager = ModuleManager(self.socket_manager, bot=self)
         self.module_manager.load()
@@ -254,8 +283,21 @@ class Bot:
 
         HandlerManager.trigger("on_managers_loaded")
 
+        # Serves recently seen chatters from memory, and batches their last_seen/num_lines updates
+        self.user_cache = UserCache(config)
+        self.socket_manager.add_handler("user.update", self.user_cache.on_user_update)
+
+        # Users seen in chat in the last two weeks, e.g. for counting the users pinged in a message
+        self.recent_chatters = RecentChattersIndex()
+        self.recent_chatters.load()
+        self.execute_every(PRUNE_INTERVAL, self.recent_chatters.prune)
+
         # Commitable managers
-        self.commitable = {"commands": self.commands, "banphrases": self.banphrase_manager}
+        self.commitable = {
+            "commands": self.commands,
+            "banphrases": self.banphrase_manager,
+            "users": self.user_cache,
+        }
 
         self.execute_every(60, self.commit_all)
         self.execute_every(1, self.do_tick)
@@ -312,6 +354,13 @@ class Bot:
 
         self.user_agent = f"pajbot1/{VERSION} ({self.bot_user.login})"
 
+        try:
+            urlfetch_cache_ttl = int(config["main"].get("urlfetch_cache_ttl", "10"))
+        except ValueError:
+            log.exception("Bad urlfetch_cache_ttl in your config")
+            urlfetch_cache_ttl = 10
+        self.url_fetcher = URLFetcher(self.user_agent, urlfetch_cache_ttl, RedisManager.get())
+
         self.thread_locals = threading.local()
 
         self.subs_only = False
@@ -325,15 +374,29 @@ class Bot:
         self.reactor.process_forever()
 
     def get_kvi_value(self, key: str, extra: dict[Any, Any] = {}) -> int:
+        # Values of the KVIs used in a command response are read together before the response is built
+        kvi_values = extra.get("kvi_values", {})
+        if key in kvi_values:
+            return kvi_values[key]
+
         return self.kvi[key].get()
 
+    @staticmethod
+    def update_prefetched_kvi_value(key: str, value: int, extra: dict[Any, Any]) -> None:
+        # $(kvi:x) after $(increasekvi:x) in the same response shows the increased value
+        kvi_values = extra.get("kvi_values", {})
+        if key in kvi_values:
+            kvi_values[key] = value
+
     def increase_kvi_value(self, key: str, extra: dict[Any, Any] = {}) -> int:
         kvi_key, kvi_amount = parse_kvi_arguments(key)
         if kvi_key is None:
             return 0
 
         try:
-            return self.kvi[kvi_key].inc(amount=kvi_amount)
+            value = self.kvi[kvi_key].inc(amount=kvi_amount)
+            self.update_prefetched_kvi_value(kvi_key, value, extra)
+            return value
         except:
             log.exception(f"Failed to increase '{kvi_key}' by {kvi_amount}")
             return 0
@@ -344,7 +407,9 @@ class Bot:
             return 0
 
         try:
-            return self.kvi[kvi_key].dec(amount=kvi_amount)
+            value = self.kvi[kvi_key].dec(amount=kvi_amount)
+            self.update_prefetched_kvi_value(kvi_key, value, extra)
+            return value
         except:
             log.exception(f"Failed to decrease '{kvi_key}' by {kvi_amount}")
             return 0
@@ -578,11 +643,26 @@ class Bot:
             log.exception("BabyRage")
             self.whisper_login(event.source.user.lower(), "Exception BabyRage")
 
+    @contextmanager
+    def send_priority_scope(self, priority: SendPriority) -> Iterator[None]:
+        """Chat messages sent from this thread inside the scope are queued in the given send queue lane"""
+        previous = self.thread_locals.__dict__.get("send_priority", None)
+        self.thread_locals.send_priority = priority
+
+        try:
+            yield
+        finally:
+            self.thread_locals.send_priority = previous
+
+    def _send_priority(self) -> SendPriority:
+        priority = self.thread_locals.__dict__.get("send_priority", None)
+        return SendPriority.COMMAND if priority is None else priority
+
     def privmsg(self, message: str, channel: Optional[str] = None) -> None:
         if channel is None:
             channel = self.channel
 
-        self.irc.privmsg(channel, message)
+        self.irc.privmsg(channel, message, self._send_priority())
 
     def c_uptime(self) -> str:
         return utils.time_ago(self.start_time)
@@ -623,17 +703,17 @@ class Bot:
 
         return "No recorded stream FeelsBadMan "
 
-    def execute_now(self, function, *args, **kwargs) -> None:
-        self.execute_delayed(0, function, *args, **kwargs)
+    def execute_now(self, function, *args, **kwargs) -> ScheduledJob:
+        return self.execute_delayed(0, function, *args, **kwargs)
 
-    def execute_at(self, at, function, *args, **kwargs) -> None:
-        self.reactor.scheduler.execute_at(at, lambda: function(*args, **kwargs))
+    def execute_at(self, at, function, *args, **kwargs) -> ScheduledJob:
+        return self.execute_delayed(seconds_until(at), function, *args, **kwargs)
 
-    def execute_delayed(self, delay, function, *args, **kwargs) -> None:
-        self.reactor.scheduler.execute_after(delay, lambda: function(*args, **kwargs))
+    def execute_delayed(self, delay, function, *args, **kwargs) -> ScheduledJob:
+        return ScheduleManager.execute_delayed(delay, function, args, kwargs, executor="reactor")
 
-    def execute_every(self, period, function, *args, **kwargs) -> None:
-        self.reactor.scheduler.execute_every(period, lambda: function(*args, **kwargs))
+    def execute_every(self, period, function, *args, **kwargs) -> ScheduledJob:
+        return ScheduleManager.execute_every(period, function, args, kwargs, executor="reactor")
 
     def _has_moderation_actions(self) -> bool:
         """this returns True if the moderation_actions value
@@ -645,16 +725,7 @@ class Bot:
         return self.thread_locals.moderation_actions is not None
 
     def _ban(self, user_id: str, reason: Optional[str] = None) -> None:
-        try:
-            self.twitch_helix_api.ban_user(self.streamer.id, self.bot_user.id, self.bot_token_manager, user_id, reason)
-        except HTTPError as e:
-            if e.response is None:
-                raise e
-
-            if e.response.status_code == 401:
-                log.error(f"Failed to ban user with id {user_id}, unauthorized: {e} - {e.response.text}")
-            else:
-                log.error(f"Failed to ban user with id {user_id}: {e} - {e.response.text}")
+        self.moderation_queue.add_by_id(user_id, Ban(reason))
 
     def ban(self, user: User, reason: Optional[str] = None) -> None:
         self.ban_id(user.id, reason)
@@ -663,27 +734,13 @@ class Bot:
         self._ban(user_id, reason)
 
     def ban_login(self, login: str, reason: Optional[str] = None) -> None:
-        user_id = self.twitch_helix_api.get_user_id(login)
-        if user_id is None:
-            log.error(f"Attempted to ban user with login {login}, but no such user was found")
-            return
-
         if self._has_moderation_actions():
             self.thread_locals.moderation_actions.add(login, Ban(reason))
         else:
-            self.ban_id(user_id, reason)
+            self.moderation_queue.add(login, Ban(reason))
 
     def _unban(self, user_id: str) -> None:
-        try:
-            self.twitch_helix_api.unban_user(self.streamer.id, self.bot_user.id, user_id, self.bot_token_manager)
-        except HTTPError as e:
-            if e.response is None:
-                raise e
-
-            if e.response.status_code == 401:
-                log.error(f"Failed to unban user with id {user_id}, unauthorized: {e} - {e.response.text}")
-            else:
-                log.error(f"Failed to unban user with id {user_id}: {e} - {e.response.text}")
+        self.moderation_queue.add_by_id(user_id, Unban())
 
     def unban(self, user: User) -> None:
         self.unban_id(user.id)
@@ -692,49 +749,13 @@ class Bot:
         self._unban(user_id)
 
     def unban_login(self, login: str) -> None:
-        user_id = self.twitch_helix_api.get_user_id(login)
-        if user_id is None:
-            log.error(f"Attempted to unban user with login {login}, but no such user was found")
-            return
-
         if self._has_moderation_actions():
             self.thread_locals.moderation_actions.add(login, Unban())
         else:
-            self.unban_id(user_id)
+            self.moderation_queue.add(login, Unban())
 
     def _untimeout(self, user_id: str) -> None:
-        try:
-            ban_data = self.twitch_helix_api.get_banned_user(
-                self.streamer.id, self.streamer_access_token_manager, user_id
-            )
-            if ban_data is None:
-                log.warning(f"User with ID {user_id} is already not banned or timed-out.")
-                return
-            # As per the Helix docs, expires_at will return empty if the user is permabanned.
-            if not ban_data.expires_at:
-                log.error(f"User with ID {user_id} is currently banned! Will not untimeout.")
-                return
-        except HTTPError as e:
-            if e.response is None:
-                raise e
-
-            if e.response.status_code == 401:
-                log.error(f"Failed to get banned user status with id {user_id}, unauthorized: {e} - {e.response.text}")
-                return
-            else:
-                log.error(f"Failed to get banned user status with id {user_id}: {e} - {e.response.text}")
-                return
-
-        try:
-            self.twitch_helix_api.unban_user(self.streamer.id, self.bot_user.id, user_id, self.bot_token_manager)
-        except HTTPError as e:
-            if e.response is None:
-                raise e
-
-            if e.response.status_code == 401:
-                log.error(f"Failed to untimeout user with id {user_id}, unauthorized: {e} - {e.response.text}")
-            else:
-                log.error(f"Failed to untimeout user with id {user_id}: {e} - {e.response.text}")
+        self.moderation_queue.add_by_id(user_id, Untimeout())
 
     def untimeout(self, user: User) -> None:
         self.untimeout_id(user.id)
@@ -743,42 +764,22 @@ class Bot:
         self._untimeout(user_id)
 
     def untimeout_login(self, login: str) -> None:
-        user_id = self.twitch_helix_api.get_user_id(login)
-        if user_id is None:
-            log.error(f"Attempted to untimeout user with login {login}, but no such user was found")
-            return
-
         if self._has_moderation_actions():
             self.thread_locals.moderation_actions.add(login, Untimeout())
         else:
-            self.untimeout_id(user_id)
+            self.moderation_queue.add(login, Untimeout())
 
     def timeout(self, user: User, duration: int, reason: Optional[str] = None) -> None:
         self.timeout_login(user.login, duration, reason)
 
     def _timeout(self, user_id: str, duration: int, reason: Optional[str] = None) -> None:
-        try:
-            self.twitch_helix_api.timeout_user(
-                self.streamer.id, self.bot_user.id, self.bot_token_manager, user_id, duration, reason
-            )
-        except HTTPError as e:
-            if e.response is None:
-                raise e
-
-            if e.response.status_code == 401:
-                log.error(f"Failed to timeout user with id {user_id}, unauthorized: {e} - {e.response.text}")
-            else:
-                log.error(f"Failed to timeout user with id {user_id}: {e} - {e.response.text}")
+        self.moderation_queue.add_by_id(user_id, Timeout(duration, reason))
 
     def timeout_login(self, login: str, duration: int, reason: Optional[str] = None) -> None:
         if self._has_moderation_actions():
             self.thread_locals.moderation_actions.add(login, Timeout(duration, reason))
         else:
-            user_id = self.twitch_helix_api.get_user_id(login)
-            if user_id is None:
-                log.error(f"Attempted to ban user with login {login}, but no such user was found")
-                return
-            self._timeout(user_id, duration, reason)
+            self.moderation_queue.add(login, Timeout(duration, reason))
 
     def timeout_warn(self, user: User, duration: int, reason: Optional[str] = None) -> tuple[int, str]:
         from pajbot.modules import WarningModule
@@ -793,25 +794,13 @@ class Bot:
         if channel_id is None:
             channel_id = self.streamer.id
 
-        try:
-            self.twitch_helix_api.delete_single_message(channel_id, self.bot_user.id, self.bot_token_manager, msg_id)
-        except HTTPError as e:
-            if e.response is None:
-                raise e
-
-            if e.response.status_code == 401:
-                log.error(f"Failed to delete message, unauthorized: {e} - {e.response.text}")
-                self.send_message("Error: The bot must be re-authed in order to delete a message.")
-            elif e.response.status_code == 403:
-                log.error(f"Failed to delete message - bot is not a moderator: {e} - {e.response.text}")
-            else:
-                log.error(f"Failed to delete message: {e} - {e.response.text}")
+        self.moderation_queue.delete_message(msg_id, channel_id)
 
     def delete_or_timeout(
         self,
         user: User,
         moderation_action: str,
-        msg_id: str,
+        msg_id: Optional[str],
         duration: int,
         reason: Optional[str] = None,
         disable_warnings: bool = False,
@@ -928,7 +917,7 @@ class Bot:
         message = utils.clean_up_message(message)
         message = f"@reply-parent-msg-id={msg_id} PRIVMSG {channel} :{message}"
 
-        self.irc.send_raw(message[:CHARACTER_LIMIT])
+        self.irc.send_raw(message[:CHARACTER_LIMIT], self._send_priority())
 
     def say(self, message: str, channel: Optional[str] = None) -> None:
         if message is None:
@@ -1026,6 +1015,7 @@ class Bot:
         now = utils.now()
         source.last_seen = now
         source.last_active = now
+        self.recent_chatters.add(source.id, source.login, source.name, now.timestamp())
 
         if not whisper:
             # increment epm and ecount
@@ -1064,7 +1054,12 @@ class Bot:
                     "trigger": trigger,
                     "msg_id": msg_id,
                 }
-                command.run(self, source, remaining_message, event=event, args=extra_args, whisper=whisper)
+                if source.moderator or source.level >= 500:
+                    # Moderator commands (e.g. !permit, !add command) are sent ahead of the regular chat backlog
+                    with self.send_priority_scope(SendPriority.MODERATION):
+                        command.run(self, source, remaining_message, event=event, args=extra_args, whisper=whisper)
+                else:
+                    command.run(self, source, remaining_message, event=event, args=extra_args, whisper=whisper)
 
         return True
 
@@ -1075,8 +1070,7 @@ class Bot:
         login = event.source.user
         name = tags["display-name"]
 
-        with DBManager.create_session_scope(expire_on_commit=False) as db_session:
-            source = User.from_basics(db_session, UserBasics(id, login, name))
+        with self.user_cache.user_scope(UserBasics(id, login, name)) as source:
             self.parse_message(event.arguments[0], source, event, tags, whisper=True)
 
     def on_usernotice(self, chatconn, event):
@@ -1089,15 +1083,16 @@ class Bot:
         login = tags["login"]
         name = tags["display-name"]
 
-        with DBManager.create_session_scope(expire_on_commit=False) as db_session:
-            source = User.from_basics(db_session, UserBasics(id, login, name))
+        with self.user_cache.user_scope(UserBasics(id, login, name)) as source:
             if event.arguments and len(event.arguments) > 0:
                 msg = event.arguments[0]
             else:
                 msg = None  # e.g. user didn't type an extra message to share with the streamer
 
             with new_message_processing_scope(self):
-                HandlerManager.trigger("on_usernotice", source=source, message=msg, tags=tags)
+                # Sub/resub alerts are the first messages to give way when chat is busy
+                with self.send_priority_scope(SendPriority.TIMER):
+                    HandlerManager.trigger("on_usernotice", source=source, message=msg, tags=tags)
 
                 if msg is not None:
                     self.parse_message(msg, source, event, tags)
@@ -1144,9 +1139,7 @@ class Bot:
                 self.timeout_login(login, 3600, reason="Bad username")
                 return True
 
-        with DBManager.create_session_scope(expire_on_commit=False) as db_session:
-            source = User.from_basics(db_session, UserBasics(id, login, name))
-
+        with self.user_cache.user_scope(UserBasics(id, login, name)) as source:
             with new_message_processing_scope(self):
                 res = HandlerManager.trigger("on_pubmsg", source=source, message=event.arguments[0], tags=tags)
                 if res is False:
@@ -1240,11 +1233,9 @@ class Bot:
         phrase_data = {"nickname": self.bot_user.login, "version": self.version_long}
 
         try:
-            if ScheduleManager.base_scheduler:
-                ScheduleManager.base_scheduler.print_jobs()
-                ScheduleManager.base_scheduler.shutdown(wait=False)
+            ScheduleManager.shutdown()
         except:
-            log.exception("Error while shutting down the apscheduler")
+            log.exception("Error while shutting down the scheduler")
 
         try:
             for p in self.phrases["quit"]:
@@ -1254,6 +1245,7 @@ class Bot:
 
         self.twitter_manager.quit()
         self.socket_manager.quit()
+        self.moderation_queue.quit()
 
         sys.exit(0)
 
@@ -1,3 +1,5 @@
+from pajbot.utils import EmojiMatcher
+
 ALL_EMOJI = [
     "😀",
     "😃",
@@ -3836,3 +3838,5 @@ ALL_EMOJI = [
     "🏴󠁧󠁢󠁳󠁣󠁴󠁿",
     "🏴󠁧󠁢󠁷󠁬󠁳󠁿",
 ]
+
+EMOJI_MATCHER = EmojiMatcher(ALL_EMOJI)
@@ -6,36 +6,39 @@ import datetime
 import logging
 import numbers
 
+from pajbot.managers.schedule import Scheduler, seconds_until
+
 from irc.schedule import IScheduler
-from tempora import schedule
-from tempora.schedule import Scheduler
 
 log = logging.getLogger(__name__)
 
 
-# same as InvokeScheduler from the original implementation,
-# but with the extra try-catch
-class SafeInvokeScheduler(Scheduler):
+def _to_seconds(value: Union[float, datetime.timedelta]) -> float:
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+
+    return value
+
+
+class ReactorScheduler(IScheduler):
     """
-    Command targets are functions to be invoked on schedule.
+    Scheduler of the irc Reactor. Jobs are timed by the bot's Scheduler, and run on the reactor thread
+    whenever the reactor is done processing its connections.
+    Exceptions raised by jobs are logged, so they don't make the bot exit.
     """
 
-    def run(self, command: schedule.DelayedCommand) -> None:
-        try:
-            command.target()
-        except Exception:
-            # we do "except Exception" to not catch KeyboardInterrupt and SystemExit (so the bot can properly quit)
-            log.exception("Logging an uncaught exception (main thread)")
-
+    def __init__(self, scheduler: Scheduler) -> None:
+        self.scheduler = scheduler
 
-# same as DefaultScheduler from the original implementation,
-# but extends SafeInvokeScheduler instead
-class SafeDefaultScheduler(SafeInvokeScheduler, IScheduler):
     def execute_every(self, period: Union[float, datetime.timedelta], func: Callable[..., Any]) -> None:
-        self.add(schedule.PeriodicCommand.after(period, func))
+        seconds = _to_seconds(period)
+        self.scheduler.add_job(func, delay=seconds, interval=seconds, executor="reactor")
 
     def execute_at(self, when: Union[numbers.Real, datetime.datetime], func: Callable[..., Any]) -> None:
-        self.add(schedule.DelayedCommand.at_time(when, func))
+        self.scheduler.add_job(func, delay=seconds_until(when), executor="reactor")  # type: ignore[arg-type]
 
     def execute_after(self, delay: Union[float, datetime.timedelta], func: Callable[..., Any]) -> None:
-        self.add(schedule.DelayedCommand.after(delay, func))
+        self.scheduler.add_job(func, delay=_to_seconds(delay), executor="reactor")
+
+    def run_pending(self) -> None:
+        self.scheduler.run_reactor_jobs()
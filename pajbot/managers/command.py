@@ -8,6 +8,7 @@ from collections import UserDict
 
 from pajbot.managers.db import DBManager
 from pajbot.models.command import Command, CommandData, CommandExample, WebCommand, parse_command_for_web
+from pajbot.models.sock import SocketClientManager
 from pajbot.utils import find
 
 from sqlalchemy.orm import joinedload
@@ -85,7 +86,8 @@ class CommandManager(UserDict[str, Command]):
 
         command = find(lambda command: command.id == command_id, self.db_commands.values())
         if command is None:
-            log.warning("Invalid ID sent to on_command_update")
+            # Commands removed through chat commands are already gone by the time we hear about their removal
+            log.debug(f"Command with id {command_id} is already removed")
             return
 
         self.db_session.expunge(command.data)
@@ -303,6 +305,8 @@ class CommandManager(UserDict[str, Command]):
         self.commit()
 
         self.rebuild()
+        # Let the web interface know about the new command
+        SocketClientManager.send("command.update", {"command_id": command.id})
         return command, True, ""
 
     def edit_command(self, command_to_edit: Command, **options: Any) -> None:
@@ -310,6 +314,7 @@ class CommandManager(UserDict[str, Command]):
         command_to_edit.data.set(**options)
         DBManager.session_add_expunge(command_to_edit)
         self.commit()
+        SocketClientManager.send("command.update", {"command_id": command_to_edit.id})
 
     def remove_command_aliases(self, command: Command) -> None:
         aliases = command.command.split("|")
@@ -328,6 +333,7 @@ class CommandManager(UserDict[str, Command]):
             db_session.delete(command)
 
         self.rebuild()
+        SocketClientManager.send("command.remove", {"command_id": command.id})
 
     def add_db_command_aliases(self, command: Command) -> int:
         aliases = command.command.split("|")
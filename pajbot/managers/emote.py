@@ -1,21 +1,41 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Optional, Protocol
+from typing import TYPE_CHECKING, Callable, Optional, Protocol, cast
 
+import json
 import logging
 import random
+import threading
+import time
+from collections import Counter
 
+from pajbot.managers.handler import HandlerManager
 from pajbot.managers.redis import RedisManager
 from pajbot.managers.schedule import ScheduleManager
 from pajbot.models.emote import Emote, EmoteInstance, EmoteInstanceCount, EmoteInstanceCountMap
 from pajbot.streamhelper import StreamHelper
-from pajbot.utils import iterate_split_with_index
+from pajbot.utils import iterate_in_chunks, iterate_split_with_index
 
 if TYPE_CHECKING:
     from pajbot.apiwrappers.twitch.helix import TwitchHelixAPI
 
 log = logging.getLogger(__name__)
 
+# EPM is counted over the last 60 seconds, with one bucket per second
+EPM_WINDOW = 60
+
+# Emote counts are written to redis every 5 seconds, or after 100 messages with emotes, whichever comes first
+ECOUNT_FLUSH_INTERVAL = 5
+ECOUNT_FLUSH_MESSAGES = 100
+
+# The most used emotes are read from redis at most once every 10 seconds, and only the top 100 are ever read
+TOP_EMOTES_CACHE_SIZE = 100
+TOP_EMOTES_CACHE_TTL = 10
+
+# How often emotes that are rarely used and haven't been used in a long time are removed from the emote counts
+ECOUNT_RETENTION_INTERVAL = 24 * 60 * 60
+ECOUNT_RETENTION_BATCH_SIZE = 1000
+
 
 class EmoteAPI(Protocol):
     def get_global_emotes(self, force_fetch: bool = ...) -> list[Emote]: ...
@@ -34,6 +54,8 @@ class GenericChannelEmoteManager:
         self.streamer_id = StreamHelper.get_streamer_id()
         self.global_lookup_table: dict[str, Emote] = {}
         self.channel_lookup_table: dict[str, Emote] = {}
+        # Called whenever the global or channel emotes change
+        self.on_update: Optional[Callable[[], None]] = None
 
         self.api = api
 
@@ -45,6 +67,8 @@ class GenericChannelEmoteManager:
     def global_emotes(self, value: list[Emote]) -> None:
         self._global_emotes = value
         self.global_lookup_table = {emote.code: emote for emote in value} if value is not None else {}
+        if self.on_update is not None:
+            self.on_update()
 
     @property
     def channel_emotes(self) -> list[Emote]:
@@ -54,6 +78,8 @@ class GenericChannelEmoteManager:
     def channel_emotes(self, value: list[Emote]) -> None:
         self._channel_emotes = value
         self.channel_lookup_table = {emote.code: emote for emote in value} if value is not None else {}
+        if self.on_update is not None:
+            self.on_update()
 
     def load_global_emotes(self) -> None:
         """Load channel emotes from the cache if available, or else, query the API."""
@@ -183,6 +209,29 @@ class SevenTVEmoteManager(GenericChannelEmoteManager):
         self.channel_emotes = self.seventv_api.get_channel_emotes(self.streamer_id, force_fetch=True)
 
 
+class EmoteLookupTable:
+    """
+    Maps emote codes to emotes from several lookup tables, where an earlier table takes precedence over a later one.
+    Never modified after it's built, so it can be replaced while other threads are reading from it.
+    """
+
+    def __init__(self, lookup_tables: list[dict[str, Emote]]) -> None:
+        emotes: dict[str, Emote] = {}
+        for lookup_table in reversed(lookup_tables):
+            emotes.update(lookup_table)
+
+        self.emotes = emotes
+        # Most words in a message can be ruled out without hashing them
+        self.lengths = frozenset(len(code) for code in emotes)
+        self.first_chars = frozenset(code[0] for code in emotes if code)
+
+    def match(self, word: str) -> Optional[Emote]:
+        if len(word) not in self.lengths or word[0] not in self.first_chars:
+            return None
+
+        return self.emotes.get(word, None)
+
+
 class EmoteManager:
     def __init__(self, twitch_helix_api, action_queue) -> None:
         self.action_queue = action_queue
@@ -193,6 +242,11 @@ class EmoteManager:
         self.bttv_emote_manager = BTTVEmoteManager()
         self.seventv_emote_manager = SevenTVEmoteManager()
 
+        self.lookup_table = EmoteLookupTable([])
+        self.lookup_table_lock = threading.Lock()
+        for manager in self.third_party_emote_managers:
+            manager.on_update = self.refresh_lookup_table
+
         # every 1 hour
         # note: whenever emotes are refreshed (cache is saved to redis), the key is additionally set to expire
         # in one hour. This is to prevent emotes from never refreshing if the bot restarts in less than an hour.
@@ -202,16 +256,16 @@ class EmoteManager:
         self.load_all_emotes()
 
     def update_all_emotes(self) -> None:
-        self.action_queue.submit(self.bttv_emote_manager.update_all)
-        self.action_queue.submit(self.ffz_emote_manager.update_all)
-        self.action_queue.submit(self.seventv_emote_manager.update_all)
-        self.action_queue.submit(self.twitch_emote_manager.update_all)
+        self.action_queue.submit_to("background", self.bttv_emote_manager.update_all)
+        self.action_queue.submit_to("background", self.ffz_emote_manager.update_all)
+        self.action_queue.submit_to("background", self.seventv_emote_manager.update_all)
+        self.action_queue.submit_to("background", self.twitch_emote_manager.update_all)
 
     def load_all_emotes(self) -> None:
-        self.action_queue.submit(self.bttv_emote_manager.load_all)
-        self.action_queue.submit(self.ffz_emote_manager.load_all)
-        self.action_queue.submit(self.seventv_emote_manager.load_all)
-        self.action_queue.submit(self.twitch_emote_manager.load_all)
+        self.action_queue.submit_to("background", self.bttv_emote_manager.load_all)
+        self.action_queue.submit_to("background", self.ffz_emote_manager.load_all)
+        self.action_queue.submit_to("background", self.seventv_emote_manager.load_all)
+        self.action_queue.submit_to("background", self.twitch_emote_manager.load_all)
 
     @staticmethod
     def twitch_emote_url(emote_id: str, size: str) -> str:
@@ -257,32 +311,23 @@ class EmoteManager:
 
         return emote_instances
 
-    def match_word_to_emote(self, word: str) -> Optional[Emote]:
-        emote = self.ffz_emote_manager.match_channel_emote(word)
-        if emote is not None:
-            return emote
-
-        emote = self.bttv_emote_manager.match_channel_emote(word)
-        if emote is not None:
-            return emote
-
-        emote = self.seventv_emote_manager.match_channel_emote(word)
-        if emote is not None:
-            return emote
-
-        emote = self.ffz_emote_manager.match_global_emote(word)
-        if emote is not None:
-            return emote
-
-        emote = self.bttv_emote_manager.match_global_emote(word)
-        if emote is not None:
-            return emote
-
-        emote = self.seventv_emote_manager.match_global_emote(word)
-        if emote is not None:
-            return emote
+    @property
+    def third_party_emote_managers(self) -> list[GenericChannelEmoteManager]:
+        return [self.ffz_emote_manager, self.bttv_emote_manager, self.seventv_emote_manager]
+
+    def refresh_lookup_table(self) -> None:
+        # Emotes are loaded on several action queue threads at once.
+        # The lock makes sure the table built last includes the latest emotes of every provider
+        with self.lookup_table_lock:
+            # ffz channel -> bttv channel -> 7tv channel -> ffz global -> bttv global -> 7tv global
+            managers = self.third_party_emote_managers
+            self.lookup_table = EmoteLookupTable(
+                [manager.channel_lookup_table for manager in managers]
+                + [manager.global_lookup_table for manager in managers]
+            )
 
-        return None
+    def match_word_to_emote(self, word: str) -> Optional[Emote]:
+        return self.lookup_table.match(word)
 
     def parse_all_emotes(
         self, message: str, twitch_emotes_tag: str = ""
@@ -295,6 +340,7 @@ class EmoteManager:
         # and then, if word is not a twitch emote, consider ffz channel -> bttv channel ->
         # 7tv channel -> ffz global -> bttv global -> 7tv global in that order.
         third_party_emote_instances = []
+        lookup_table = self.lookup_table
 
         for current_word_index, word in iterate_split_with_index(message.split(" ")):
             # ignore twitch emotes
@@ -302,7 +348,7 @@ class EmoteManager:
             if is_twitch_emote:
                 continue
 
-            emote = self.match_word_to_emote(word)
+            emote = lookup_table.match(word)
             if emote is None:
                 # this word is not an emote
                 continue
@@ -375,9 +421,56 @@ def compute_emote_counts(emote_instances: list[EmoteInstance]) -> dict[str, Emot
     return emote_counts
 
 
+class RollingCounter:
+    """Counts occurrences of each key over the last `window` seconds, in a ring buffer of one-second buckets"""
+
+    def __init__(self, window: int, clock: Callable[[], float] = time.monotonic) -> None:
+        self.window = window
+        self.clock = clock
+
+        # Total over all buckets
+        self.totals: dict[str, int] = {}
+        self.buckets: list[Counter[str]] = [Counter() for _ in range(window)]
+        self.current_second = int(self.clock())
+
+    def _advance(self) -> None:
+        # Empties the buckets of the seconds that left the window
+        now = int(self.clock())
+        elapsed = min(now - self.current_second, self.window)
+        for second in range(now - elapsed + 1, now + 1):
+            bucket = self.buckets[second % self.window]
+            for key, count in bucket.items():
+                self.totals[key] -= count
+            bucket.clear()
+
+        self.current_second = max(now, self.current_second)
+
+    def add(self, key: str, count: int) -> int:
+        """Adds count to the given key, and returns its new total"""
+        self._advance()
+        self.buckets[self.current_second % self.window][key] += count
+        total = self.totals.get(key, 0) + count
+        self.totals[key] = total
+        return total
+
+    def get(self, key: str) -> Optional[int]:
+        """Returns the total of the given key, or None if it has never been counted"""
+        self._advance()
+        return self.totals.get(key, None)
+
+
 class EpmManager:
+    """
+    Keeps the number of times each emote was used over the last minute in memory.
+    New EPM records are collected and written to redis once per second.
+    """
+
     def __init__(self) -> None:
-        self.epm: dict[str, int] = {}
+        self.epm = RollingCounter(EPM_WINDOW)
+
+        # Highest EPM of each emote since the last flush
+        self.pending_records: dict[str, int] = {}
+        self.lock = threading.Lock()
 
         redis = RedisManager.get()
         self.redis_zadd_if_higher = redis.register_script(
@@ -397,28 +490,39 @@ end
 """
         )
 
+        ScheduleManager.execute_every(1, self.flush)
+
     def handle_emotes(self, emote_counts: EmoteInstanceCountMap) -> None:
         # passed dict maps emote code (e.g. "Kappa") to an EmoteInstanceCount instance
         for emote_code, obj in emote_counts.items():
             self.epm_incr(emote_code, obj.count)
 
     def epm_incr(self, code: str, count: int) -> None:
-        new_epm = self.epm.get(code, 0) + count
-        self.epm[code] = new_epm
-        self.save_epm_record(code, new_epm)
-        ScheduleManager.execute_delayed(60, self.epm_decr, args=[code, count])
+        with self.lock:
+            new_epm = self.epm.add(code, count)
+            if new_epm > self.pending_records.get(code, 0):
+                self.pending_records[code] = new_epm
 
-    def epm_decr(self, code: str, count: int) -> None:
-        self.epm[code] -= count
+    def flush(self) -> None:
+        with self.lock:
+            pending_records = self.pending_records
+            self.pending_records = {}
+
+        if not pending_records:
+            return
 
-    def save_epm_record(self, code: str, count: int) -> None:
         streamer = StreamHelper.get_streamer()
-        self.redis_zadd_if_higher(keys=[f"{streamer}:emotes:epmrecord", count], args=[code])
+        with RedisManager.pipeline_context() as pipeline:
+            for code, count in pending_records.items():
+                self.redis_zadd_if_higher(
+                    keys=[f"{streamer}:emotes:epmrecord", str(count)], args=[code], client=pipeline
+                )
 
     def get_emote_epm(self, emote_code: str) -> Optional[int]:
         """Returns the current "emote per minute" usage of the given emote code,
         or None if the emote is unknown to the bot."""
-        return self.epm.get(emote_code, None)
+        with self.lock:
+            return self.epm.get(emote_code)
 
     @staticmethod
     def get_emote_epm_record(emote_code) -> Optional[float]:
@@ -428,20 +532,161 @@ end
 
 
 class EcountManager:
-    @staticmethod
-    def handle_emotes(emote_counts: EmoteInstanceCountMap) -> None:
+    """
+    Counts emote usage in memory, and adds the counts to the totals in redis every few seconds (or after a number
+    of messages), so redis traffic scales with the number of distinct emotes used and not with the chat rate.
+    """
+
+    def __init__(self, retention_days: int = 0, retention_min_count: int = 0) -> None:
+        self.pending: Counter[str] = Counter()
+        # Counts that are currently being written to redis
+        self.flushing: Counter[str] = Counter()
+        self.num_pending_messages = 0
+        self.lock = threading.Lock()
+
+        # Emotes used fewer than retention_min_count times in total that haven't been used in retention_days days
+        # are removed from the emote counts. 0 days disables this
+        self.retention_days = retention_days
+        self.retention_min_count = retention_min_count
+
+        redis = RedisManager.get()
+        # Removes the given emote codes if they still haven't been used since the cutoff and are still rarely used,
+        # even if they were used while we were looking at them
+        self.redis_remove_stale_emotes = redis.register_script(
+            """
+local cutoff = tonumber(ARGV[1])
+local min_count = tonumber(ARGV[2])
+local removed = 0
+for i = 3, #ARGV do
+    local last_used = tonumber(redis.call('zscore', KEYS[2], ARGV[i]))
+    local count = tonumber(redis.call('zscore', KEYS[1], ARGV[i]))
+    if (not last_used or last_used <= cutoff) and (not count or count < min_count) then
+        redis.call('zrem', KEYS[1], ARGV[i])
+        redis.call('zrem', KEYS[2], ARGV[i])
+        redis.call('zrem', KEYS[3], ARGV[i])
+        removed = removed + 1
+    end
+end
+return removed
+"""
+        )
+
+        ScheduleManager.execute_every(ECOUNT_FLUSH_INTERVAL, self.flush)
+        if self.retention_days > 0:
+            ScheduleManager.execute_every(ECOUNT_RETENTION_INTERVAL, self.prune_stale_emotes)
+        HandlerManager.add_handler("on_quit", self.on_quit)
+
+    def handle_emotes(self, emote_counts: EmoteInstanceCountMap) -> None:
         # passed dict maps emote code (e.g. "Kappa") to an EmoteInstanceCount instance
+        if not emote_counts:
+            return
+
+        with self.lock:
+            for emote_code, instance_counts in emote_counts.items():
+                self.pending[emote_code] += instance_counts.count
+
+            self.num_pending_messages += 1
+            flush_now = self.num_pending_messages >= ECOUNT_FLUSH_MESSAGES
+            if flush_now:
+                self.num_pending_messages = 0
+
+        if flush_now:
+            # Don't make the message wait for redis
+            ScheduleManager.execute_now(self.flush)
+
+    def flush(self) -> None:
+        with self.lock:
+            if not self.pending:
+                return
+
+            pending = self.pending
+            self.pending = Counter()
+            self.num_pending_messages = 0
+            self.flushing.update(pending)
+
         streamer = StreamHelper.get_streamer()
         redis_key = f"{streamer}:emotes:count"
-        with RedisManager.pipeline_context() as redis:
-            for emote_code, instance_counts in emote_counts.items():
-                redis.zincrby(redis_key, instance_counts.count, emote_code)
+        now = time.time()
+        try:
+            with RedisManager.pipeline_context() as redis:
+                for emote_code, count in pending.items():
+                    redis.zincrby(redis_key, count, emote_code)
+                # Remember when every emote was last used, for prune_stale_emotes
+                redis.zadd(f"{streamer}:emotes:last_used", {emote_code: now for emote_code in pending})
+        except:
+            log.exception("Failed to write emote counts to redis, will retry on next flush")
+            with self.lock:
+                self.pending.update(pending)
+        finally:
+            with self.lock:
+                self.flushing.subtract(pending)
+                self.flushing = +self.flushing
+
+    def on_quit(self, **rest) -> bool:
+        self.flush()
+        return True
+
+    def get_emote_count(self, emote_code: str) -> Optional[int]:
+        redis = RedisManager.get()
+        streamer = StreamHelper.get_streamer()
+        emote_count = cast(Optional[float], redis.zscore(f"{streamer}:emotes:count", emote_code))
+
+        with self.lock:
+            unflushed_count = self.pending[emote_code] + self.flushing[emote_code]
+
+        if emote_count is None and unflushed_count == 0:
+            return None
+        return int(emote_count or 0) + unflushed_count
 
     @staticmethod
-    def get_emote_count(emote_code: str) -> Optional[int]:
+    def get_top_emotes(limit: int = TOP_EMOTES_CACHE_SIZE) -> list[tuple[str, int]]:
+        """Returns (emote code, count) of the most used emotes, most used first. At most TOP_EMOTES_CACHE_SIZE"""
         redis = RedisManager.get()
         streamer = StreamHelper.get_streamer()
-        emote_count = redis.zscore(f"{streamer}:emotes:count", emote_code)
-        if emote_count is None:
-            return None
-        return int(emote_count)
+        cache_key = f"{streamer}:cache:top_emotes"
+
+        cached_top_emotes = cast(Optional[str], redis.get(cache_key))
+        if cached_top_emotes is not None:
+            top_emotes = json.loads(cached_top_emotes)
+        else:
+            top_emotes = [
+                [emote_code, int(emote_count)]
+                for emote_code, emote_count in cast(
+                    list[tuple[str, float]],
+                    redis.zrevrange(f"{streamer}:emotes:count", 0, TOP_EMOTES_CACHE_SIZE - 1, withscores=True),
+                )
+            ]
+            redis.setex(cache_key, TOP_EMOTES_CACHE_TTL, json.dumps(top_emotes, separators=(",", ":")))
+
+        return [(emote_code, emote_count) for emote_code, emote_count in top_emotes[:limit]]
+
+    def prune_stale_emotes(self) -> None:
+        redis = RedisManager.get()
+        streamer = StreamHelper.get_streamer()
+        count_key = f"{streamer}:emotes:count"
+        last_used_key = f"{streamer}:emotes:last_used"
+        epm_record_key = f"{streamer}:emotes:epmrecord"
+        now = time.time()
+
+        seeded_key = f"{streamer}:emotes:last_used_seeded"
+        if not redis.exists(seeded_key):
+            # Emotes that were counted before we kept track of when they were last used get a full retention period
+            num_seeded = 0
+            for chunk in iterate_in_chunks(list(redis.zscan_iter(count_key)), ECOUNT_RETENTION_BATCH_SIZE):
+                redis.zadd(last_used_key, {emote_code: now for emote_code, _ in chunk}, nx=True)
+                num_seeded += len(chunk)
+            redis.set(seeded_key, 1)
+            log.info(f"Started keeping track of when {num_seeded} emotes were last used")
+            return
+
+        cutoff = now - self.retention_days * 24 * 60 * 60
+        stale_emote_codes = cast(list[str], redis.zrangebyscore(last_used_key, "-inf", cutoff))
+
+        num_removed = 0
+        for chunk in iterate_in_chunks(stale_emote_codes, ECOUNT_RETENTION_BATCH_SIZE):
+            num_removed += self.redis_remove_stale_emotes(
+                keys=[count_key, last_used_key, epm_record_key], args=[cutoff, self.retention_min_count, *chunk]
+            )
+
+        if num_removed > 0:
+            log.info(f"Removed {num_removed} rarely used emotes that haven't been used in {self.retention_days} days")
@@ -1,12 +1,16 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Optional
+from typing import TYPE_CHECKING, Callable, Optional
 
 import logging
 import socket
 import ssl
+import threading
+import time
+from collections import deque
 
 from pajbot.managers.schedule import ScheduledJob, ScheduleManager
+from pajbot.tmi import SendPriority, TMIRateLimits
 
 from irc.client import InvalidCharacters, MessageTooLong, ServerConnection, ServerNotConnectedError
 from irc.connection import Factory
@@ -16,6 +20,119 @@ if TYPE_CHECKING:
 
 log = logging.getLogger(__name__)
 
+# TMI counts sent messages over a rolling 30 second window, we keep one extra second of margin
+RATE_LIMIT_WINDOW = 31
+
+# Maximum number of messages waiting to be sent.
+# Once it's full, the oldest message from the least important non-empty lane is dropped
+MAX_BACKLOG = 200
+
+# Messages that waited in the queue for longer than this many seconds are dropped instead of sent late
+MAX_MESSAGE_AGE = {
+    SendPriority.MODERATION: 120,
+    SendPriority.COMMAND: 60,
+    SendPriority.TIMER: 300,
+}
+
+
+class QueuedMessage:
+    def __init__(self, raw: str, queued_at: float) -> None:
+        self.raw = raw
+        self.queued_at = queued_at
+
+
+class SendQueue:
+    """
+    Outgoing IRC message queue, paced by a sliding window of the messages sent during the last 30 seconds.
+
+    Messages are sent from the most important lane first (see SendPriority). A message that is identical to
+    one that's already waiting to be sent is dropped.
+    """
+
+    def __init__(self, rate_limits: TMIRateLimits, clock: Callable[[], float] = time.monotonic) -> None:
+        self.rate_limits = rate_limits
+        self.clock = clock
+
+        self.lanes: dict[SendPriority, deque[QueuedMessage]] = {priority: deque() for priority in SendPriority}
+        self.queued: set[str] = set()
+        self.sent_at: deque[float] = deque()
+        self.lock = threading.Lock()
+
+        self.num_coalesced = 0
+        self.num_dropped = 0
+
+    def __len__(self) -> int:
+        return len(self.queued)
+
+    def push(self, raw: str, priority: SendPriority) -> bool:
+        """Queue the raw IRC line. Returns False if the message was dropped or merged into an identical message"""
+        with self.lock:
+            if raw in self.queued:
+                self.num_coalesced += 1
+                return False
+
+            if len(self.queued) >= MAX_BACKLOG:
+                victim_priority = max(p for p, lane in self.lanes.items() if lane)
+                if victim_priority < priority:
+                    # Everything in the queue is more important than the new message
+                    self.num_dropped += 1
+                    log.warning(f"Send queue is full, dropping message: {raw}")
+                    return False
+
+                victim = self.lanes[victim_priority].popleft()
+                self.queued.discard(victim.raw)
+                self.num_dropped += 1
+                log.warning(f"Send queue is full, dropping message: {victim.raw}")
+
+            self.lanes[priority].append(QueuedMessage(raw, self.clock()))
+            self.queued.add(raw)
+            return True
+
+    def _prune_window(self, now: float) -> None:
+        while self.sent_at and self.sent_at[0] <= now - RATE_LIMIT_WINDOW:
+            self.sent_at.popleft()
+
+    def _drop_stale(self, now: float) -> None:
+        for priority, lane in self.lanes.items():
+            max_age = MAX_MESSAGE_AGE[priority]
+            while lane and lane[0].queued_at < now - max_age:
+                message = lane.popleft()
+                self.queued.discard(message.raw)
+                self.num_dropped += 1
+                log.warning(f"Dropping message that waited for more than {max_age} seconds: {message.raw}")
+
+    def pop_sendable(self) -> list[str]:
+        """Take out as many messages as the rate limit allows to be sent right now, and count them as sent"""
+        with self.lock:
+            now = self.clock()
+            self._prune_window(now)
+            self._drop_stale(now)
+
+            budget = self.rate_limits.privmsg_per_30 - len(self.sent_at)
+            messages: list[str] = []
+            for priority in SendPriority:
+                lane = self.lanes[priority]
+                while lane and len(messages) < budget:
+                    message = lane.popleft()
+                    self.queued.discard(message.raw)
+                    messages.append(message.raw)
+                    self.sent_at.append(now)
+
+            return messages
+
+    def time_until_next_send(self) -> Optional[float]:
+        """Returns how many seconds until the next queued message can be sent, or None if the queue is empty"""
+        with self.lock:
+            if not self.queued:
+                return None
+
+            now = self.clock()
+            self._prune_window(now)
+            if len(self.sent_at) < self.rate_limits.privmsg_per_30:
+                return 0.0
+
+            return self.sent_at[0] + RATE_LIMIT_WINDOW - now
+
 
 class Connection(ServerConnection):
     """
@@ -56,7 +173,9 @@ class IRCManager:
         self.conn: Optional[Connection] = None
         self.ping_task: Optional[ScheduledJob] = None
 
-        self.num_privmsg_sent = 0
+        self.send_queue = SendQueue(bot.tmi_rate_limits)
+        self.send_lock = threading.RLock()
+        self.flush_scheduled = False
 
         self.channels: list[str] = [self.bot.channel]
 
@@ -104,33 +223,46 @@ class IRCManager:
         if self.conn is not None:
             self.conn.ping("tmi.twitch.tv")
 
-    def privmsg(self, channel: str, message: str) -> None:
-        if self.conn is None:
-            log.error("Not connected or rate limit was reached. Delaying message a few seconds.")
-            self.bot.execute_delayed(2, self.privmsg, channel, message)
-            return
+    def privmsg(self, channel: str, message: str, priority: SendPriority = SendPriority.COMMAND) -> None:
+        self.send_raw(f"PRIVMSG {channel} :{message}", priority)
+
+    def send_raw(self, message: str, priority: SendPriority = SendPriority.COMMAND) -> None:
+        if not self.send_queue.push(message, priority):
+            log.debug(f"Message was not queued: {message}")
+
+        self._flush_send_queue()
 
-        self.conn.privmsg(channel, message)
+    def _flush_send_queue(self) -> None:
+        with self.send_lock:
+            if self.conn is None:
+                log.error("Not connected. Delaying messages a few seconds.")
+                self._schedule_flush(2)
+                return
 
-        self.num_privmsg_sent += 1
-        self.bot.execute_delayed(31, self._reduce_num_privmsg_sent)
+            for message in self.send_queue.pop_sendable():
+                try:
+                    self.conn.send_raw(message)
+                except (InvalidCharacters, MessageTooLong, ServerNotConnectedError):
+                    log.exception(f"Failed to send message: {message}")
 
-    def send_raw(self, message):
-        if self.conn is None:
-            log.error("Not connected or rate limit was reached. Delaying message a few seconds.")
-            self.bot.execute_delayed(2, self.send_raw, message)
-            return
+            delay = self.send_queue.time_until_next_send()
+            if delay is not None:
+                self._schedule_flush(delay)
 
-        self.conn.send_raw(message)
+    def _schedule_flush(self, delay: float) -> None:
+        # Only one delayed flush is pending at any time, no matter how many messages are queued
+        with self.send_lock:
+            if self.flush_scheduled:
+                return
 
-        self.num_privmsg_sent += 1
-        self.bot.execute_delayed(31, self._reduce_num_privmsg_sent)
+            self.flush_scheduled = True
+            self.bot.execute_delayed(delay, self._scheduled_flush)
 
-    def _can_send(self) -> bool:
-        return self.num_privmsg_sent < self.bot.tmi_rate_limits.privmsg_per_30
+    def _scheduled_flush(self) -> None:
+        with self.send_lock:
+            self.flush_scheduled = False
 
-    def _reduce_num_privmsg_sent(self):
-        self.num_privmsg_sent -= 1
+        self._flush_send_queue()
 
     def _dispatcher(self, conn, event):
         method = getattr(self.bot, "on_" + event.type, None)
@@ -151,3 +283,4 @@ class IRCManager:
     def _on_welcome(self, conn, _event):
         log.info("Successfully connected and authenticated with IRC")
         conn.join(",".join(self.channels))
+        self._flush_send_queue()
@@ -1,14 +1,18 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Optional
+from typing import TYPE_CHECKING, Iterable, Optional, cast
 
 import logging
-from collections import UserDict
+import threading
+from collections import Counter, UserDict
 
+from pajbot.managers.handler import HandlerManager
 from pajbot.managers.redis import RedisManager
+from pajbot.managers.schedule import ScheduleManager
 from pajbot.streamhelper import StreamHelper
 
 import regex as re
+from redis.exceptions import ResponseError
 
 if TYPE_CHECKING:
     from pajbot.managers.redis import RedisType
@@ -17,32 +21,36 @@ if TYPE_CHECKING:
 KVI_ARGUMENT_REGEX = re.compile(r"^([\w_-]+)(?: ([0-9]+))?$")
 KVI_PROHIBITED_KEYS = "active_subs"
 
+# Changes to coalesced counters are written to redis once per second
+KVI_FLUSH_INTERVAL = 1
+
 log = logging.getLogger(__name__)
 
 
 class KVIData:
-    def __init__(self, streamer: str, kvi_id: str) -> None:
+    def __init__(self, streamer: str, kvi_id: str, manager: Optional[KVIManager] = None) -> None:
         self.key = f"{streamer}:kvi"
         self.id = kvi_id
+        # Set if increments & decrements of this counter are coalesced locally
+        self.manager = manager
 
     def set(self, new_value: int, redis: Optional[RedisType] = None) -> None:
         if redis is None:
             redis = RedisManager.get()
 
-        redis.hset(self.key, self.id, new_value)
+        if self.manager is not None:
+            self.manager.discard_pending(self.id)
+
+        redis.hset(self.key, self.id, str(new_value))
 
     def get(self, redis: Optional[RedisType] = None) -> int:
         if redis is None:
             redis = RedisManager.get()
 
-        value: int = 0
+        value = parse_kvi_value(cast(Optional[str], redis.hget(self.key, self.id)))
 
-        try:
-            raw_value = redis.hget(self.key, self.id)
-            if raw_value:
-                value = int(raw_value)
-        except (TypeError, ValueError):
-            value = 0
+        if self.manager is not None:
+            value += self.manager.get_pending(self.id)
 
         return value
 
@@ -50,33 +58,150 @@ class KVIData:
         """
         Increase the value of the given counter by `amount` and return the final result
         """
+        if self.manager is not None:
+            return self.manager.add_pending(self.id, amount)
+
         redis = RedisManager.get()
-        old_value = self.get(redis=redis)
-        new_value = old_value + amount
-        self.set(new_value, redis=redis)
-        return new_value
+        try:
+            return cast(int, redis.hincrby(self.key, self.id, amount))
+        except ResponseError:
+            # The stored value is not an integer, which counts as 0
+            redis.hset(self.key, self.id, str(amount))
+            return amount
 
     def dec(self, amount: int = 1) -> int:
         """
         Decrease the value of the given counter by `amount` and return the final result
         """
-        redis = RedisManager.get()
-        old_value = self.get(redis=redis)
-        new_value = old_value - amount
-        self.set(new_value, redis=redis)
-        return new_value
+        return self.inc(-amount)
 
     def __str__(self) -> str:
         return str(self.get())
 
 
+def parse_kvi_value(raw_value: Optional[str]) -> int:
+    try:
+        if raw_value:
+            return int(raw_value)
+    except (TypeError, ValueError):
+        pass
+
+    return 0
+
+
 class KVIManager(UserDict):
-    def __init__(self) -> None:
+    """
+    Counters stored in a redis hash, changed with atomic HINCRBY so the bot and the web interface never overwrite
+    each other's changes.
+
+    Changes to the counters listed in coalesced_ids are added up in memory and written to redis once per second,
+    for counters that are changed many times per second (e.g. by a command spammed in chat).
+    """
+
+    def __init__(self, coalesced_ids: Iterable[str] = []) -> None:
         self.streamer = StreamHelper.get_streamer()
         super().__init__(self)
 
+        self.coalesced_ids = frozenset(coalesced_ids)
+        # Changes that haven't been written to redis yet
+        self.pending: Counter[str] = Counter()
+        # Changes that are being written to redis right now
+        self.flushing: Counter[str] = Counter()
+        # Value of each coalesced counter as of the last flush, or as read from redis since then.
+        # Dropped on every flush, so changes made by the web interface or other processes show up within a second
+        self.known_values: dict[str, int] = {}
+        self.lock = threading.Lock()
+
+        if self.coalesced_ids:
+            ScheduleManager.execute_every(KVI_FLUSH_INTERVAL, self.flush)
+            HandlerManager.add_handler("on_quit", self.on_quit)
+
     def __getitem__(self, kvi_id: str) -> KVIData:
-        return KVIData(self.streamer, kvi_id)
+        return KVIData(self.streamer, kvi_id, self if kvi_id in self.coalesced_ids else None)
+
+    def get_many(self, kvi_ids: list[str]) -> dict[str, int]:
+        """Returns the values of all given counters, read from redis in one round-trip"""
+        if not kvi_ids:
+            return {}
+
+        raw_values = cast(list[Optional[str]], RedisManager.get().hmget(f"{self.streamer}:kvi", kvi_ids))
+        values = {kvi_id: parse_kvi_value(raw_value) for kvi_id, raw_value in zip(kvi_ids, raw_values)}
+
+        with self.lock:
+            for kvi_id in values:
+                values[kvi_id] += self.pending[kvi_id] + self.flushing[kvi_id]
+
+        return values
+
+    def get_pending(self, kvi_id: str) -> int:
+        with self.lock:
+            return self.pending[kvi_id] + self.flushing[kvi_id]
+
+    def add_pending(self, kvi_id: str, amount: int) -> int:
+        """Queues a change to a coalesced counter, and returns what its value will be once it's written"""
+        with self.lock:
+            known_value = self.known_values.get(kvi_id)
+
+        if known_value is None:
+            known_value = parse_kvi_value(cast(Optional[str], RedisManager.get().hget(f"{self.streamer}:kvi", kvi_id)))
+
+        with self.lock:
+            known_value = self.known_values.setdefault(kvi_id, known_value)
+            self.pending[kvi_id] += amount
+            return known_value + self.pending[kvi_id] + self.flushing[kvi_id]
+
+    def discard_pending(self, kvi_id: str) -> None:
+        # The counter is being set to a new value, which overrides all changes that haven't been written yet
+        with self.lock:
+            self.pending.pop(kvi_id, None)
+            self.known_values.pop(kvi_id, None)
+
+    def flush(self) -> None:
+        with self.lock:
+            self.known_values = {}
+            # Decrements are negative counts, so we can't use Counter's unary + to drop the zero counts
+            pending = Counter({kvi_id: amount for kvi_id, amount in self.pending.items() if amount != 0})
+            self.pending = Counter()
+            if not pending:
+                return
+            self.flushing.update(pending)
+
+        redis = RedisManager.get()
+        redis_key = f"{self.streamer}:kvi"
+        results = None
+        try:
+            with redis.pipeline() as pipeline:
+                for kvi_id, amount in pending.items():
+                    pipeline.hincrby(redis_key, kvi_id, amount)
+                results = pipeline.execute(raise_on_error=False)
+        except:
+            log.exception("Failed to write KVI changes to redis, will retry on next flush")
+
+        new_values: dict[str, int] = {}
+        for kvi_id, result in zip(pending, results or []):
+            if not isinstance(result, Exception):
+                new_values[kvi_id] = result
+                continue
+
+            # The stored value is not an integer, which counts as 0
+            try:
+                redis.hset(redis_key, kvi_id, str(pending[kvi_id]))
+                new_values[kvi_id] = pending[kvi_id]
+            except:
+                log.exception(f"Failed to reset KVI value {kvi_id}")
+
+        with self.lock:
+            self.flushing.subtract(pending)
+            self.flushing = Counter({kvi_id: amount for kvi_id, amount in self.flushing.items() if amount != 0})
+            if results is None:
+                self.pending.update(pending)
+            else:
+                # Changes queued during the flush are still pending, so these values are up to date
+                self.known_values.update(new_values)
+
+    def on_quit(self, **rest) -> bool:
+        self.flush()
+        return True
 
 
 def parse_kvi_arguments(input_str: str) -> tuple[Optional[str], int]:
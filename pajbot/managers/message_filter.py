@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any, Callable, Optional, Protocol
+
+import logging
+from enum import IntEnum
+from functools import cached_property
+
+if TYPE_CHECKING:
+    from pajbot.bot import Bot
+    from pajbot.models.emote import EmoteInstance
+    from pajbot.models.user import User
+
+log = logging.getLogger(__name__)
+
+
+class FilterCost(IntEnum):
+    # Only looks at the message itself, e.g. its length or the characters in it
+    CHEAP = 0
+    # Talks to the database, redis or an external service
+    EXPENSIVE = 1
+
+
+class CharacterStats:
+    def __init__(self, message: str) -> None:
+        lowercase = 0
+        uppercase = 0
+        non_alnum = 0
+        for c in message:
+            if c.islower():
+                lowercase += 1
+            elif c.isupper():
+                uppercase += 1
+            if not c.isalnum():
+                non_alnum += 1
+
+        self.lowercase = lowercase
+        self.uppercase = uppercase
+        self.non_alnum = non_alnum
+
+
+class FilteredMessage:
+    """
+    A chat message that's being checked by the message filters.
+    Everything derived from the message is computed the first time a filter asks for it, and then shared.
+    """
+
+    def __init__(
+        self,
+        source: User,
+        message: str,
+        emote_instances: list[EmoteInstance],
+        urls: list[str],
+        msg_id: Optional[str],
+        whisper: bool,
+    ) -> None:
+        self.source = source
+        self.message = message
+        self.emote_instances = emote_instances
+        self.urls = urls
+        self.msg_id = msg_id
+        self.whisper = whisper
+
+    @cached_property
+    def words(self) -> list[str]:
+        return self.message.split(" ")
+
+    @cached_property
+    def lower(self) -> str:
+        return self.message.lower()
+
+    @cached_property
+    def character_stats(self) -> CharacterStats:
+        return CharacterStats(self.message)
+
+
+class FilterPunishment:
+    """The punishment a message filter wants to apply to the sender of a message"""
+
+    def __init__(self, apply: Callable[[], None], duration: int, permanent: bool = False) -> None:
+        self.apply = apply
+        self.duration = duration
+        self.permanent = permanent
+
+    @staticmethod
+    def delete_or_timeout(
+        bot: Bot,
+        message: FilteredMessage,
+        moderation_action: str,
+        duration: int,
+        reason: Optional[str] = None,
+        disable_warnings: bool = False,
+    ) -> FilterPunishment:
+        """Same arguments as Bot.delete_or_timeout"""
+
+        def apply() -> None:
+            if moderation_action == "Delete" and message.msg_id is None:
+                # Whispers have no message ID, and can't be deleted
+                log.debug(f"Not deleting message without ID from {message.source}")
+                return
+
+            bot.delete_or_timeout(
+                message.source,
+                moderation_action,
+                message.msg_id,
+                duration,
+                reason,
+                disable_warnings=disable_warnings,
+            )
+
+        return FilterPunishment(apply, duration if moderation_action == "Timeout" else 0)
+
+    def greater_than(self, other: FilterPunishment) -> bool:
+        if other.permanent:
+            return False
+
+        if self.permanent:
+            return True
+
+        return self.duration > other.duration
+
+
+class MessageFilter(Protocol):
+    # Cheap filters run first. Expensive filters are skipped once a cheap filter found a violation
+    FILTER_COST: FilterCost
+
+    def filter_message(self, message: FilteredMessage) -> Optional[FilterPunishment]:
+        """
+        Returns the punishment the sender of the message deserves, or None if the message is fine.
+        Must not have side effects, everything that should happen to the user goes into the punishment.
+        """
+        ...
+
+
+class MessageFilterManager:
+    """
+    Runs all enabled message filters against every chat message, and applies the harshest punishment
+    any of them asked for.
+    """
+
+    filters: list[MessageFilter] = []
+
+    @staticmethod
+    def add_filter(message_filter: MessageFilter) -> None:
+        if any(f is message_filter for f in MessageFilterManager.filters):
+            return
+
+        # Rebuilt instead of modified, so a message being filtered keeps iterating over the old list
+        filters = MessageFilterManager.filters + [message_filter]
+        filters.sort(key=lambda f: f.FILTER_COST)
+        MessageFilterManager.filters = filters
+
+    @staticmethod
+    def remove_filter(message_filter: MessageFilter) -> None:
+        MessageFilterManager.filters = [f for f in MessageFilterManager.filters if f is not message_filter]
+
+    @staticmethod
+    def check_message(message: FilteredMessage) -> Optional[FilterPunishment]:
+        punishment: Optional[FilterPunishment] = None
+        for message_filter in MessageFilterManager.filters:
+            if punishment is not None:
+                if punishment.permanent:
+                    # Nothing is harsher than a ban
+                    break
+
+                if message_filter.FILTER_COST >= FilterCost.EXPENSIVE:
+                    break
+
+            try:
+                res = message_filter.filter_message(message)
+            except:
+                log.exception(f"Unhandled exception from message filter {message_filter}")
+                continue
+
+            if res is not None and (punishment is None or res.greater_than(punishment)):
+                punishment = res
+
+        return punishment
+
+    @staticmethod
+    def on_message(
+        source: User,
+        message: str,
+        emote_instances: list[EmoteInstance],
+        urls: list[str],
+        msg_id: Optional[str],
+        whisper: bool,
+        **rest: Any,
+    ) -> bool:
+        if not MessageFilterManager.filters:
+            return True
+
+        punishment = MessageFilterManager.check_message(
+            FilteredMessage(source, message, emote_instances, urls, msg_id, whisper)
+        )
+        if punishment is None:
+            return True
+
+        punishment.apply()
+        return False
@@ -0,0 +1,358 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any, Callable, Optional, Union
+
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from pajbot.apiwrappers.twitch.helix import TwitchHelixAPI
+from pajbot.managers.redis import RedisManager
+from pajbot.models.moderation_action import Ban, ModerationAction, Timeout, Unban, Untimeout, combine_actions
+from pajbot.streamhelper import StreamHelper
+from pajbot.utils import TokenBucket
+
+from requests import HTTPError, Response
+from requests.adapters import HTTPAdapter
+
+if TYPE_CHECKING:
+    from pajbot.bot import Bot
+
+log = logging.getLogger(__name__)
+
+# Helix gives every user access token a bucket of 800 points that refills over one minute
+# https://dev.twitch.tv/docs/api/guide/#twitch-rate-limits
+HELIX_RATE_LIMIT_POINTS = 800
+HELIX_RATE_LIMIT_PERIOD = 60
+
+# Number of concurrent Helix requests (and pooled connections) the moderation worker uses
+WORKER_POOL_SIZE = 4
+
+# A timeout or ban that repeats one we executed less than this many seconds ago is not sent again,
+# unless it escalates the punishment
+RECENT_ACTION_WINDOW = 10
+
+# Number of latency samples kept for the queue metrics
+LATENCY_SAMPLES = 1000
+
+# Published stats expire if the bot stops publishing them, in seconds
+STATS_TTL = 60
+
+
+def get_stats_key() -> str:
+    return f"{StreamHelper.get_streamer()}:moderation_queue:stats"
+
+
+@dataclass
+class DeleteMessage:
+    msg_id: str
+    channel_id: str
+
+
+QueuedAction = Union[ModerationAction, DeleteMessage]
+
+
+class PendingModerationAction:
+    def __init__(
+        self, key: str, action: QueuedAction, login: Optional[str], user_id: Optional[str], queued_at: float
+    ) -> None:
+        self.key = key
+        self.action = action
+        self.login = login
+        self.user_id = user_id
+        self.queued_at = queued_at
+
+    def merge(self, action: QueuedAction) -> None:
+        if isinstance(action, (Unban, Untimeout)) and isinstance(self.action, (Ban, Timeout)):
+            # A later unban/untimeout from another message overrides a punishment that hasn't been sent yet
+            self.action = action
+            return
+
+        if isinstance(action, DeleteMessage) or isinstance(self.action, DeleteMessage):
+            return
+
+        self.action = combine_actions(self.action, action)
+
+
+class RecentModerationAction:
+    def __init__(self, action: ModerationAction, now: float) -> None:
+        self.action = action
+        self.expires_at = now + RECENT_ACTION_WINDOW
+        if isinstance(action, Timeout):
+            self.punishment_ends_at = now + action.duration
+        else:
+            self.punishment_ends_at = float("inf")
+
+    def covers(self, action: ModerationAction, now: float) -> bool:
+        """Returns True if sending the given action again would not change anything"""
+        if now > self.expires_at:
+            return False
+
+        if isinstance(action, Ban):
+            return isinstance(self.action, Ban)
+
+        if isinstance(action, Timeout):
+            return now + action.duration <= self.punishment_ends_at
+
+        return False
+
+
+class ModerationQueue:
+    """
+    Executes bans, timeouts, unbans, untimeouts and message deletions on a dedicated worker, so the IRC
+    thread never waits for a Helix request.
+
+    Actions that are queued for the same user before they are sent are merged, using the same rules as
+    ModerationActions. Timeouts and bans that are already covered by an action we sent a few seconds ago
+    (e.g. the same spammer being timed out for every message of a spam wave) are dropped.
+    Requests are paced by a token bucket that follows the Helix rate limit headers.
+    """
+
+    def __init__(self, bot: Bot, clock: Callable[[], float] = time.monotonic) -> None:
+        self.bot = bot
+        self.clock = clock
+
+        # Our own Helix client, so moderation requests get their own connection pool
+        self.api = TwitchHelixAPI(RedisManager.get(), bot.app_token_manager)
+        self.api.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=WORKER_POOL_SIZE))
+        self.api.session.hooks["response"].append(self._on_response)
+
+        self.bucket = TokenBucket(
+            HELIX_RATE_LIMIT_POINTS, HELIX_RATE_LIMIT_POINTS / HELIX_RATE_LIMIT_PERIOD, clock=clock
+        )
+        self.executor = ThreadPoolExecutor(max_workers=WORKER_POOL_SIZE, thread_name_prefix="ModerationWorker")
+
+        self.pending: OrderedDict[str, PendingModerationAction] = OrderedDict()
+        self.in_flight: set[str] = set()
+        self.recent: dict[str, RecentModerationAction] = {}
+        self.condition = threading.Condition()
+
+        self.num_executed = 0
+        self.num_skipped = 0
+        self.num_failed = 0
+        self.latencies: deque[float] = deque(maxlen=LATENCY_SAMPLES)
+
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="ModerationQueueThread")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def quit(self) -> None:
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+    def add(self, login: str, action: ModerationAction) -> None:
+        self._enqueue(f"login:{login}", action, login=login)
+
+    def add_by_id(self, user_id: str, action: ModerationAction) -> None:
+        self._enqueue(f"id:{user_id}", action, user_id=user_id)
+
+    def delete_message(self, msg_id: str, channel_id: str) -> None:
+        self._enqueue(f"delete:{msg_id}", DeleteMessage(msg_id, channel_id))
+
+    def _enqueue(
+        self, key: str, action: QueuedAction, login: Optional[str] = None, user_id: Optional[str] = None
+    ) -> None:
+        with self.condition:
+            existing = self.pending.get(key)
+            if existing is not None:
+                existing.merge(action)
+                return
+
+            self.pending[key] = PendingModerationAction(key, action, login, user_id, self.clock())
+            self.condition.notify()
+
+    def _pop_next(self) -> Optional[PendingModerationAction]:
+        # Must be called with self.condition held.
+        # Actions for a user that already has a request in flight wait, so they are executed in order
+        for key, item in self.pending.items():
+            if key not in self.in_flight:
+                del self.pending[key]
+                self.in_flight.add(key)
+                return item
+
+        return None
+
+    def _run(self) -> None:
+        while True:
+            with self.condition:
+                item = self._pop_next()
+                while item is None and self.running:
+                    self.condition.wait()
+                    item = self._pop_next()
+
+                if item is None:
+                    return
+
+            # Only the dispatcher waits for the rate limit, never the caller
+            self.bucket.acquire()
+            self.executor.submit(self._execute, item)
+
+    def _on_response(self, response: Response, *args: Any, **kwargs: Any) -> None:
+        # The GET requests in here (user lookups & banned user status) don't use the bot's token,
+        # so only the moderation requests themselves tell us about the bucket we are pacing
+        if response.request.method not in ("POST", "DELETE"):
+            return
+
+        remaining = response.headers.get("Ratelimit-Remaining")
+        if remaining is None:
+            return
+
+        try:
+            self.bucket.limit(int(remaining))
+        except ValueError:
+            log.warning(f"Bad Ratelimit-Remaining header from Helix: {remaining}")
+
+    def _execute(self, item: PendingModerationAction) -> None:
+        outcome = "failed"
+        try:
+            outcome = self._execute_item(item)
+        except:
+            log.exception(f"Unhandled exception while executing moderation action {item.action}")
+        finally:
+            with self.condition:
+                self.in_flight.discard(item.key)
+                self.latencies.append(self.clock() - item.queued_at)
+                if outcome == "executed":
+                    self.num_executed += 1
+                elif outcome == "skipped":
+                    self.num_skipped += 1
+                else:
+                    self.num_failed += 1
+                self.condition.notify()
+
+    def _execute_item(self, item: PendingModerationAction) -> str:
+        if isinstance(item.action, DeleteMessage):
+            return "executed" if self._delete_message(item.action) else "failed"
+
+        user_id = item.user_id
+        if user_id is None:
+            assert item.login is not None
+            user_id = self.api.get_user_id(item.login)
+            if user_id is None:
+                log.error(f"Attempted to moderate user with login {item.login}, but no such user was found")
+                return "failed"
+
+        with self.condition:
+            recent = self.recent.get(user_id)
+        if recent is not None and recent.covers(item.action, self.clock()):
+            log.debug(f"Skipping {item.action} for user with id {user_id}, already covered by {recent.action}")
+            return "skipped"
+
+        return "executed" if self._execute_action(user_id, item.action) else "failed"
+
+    def _execute_action(self, user_id: str, action: ModerationAction) -> bool:
+        bot = self.bot
+
+        if isinstance(action, Untimeout):
+            if not self._can_untimeout(user_id):
+                return False
+
+        try:
+            if isinstance(action, Ban):
+                self.api.ban_user(bot.streamer.id, bot.bot_user.id, bot.bot_token_manager, user_id, action.reason)
+            elif isinstance(action, Timeout):
+                self.api.timeout_user(
+                    bot.streamer.id, bot.bot_user.id, bot.bot_token_manager, user_id, action.duration, action.reason
+                )
+            else:
+                self.api.unban_user(bot.streamer.id, bot.bot_user.id, user_id, bot.bot_token_manager)
+        except HTTPError as e:
+            if e.response is None:
+                raise e
+
+            description = type(action).__name__.lower()
+            if e.response.status_code == 401:
+                log.error(f"Failed to {description} user with id {user_id}, unauthorized: {e} - {e.response.text}")
+            else:
+                log.error(f"Failed to {description} user with id {user_id}: {e} - {e.response.text}")
+            return False
+
+        with self.condition:
+            if isinstance(action, (Ban, Timeout)):
+                self.recent[user_id] = RecentModerationAction(action, self.clock())
+            else:
+                self.recent.pop(user_id, None)
+
+            self._prune_recent()
+
+        return True
+
+    def _can_untimeout(self, user_id: str) -> bool:
+        bot = self.bot
+
+        try:
+            ban_data = self.api.get_banned_user(bot.streamer.id, bot.streamer_access_token_manager, user_id)
+        except HTTPError as e:
+            if e.response is None:
+                raise e
+
+            if e.response.status_code == 401:
+                log.error(f"Failed to get banned user status with id {user_id}, unauthorized: {e} - {e.response.text}")
+            else:
+                log.error(f"Failed to get banned user status with id {user_id}: {e} - {e.response.text}")
+            return False
+
+        if ban_data is None:
+            log.warning(f"User with ID {user_id} is already not banned or timed-out.")
+            return False
+
+        # As per the Helix docs, expires_at will return empty if the user is permabanned.
+        if not ban_data.expires_at:
+            log.error(f"User with ID {user_id} is currently banned! Will not untimeout.")
+            return False
+
+        return True
+
+    def _delete_message(self, action: DeleteMessage) -> bool:
+        bot = self.bot
+
+        try:
+            self.api.delete_single_message(action.channel_id, bot.bot_user.id, bot.bot_token_manager, action.msg_id)
+            return True
+        except HTTPError as e:
+            if e.response is None:
+                raise e
+
+            if e.response.status_code == 401:
+                log.error(f"Failed to delete message, unauthorized: {e} - {e.response.text}")
+                bot.execute_now(bot.send_message, "Error: The bot must be re-authed in order to delete a message.")
+            elif e.response.status_code == 403:
+                log.error(f"Failed to delete message - bot is not a moderator: {e} - {e.response.text}")
+            else:
+                log.error(f"Failed to delete message: {e} - {e.response.text}")
+            return False
+
+    def _prune_recent(self) -> None:
+        # Must be called with self.condition held
+        now = self.clock()
+        for user_id in [user_id for user_id, recent in self.recent.items() if recent.expires_at < now]:
+            self.recent.pop(user_id, None)
+
+    def jsonify(self) -> dict[str, Any]:
+        with self.condition:
+            latencies = sorted(self.latencies)
+            queue_depth = len(self.pending)
+            in_flight = len(self.in_flight)
+
+        return {
+            "queue_depth": queue_depth,
+            "in_flight": in_flight,
+            "executed": self.num_executed,
+            "skipped": self.num_skipped,
+            "failed": self.num_failed,
+            "rate_limit_tokens": int(self.bucket.available),
+            "latency_avg_ms": sum(latencies) / len(latencies) * 1000.0 if latencies else 0.0,
+            "latency_p95_ms": latencies[int(len(latencies) * 0.95)] * 1000.0 if latencies else 0.0,
+            "latency_max_ms": latencies[-1] * 1000.0 if latencies else 0.0,
+        }
+
+    def publish_stats(self) -> None:
+        """Makes the stats available to the web interface"""
+        data = {"published_at": time.time(), **self.jsonify()}
+        RedisManager.get().set(get_stats_key(), json.dumps(data), ex=STATS_TTL)
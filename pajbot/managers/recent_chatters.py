@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+from typing import Callable, Iterable, Optional
+
+import datetime
+import logging
+import threading
+import time
+
+from pajbot.managers.db import DBManager
+from pajbot.models.user import User, UserBasics
+
+log = logging.getLogger(__name__)
+
+# Users that haven't been seen in chat for this long are no longer considered recent chatters
+RECENT_CHATTER_MAX_AGE = datetime.timedelta(weeks=2)
+
+# How often users that have aged out are removed from the index, in seconds
+PRUNE_INTERVAL = 60 * 60
+
+
+class RecentChattersIndex:
+    """
+    In-memory index of the users that have been seen in chat recently, keyed by their lowercase login and
+    display name. It is seeded from the database when the bot starts, kept up to date from chat messages and
+    the chatters list, and pruned every hour.
+    """
+
+    def __init__(
+        self, max_age: datetime.timedelta = RECENT_CHATTER_MAX_AGE, clock: Callable[[], float] = time.time
+    ) -> None:
+        self.max_age = max_age.total_seconds()
+        self.clock = clock
+
+        # lowercase login or display name -> user ID
+        self.user_ids: dict[str, str] = {}
+        # user ID -> (names of the user in user_ids, unix timestamp of when the user was last seen)
+        self.users: dict[str, tuple[tuple[str, ...], float]] = {}
+
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    def load(self) -> None:
+        """Seeds the index with the recently seen users from the database"""
+        cutoff = datetime.datetime.fromtimestamp(self.clock() - self.max_age, tz=datetime.timezone.utc)
+        with DBManager.create_session_scope() as db_session:
+            rows = (
+                db_session.query(User)
+                .with_entities(User.id, User._login, User.name, User.last_seen)
+                .filter(User.last_seen >= cutoff)
+                .all()
+            )
+
+        with self.lock:
+            for user_id, login, name, last_seen in rows:
+                self._add(user_id, login, name, last_seen.timestamp())
+
+        log.info(f"Loaded {len(rows)} recent chatters")
+
+    def add(self, user_id: str, login: str, name: str, last_seen: Optional[float] = None) -> None:
+        if last_seen is None:
+            last_seen = self.clock()
+
+        with self.lock:
+            self._add(user_id, login, name, last_seen)
+
+    def add_many(self, users: Iterable[UserBasics], last_seen: Optional[float] = None) -> None:
+        if last_seen is None:
+            last_seen = self.clock()
+
+        with self.lock:
+            for user in users:
+                self._add(user.id, user.login, user.name, last_seen)
+
+    def _add(self, user_id: str, login: str, name: str, last_seen: float) -> None:
+        # Must be called with self.lock held
+        names = (login,) if name.lower() == login else (login, name.lower())
+
+        existing = self.users.get(user_id)
+        if existing is not None:
+            old_names, old_last_seen = existing
+            last_seen = max(last_seen, old_last_seen)
+            if old_names != names:
+                # The user renamed themselves
+                self._remove_names(user_id, old_names)
+
+        self.users[user_id] = (names, last_seen)
+        for user_name in names:
+            self.user_ids[user_name] = user_id
+
+    def _remove_names(self, user_id: str, names: tuple[str, ...]) -> None:
+        # Must be called with self.lock held
+        for user_name in names:
+            if self.user_ids.get(user_name) == user_id:
+                del self.user_ids[user_name]
+
+    def count_known_users(self, usernames: Iterable[str]) -> int:
+        """Returns how many distinct recent chatters the given lowercase logins or display names refer to"""
+        cutoff = self.clock() - self.max_age
+        with self.lock:
+            user_ids = {self.user_ids[username] for username in usernames if username in self.user_ids}
+            return sum(1 for user_id in user_ids if self.users[user_id][1] >= cutoff)
+
+    def prune(self) -> None:
+        cutoff = self.clock() - self.max_age
+        with self.lock:
+            expired = [user_id for user_id, (_, last_seen) in self.users.items() if last_seen < cutoff]
+            for user_id in expired:
+                names, _ = self.users.pop(user_id)
+                self._remove_names(user_id, names)
+
+        if expired:
+            log.debug(f"Pruned {len(expired)} chatters that haven't been seen recently")
@@ -1,55 +1,410 @@
-from typing import Any, Callable, Iterable, Mapping, Optional
+from __future__ import annotations
+
+from typing import Any, Callable, Iterable, Mapping, Optional, Union
 
 import datetime
+import functools
 import logging
+import math
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-from pajbot import utils
+log = logging.getLogger(__name__)
 
-from apscheduler.job import Job
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.schedulers.base import BaseScheduler
+# Length of one tick of the timing wheel, in seconds. Jobs are handed to their executor at most one tick after they're due
+TICK_LENGTH = 0.05
 
-log = logging.getLogger(__name__)
+# Every level of the timing wheel has 2**WHEEL_BITS slots. With 4 levels of 64 ticks of 50ms, jobs up to ~9.7 days
+# away are placed on the wheel directly, jobs further away wait in an overflow list
+WHEEL_BITS = 6
+WHEEL_LEVELS = 4
+
+# Number of threads running jobs on the "io" and "cpu" executors
+IO_WORKERS = 10
+CPU_WORKERS = min(4, os.cpu_count() or 1)
+
+# Jobs on the reactor executor that run for longer than this hold up chat, and are logged (in seconds)
+SLOW_REACTOR_JOB_THRESHOLD = 1.0
+
+# Jobs that start this much later than they were due are logged, it means their executor can't keep up (in seconds)
+LAG_WARNING_THRESHOLD = 5.0
+
+ExecutorSubmit = Callable[[Callable[[], None]], Any]
+
+
+def seconds_until(when: Union[float, datetime.datetime]) -> float:
+    """Returns the number of seconds until the given datetime or unix timestamp"""
+    if isinstance(when, datetime.datetime):
+        return (when - datetime.datetime.now(when.tzinfo)).total_seconds()
+
+    return when - time.time()
+
+
+class TimingWheel:
+    """
+    Hierarchical timing wheel of items that become due at a given tick.
+    Adding an item and collecting the items that became due take constant time per item, no matter how many items
+    are waiting. Items that are due more than one rotation of a level away wait on the next, coarser level, and move
+    down a level each time the level above them turns over.
+    """
+
+    def __init__(self, bits: int = WHEEL_BITS, num_levels: int = WHEEL_LEVELS) -> None:
+        self.bits = bits
+        self.mask = (1 << bits) - 1
+        self.num_levels = num_levels
+
+        # levels[level][slot] = [(due tick, item)]
+        self.levels: list[list[list[tuple[int, Any]]]] = [[[] for _ in range(1 << bits)] for _ in range(num_levels)]
+        # Items that are due further away than the top level reaches
+        self.overflow: list[tuple[int, Any]] = []
+
+        self.current_tick = 0
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def add(self, item: Any, due_tick: int) -> None:
+        # Items that are already due become due on the next tick
+        self._place(max(due_tick, self.current_tick + 1), item)
+        self.size += 1
+
+    def _place(self, due_tick: int, item: Any) -> None:
+        delta = due_tick - self.current_tick
+        for level in range(self.num_levels):
+            if delta < 1 << (self.bits * (level + 1)):
+                self.levels[level][(due_tick >> (self.bits * level)) & self.mask].append((due_tick, item))
+                return
+
+        self.overflow.append((due_tick, item))
+
+    def advance(self, to_tick: int) -> list[Any]:
+        """Moves the wheel forward to the given tick, and returns the items that became due on the way, in order"""
+        due: list[Any] = []
+        while self.current_tick < to_tick:
+            self.current_tick += 1
+            tick = self.current_tick
+
+            # Find the highest level that turned over on this tick
+            level = 0
+            while level < self.num_levels and tick & ((1 << (self.bits * (level + 1))) - 1) == 0:
+                level += 1
+
+            if level == self.num_levels:
+                overflow, self.overflow = self.overflow, []
+                for due_tick, item in overflow:
+                    self._place(due_tick, item)
+                level -= 1
+
+            # Move the items of the current slot of each level that turned over down a level, highest level first
+            for cascade_level in range(level, 0, -1):
+                slot_index = (tick >> (self.bits * cascade_level)) & self.mask
+                slot = self.levels[cascade_level][slot_index]
+                if slot:
+                    self.levels[cascade_level][slot_index] = []
+                    for due_tick, item in slot:
+                        self._place(due_tick, item)
+
+            slot_index = tick & self.mask
+            slot = self.levels[0][slot_index]
+            if slot:
+                self.levels[0][slot_index] = []
+                self.size -= len(slot)
+                due.extend(item for _, item in slot)
+
+        return due
+
+
+class JobStats:
+    """How late, and for how long, the jobs with the same name ran"""
+
+    def __init__(self) -> None:
+        self.runs = 0
+        self.failures = 0
+        # Runs of a periodic job that were skipped because its previous run hadn't finished yet
+        self.skipped = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+        self.total_run_time = 0.0
+        self.max_run_time = 0.0
+
+    def record(self, lag: float, run_time: float, failed: bool) -> None:
+        self.runs += 1
+        if failed:
+            self.failures += 1
+        self.total_lag += lag
+        self.max_lag = max(self.max_lag, lag)
+        self.total_run_time += run_time
+        self.max_run_time = max(self.max_run_time, run_time)
+
+    def jsonify(self) -> dict[str, Any]:
+        return {
+            "runs": self.runs,
+            "failures": self.failures,
+            "skipped": self.skipped,
+            "avg_lag": self.total_lag / self.runs if self.runs else 0.0,
+            "max_lag": self.max_lag,
+            "avg_run_time": self.total_run_time / self.runs if self.runs else 0.0,
+            "max_run_time": self.max_run_time,
+        }
 
 
 class ScheduledJob:
-    def __init__(self, job: Job) -> None:
-        self.job = job
+    def __init__(
+        self,
+        scheduler: Scheduler,
+        function: Callable[..., Any],
+        args: Iterable[Any],
+        kwargs: Mapping[str, Any],
+        executor: str,
+        due_at: float,
+        interval: Optional[float],
+        jitter: Optional[float],
+        name: str,
+    ) -> None:
+        self.scheduler = scheduler
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.executor = executor
+        self.interval = interval
+        self.jitter = jitter
+        self.name = name
+
+        # When the job is due next, scheduled_at is the same time without jitter
+        self.scheduled_at = due_at
+        self.due_at = due_at
+
+        self.cancelled = False
+        self.paused = False
+        self.running = False
+        # Set when a one-off job became due while it was paused, it then runs as soon as it's resumed
+        self.missed = False
 
     def pause(self) -> None:
-        self.job.pause()
+        self.paused = True
 
     def resume(self) -> None:
-        self.job.resume()
+        self.scheduler.resume_job(self)
+
+    def cancel(self) -> None:
+        self.cancelled = True
 
     def remove(self) -> None:
-        self.job.remove()
+        self.cancel()
+
+
+class Scheduler:
+    """
+    Runs functions after a delay, or every interval, on one of these executors:
+     - "reactor": The bot's main thread, which also handles chat. Only for quick jobs
+     - "io": A thread pool for jobs that wait on the network or the database
+     - "cpu": A small thread pool for jobs that need a lot of computation
+
+    One thread advances a hierarchical timing wheel every tick, and hands the jobs that became due to their executor.
+    Jobs are cancelled lazily, they're dropped when they become due.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic, tick_length: float = TICK_LENGTH) -> None:
+        self.clock = clock
+        self.tick_length = tick_length
+        self.start_time = clock()
+
+        self.wheel = TimingWheel()
+        self.lock = threading.Lock()
+
+        # Jobs waiting to be run by the reactor thread, see run_reactor_jobs
+        self.reactor_jobs: deque[Callable[[], None]] = deque()
+        # Thread pools don't start any threads until something is submitted to them
+        self.pools = {
+            "io": ThreadPoolExecutor(IO_WORKERS, thread_name_prefix="scheduler-io"),
+            "cpu": ThreadPoolExecutor(CPU_WORKERS, thread_name_prefix="scheduler-cpu"),
+        }
+        self.executors: dict[str, ExecutorSubmit] = {"reactor": self.reactor_jobs.append}
+        for executor_name, pool in self.pools.items():
+            self.executors[executor_name] = pool.submit
+
+        self.stats: dict[str, JobStats] = {}
+
+        self.thread: Optional[threading.Thread] = None
+        self.stopped = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self._run_forever, name="Scheduler", daemon=True)
+        self.thread.start()
+
+    def shutdown(self) -> None:
+        self.stopped.set()
+        for pool in self.pools.values():
+            pool.shutdown(wait=False)
+
+    def add_executor(self, name: str, submit: ExecutorSubmit) -> None:
+        self.executors[name] = submit
+
+    def add_job(
+        self,
+        function: Callable[..., Any],
+        args: Optional[Iterable[Any]] = None,
+        kwargs: Optional[Mapping[str, Any]] = None,
+        delay: float = 0.0,
+        interval: Optional[float] = None,
+        jitter: Optional[float] = None,
+        executor: str = "io",
+        name: Optional[str] = None,
+    ) -> ScheduledJob:
+        """
+        Runs the function after delay seconds, and then every interval seconds if an interval is given.
+        Every run of a periodic job is delayed by a random amount of up to jitter seconds.
+        """
+
+        if name is None:
+            name = getattr(function, "__qualname__", repr(function))
+
+        due_at = self.clock() + max(delay, 0.0)
+        job = ScheduledJob(self, function, args or (), kwargs or {}, executor, due_at, interval, jitter, name)
+        if jitter:
+            job.due_at += random.uniform(0, jitter)
+
+        with self.lock:
+            self.wheel.add(job, self._tick_for(job.due_at))
+
+        return job
+
+    def resume_job(self, job: ScheduledJob) -> None:
+        job.paused = False
+        if job.missed and not job.cancelled:
+            job.missed = False
+            with self.lock:
+                self.wheel.add(job, self._tick_for(self.clock()))
+
+    def _tick_for(self, when: float) -> int:
+        return math.ceil((when - self.start_time) / self.tick_length)
+
+    def run_due(self) -> None:
+        """Hands the jobs that are due to their executors"""
+        now = self.clock()
+        with self.lock:
+            for job in self.wheel.advance(int((now - self.start_time) / self.tick_length)):
+                self._dispatch(job, now)
+
+    def run_reactor_jobs(self) -> None:
+        # Only runs the jobs that were queued when we started, so jobs that queue more jobs can't hold up the reactor
+        for _ in range(len(self.reactor_jobs)):
+            self.reactor_jobs.popleft()()
+
+    def _run_forever(self) -> None:
+        while not self.stopped.is_set():
+            try:
+                self.run_due()
+            except:
+                log.exception("Unhandled exception in the scheduler")
+
+            next_tick_at = self.start_time + (self.wheel.current_tick + 1) * self.tick_length
+            self.stopped.wait(max(0.0, next_tick_at - self.clock()))
+
+    def _dispatch(self, job: ScheduledJob, now: float) -> None:
+        # Must be called with self.lock held
+        if job.cancelled:
+            return
+
+        due_at = job.due_at
+        if job.interval is not None:
+            job.scheduled_at += job.interval
+            if job.scheduled_at <= now:
+                # We fell behind, skip the runs we missed instead of running them all at once
+                job.scheduled_at = now + job.interval
+            job.due_at = job.scheduled_at
+            if job.jitter:
+                job.due_at += random.uniform(0, job.jitter)
+            self.wheel.add(job, self._tick_for(job.due_at))
+
+        if job.paused:
+            if job.interval is None:
+                job.missed = True
+            return
+
+        if job.running:
+            # The previous run of this periodic job hasn't finished yet
+            self._get_stats(job.name).skipped += 1
+            return
+
+        submit = self.executors.get(job.executor)
+        if submit is None:
+            log.error(f"Scheduled job {job.name} uses unknown executor {job.executor}")
+            return
+
+        job.running = True
+        try:
+            submit(functools.partial(self._run, job, due_at))
+        except:
+            job.running = False
+            log.exception(f"Failed to submit scheduled job {job.name} to the {job.executor} executor")
+
+    def _run(self, job: ScheduledJob, due_at: float) -> None:
+        started_at = self.clock()
+        failed = False
+        try:
+            job.function(*job.args, **job.kwargs)
+        except Exception:
+            # We do "except Exception" to not catch KeyboardInterrupt and SystemExit (so the bot can properly quit)
+            failed = True
+            log.exception(f"Logging an uncaught exception (scheduled job {job.name})")
+        finally:
+            job.running = False
+
+        run_time = self.clock() - started_at
+        lag = max(0.0, started_at - due_at)
+        with self.lock:
+            self._get_stats(job.name).record(lag, run_time, failed)
+
+        if lag > LAG_WARNING_THRESHOLD:
+            log.warning(f"Scheduled job {job.name} started {lag:.1f}s late, the {job.executor} executor can't keep up")
+        if job.executor == "reactor" and run_time > SLOW_REACTOR_JOB_THRESHOLD:
+            log.warning(f"Scheduled job {job.name} held up the reactor thread for {run_time:.1f}s")
+
+    def _get_stats(self, name: str) -> JobStats:
+        # Must be called with self.lock held
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = JobStats()
+        return stats
+
+    def get_stats(self) -> dict[str, dict[str, Any]]:
+        with self.lock:
+            return {name: stats.jsonify() for name, stats in self.stats.items()}
 
 
 class ScheduleManager:
-    base_scheduler = BackgroundScheduler(daemon=True)
+    scheduler = Scheduler()
 
     @staticmethod
     def init() -> None:
-        if ScheduleManager.base_scheduler.running:
+        if ScheduleManager.scheduler.running:
             log.warning("ScheduleManager had its init function called twice!!!!")
             return
 
-        print(type(ScheduleManager.base_scheduler))
-        ScheduleManager.base_scheduler.start()
+        ScheduleManager.scheduler.start()
+
+    @staticmethod
+    def shutdown() -> None:
+        ScheduleManager.scheduler.shutdown()
 
     @staticmethod
     def execute_now(
         method: Callable[..., Any],
         args: Optional[Iterable[Any]] = None,
         kwargs: Optional[Mapping[str, Any]] = None,
-        scheduler: Optional[BaseScheduler] = None,
+        executor: str = "io",
     ) -> ScheduledJob:
-        if scheduler is None:
-            scheduler = ScheduleManager.base_scheduler
-
-        job = scheduler.add_job(method, "date", run_date=utils.now(), args=args, kwargs=kwargs)
-        return ScheduledJob(job)
+        return ScheduleManager.scheduler.add_job(method, args, kwargs, executor=executor)
 
     @staticmethod
     def execute_delayed(
@@ -57,15 +412,9 @@ class ScheduleManager:
         method: Callable[..., Any],
         args: Optional[Iterable[Any]] = None,
         kwargs: Optional[Mapping[str, Any]] = None,
-        scheduler: Optional[BaseScheduler] = None,
+        executor: str = "io",
     ) -> ScheduledJob:
-        if scheduler is None:
-            scheduler = ScheduleManager.base_scheduler
-
-        job = scheduler.add_job(
-            method, "date", run_date=utils.now() + datetime.timedelta(seconds=delay), args=args, kwargs=kwargs
-        )
-        return ScheduledJob(job)
+        return ScheduleManager.scheduler.add_job(method, args, kwargs, delay=delay, executor=executor)
 
     @staticmethod
     def execute_every(
@@ -73,11 +422,9 @@ class ScheduleManager:
         method: Callable[..., Any],
         args: Optional[Iterable[Any]] = None,
         kwargs: Optional[Mapping[str, Any]] = None,
-        scheduler: Optional[BaseScheduler] = None,
+        executor: str = "io",
         jitter: Optional[float] = None,
     ) -> ScheduledJob:
-        if scheduler is None:
-            scheduler = ScheduleManager.base_scheduler
-
-        job = scheduler.add_job(method, "interval", seconds=interval, args=args, kwargs=kwargs, jitter=jitter)
-        return ScheduledJob(job)
+        return ScheduleManager.scheduler.add_job(
+            method, args, kwargs, delay=interval, interval=interval, jitter=jitter, executor=executor
+        )
@@ -0,0 +1,222 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Callable, Optional, cast
+
+import cgi
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+if TYPE_CHECKING:
+    from pajbot.managers.redis import RedisType
+
+log = logging.getLogger(__name__)
+
+# (connect, read) timeouts in seconds for every urlfetch request
+URLFETCH_TIMEOUT = (3.05, 10)
+
+# Maximum number of requests to the same host that can be in flight at once
+MAX_REQUESTS_PER_HOST = 4
+
+# Number of responses kept in the in-memory cache
+MEMORY_CACHE_SIZE = 256
+
+# Only this many characters of a response are ever used in a chat message
+MAX_VALUE_LENGTH = 400
+
+
+class URLFetchError(Exception):
+    pass
+
+
+class URLFetcher:
+    """
+    Fetches the URLs of $(urlfetch ...) substitutions.
+
+    All requests share one connection pool and have strict timeouts. Successful responses are cached in memory
+    and in redis together with when they were fetched, so every caller can decide how old a response it accepts.
+    Identical requests that are made while one is already in flight wait for its result instead of making their own,
+    and only a few requests to the same host can run at the same time.
+    """
+
+    def __init__(
+        self,
+        user_agent: str,
+        default_cache_ttl: int,
+        redis: Optional[RedisType] = None,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.default_cache_ttl = default_cache_ttl
+        self.redis = redis
+        # Wall clock time, the fetch times in redis are shared between processes
+        self.clock = clock
+
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_maxsize=MAX_REQUESTS_PER_HOST))
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=MAX_REQUESTS_PER_HOST))
+        self.session.headers.update(
+            {
+                "Accept": "text/plain",
+                "Accept-Language": "en-US, en;q=0.9, *;q=0.5",
+                "User-Agent": user_agent,
+            }
+        )
+
+        # URL -> (fetched at, value)
+        self.cache: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self.in_flight: dict[str, Future[str]] = {}
+        self.host_limits: dict[str, threading.BoundedSemaphore] = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def redis_key(url: str) -> str:
+        return f"urlfetch:{hashlib.sha1(url.encode('utf-8')).hexdigest()}"
+
+    def fetch(self, url: str, cache_ttl: Optional[int] = None) -> str:
+        """
+        Returns the value that replaces a $(urlfetch ...) substitution for the given URL.
+        cache_ttl overrides the default cache duration (in seconds): cached responses that were fetched longer than
+        cache_ttl seconds ago are not used. 0 disables caching.
+        Raises URLFetchError if the request failed.
+        """
+
+        if cache_ttl is None:
+            cache_ttl = self.default_cache_ttl
+
+        if cache_ttl > 0:
+            value = self._get_cached(url, cache_ttl)
+            if value is not None:
+                return value
+
+        with self.lock:
+            future = self.in_flight.get(url)
+            is_owner = future is None
+            if future is None:
+                future = self.in_flight[url] = Future()
+
+        if not is_owner:
+            # Someone else is already fetching this URL
+            return future.result()
+
+        try:
+            value, cacheable = self._fetch(url)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(value)
+            if cacheable and cache_ttl > 0:
+                self._set_cached(url, value, cache_ttl)
+            return value
+        finally:
+            with self.lock:
+                self.in_flight.pop(url, None)
+
+    def _get_cached(self, url: str, cache_ttl: int) -> Optional[str]:
+        now = self.clock()
+        with self.lock:
+            entry = self.cache.get(url)
+            if entry is not None:
+                fetched_at, value = entry
+                if now - fetched_at <= cache_ttl:
+                    self.cache.move_to_end(url)
+                    return value
+
+        # Another process might have fetched the URL more recently
+        if self.redis is None:
+            return None
+
+        try:
+            cached_entry = cast(Optional[str], self.redis.get(self.redis_key(url)))
+        except:
+            log.exception("Failed to read urlfetch cache from redis")
+            return None
+
+        if cached_entry is None:
+            return None
+
+        try:
+            data = json.loads(cached_entry)
+            fetched_at = float(data["fetched_at"])
+            value = str(data["value"])
+        except (ValueError, TypeError, KeyError):
+            return None
+
+        self._store_in_memory(url, fetched_at, value)
+        if now - fetched_at > cache_ttl:
+            return None
+
+        return value
+
+    def _set_cached(self, url: str, value: str, cache_ttl: int) -> None:
+        fetched_at = self.clock()
+        self._store_in_memory(url, fetched_at, value)
+
+        if self.redis is None:
+            return
+
+        try:
+            self.redis.setex(
+                self.redis_key(url),
+                cache_ttl,
+                json.dumps({"fetched_at": fetched_at, "value": value}, separators=(",", ":")),
+            )
+        except:
+            log.exception("Failed to write urlfetch cache to redis")
+
+    def _store_in_memory(self, url: str, fetched_at: float, value: str) -> None:
+        with self.lock:
+            entry = self.cache.get(url)
+            if entry is not None and entry[0] > fetched_at:
+                # We already have a newer response
+                return
+
+            self.cache[url] = (fetched_at, value)
+            self.cache.move_to_end(url)
+            while len(self.cache) > MEMORY_CACHE_SIZE:
+                self.cache.popitem(last=False)
+
+    def _get_host_limit(self, url: str) -> threading.BoundedSemaphore:
+        host = urlparse(url).hostname or ""
+        with self.lock:
+            host_limit = self.host_limits.get(host)
+            if host_limit is None:
+                host_limit = self.host_limits[host] = threading.BoundedSemaphore(MAX_REQUESTS_PER_HOST)
+            return host_limit
+
+    def _fetch(self, url: str) -> tuple[str, bool]:
+        """Returns the value for the given URL, and whether it can be cached"""
+        host_limit = self._get_host_limit(url)
+        if not host_limit.acquire(timeout=sum(URLFETCH_TIMEOUT)):
+            raise URLFetchError(f"Too many requests to the host of {url} in flight")
+
+        try:
+            r = self.session.get(url, allow_redirects=True, timeout=URLFETCH_TIMEOUT)
+        except requests.RequestException as e:
+            raise URLFetchError(f"Failed to fetch {url}: {e}") from e
+        finally:
+            host_limit.release()
+
+        if r.status_code == requests.codes.ok:
+            # For "legacy" reasons, we don't check the content type of ok status codes
+            return self.clean_up_value(r.text), True
+
+        # An error code was returned, ensure the response is plain text
+        content_type = r.headers.get("Content-Type", None)
+        if content_type is not None and cgi.parse_header(content_type)[0] != "text/plain":
+            # The content type is not plain text, return a generic error showing the status code returned
+            return f"urlfetch error {r.status_code}", False
+
+        return self.clean_up_value(r.text), False
+
+    @staticmethod
+    def clean_up_value(text: str) -> str:
+        return text.strip().replace("\n", "").replace("\r", "")[:MAX_VALUE_LENGTH]
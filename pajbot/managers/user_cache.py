@@ -0,0 +1,329 @@
+from __future__ import annotations
+
+from typing import Any, Iterator, Optional
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import pajbot.config as cfg
+from pajbot.managers.db import DBManager
+from pajbot.models.sock import SocketClientManager
+from pajbot.models.user import User, UserBasics
+
+from sqlalchemy import event, inspect, text
+from sqlalchemy.orm import Session, make_transient_to_detached, object_session
+from sqlalchemy.orm.attributes import set_committed_value
+
+log = logging.getLogger(__name__)
+
+# These columns are never served from the cache. When a cached user is attached to a session, they are
+# left expired, so the first access inside the message processing transaction loads them straight from the database.
+UNCACHED_COLUMNS = frozenset(["points", "tokens"])
+
+# These columns are bumped on every chat message. Changes to them are moved out of the session before it commits,
+# and are written to the database in batches by UserCache.commit
+WRITE_BEHIND_COLUMNS = ("last_seen", "last_active", "num_lines")
+
+# Session.info key under which publish_user_updates remembers the users changed in a transaction
+UPDATED_USER_IDS_KEY = "updated_user_ids"
+
+
+class UserCacheEntry:
+    def __init__(self, values: dict[str, Any]) -> None:
+        self.values = values
+        self.loaded_at = time.monotonic()
+
+
+class PendingUserWrite:
+    def __init__(self, basics: UserBasics) -> None:
+        self.id = basics.id
+        self.login = basics.login
+        self.name = basics.name
+        self.last_seen: Optional[Any] = None
+        self.last_active: Optional[Any] = None
+        self.add_num_lines = 0
+
+    def jsonify(self) -> dict[str, Any]:
+        return {
+            "id": self.id,
+            "login": self.login,
+            "name": self.name,
+            "last_seen": self.last_seen,
+            "last_active": self.last_active,
+            "add_num_lines": self.add_num_lines,
+        }
+
+
+class UserCache:
+    """
+    Bounded LRU cache of recently seen chatters, keyed by Twitch user ID.
+
+    A cache hit builds the User object for a chat message without issuing a SELECT. The login, display name,
+    last_seen, last_active and num_lines updates every message causes are coalesced in memory and written to the
+    database in one batched upsert every time the bot commits (see Bot.commit_all).
+
+    Points and tokens are never cached. Any other update to a user row made through the bot's ORM evicts that user,
+    so the next message reloads them from the database. Updates made by the web interface evict the user through
+    the user.update topic, and bulk updates that bypass the ORM must call clear().
+    """
+
+    def __init__(self, config: cfg.Config) -> None:
+        try:
+            self.max_size = int(config["main"].get("user_cache_size", "10000"))
+        except ValueError:
+            log.exception("Bad user_cache_size in your config")
+            self.max_size = 10000
+
+        try:
+            self.ttl = int(config["main"].get("user_cache_ttl", "300"))
+        except ValueError:
+            log.exception("Bad user_cache_ttl in your config")
+            self.ttl = 300
+
+        self.entries: OrderedDict[str, UserCacheEntry] = OrderedDict()
+        self.pending: dict[str, PendingUserWrite] = {}
+        # Number of open user scopes, and the number of times the user was invalidated while a scope was open,
+        # by user ID. A scope only puts its user back into the cache if nobody invalidated the user in the meantime
+        self.open_scopes: dict[str, int] = {}
+        self.invalidations: dict[str, int] = {}
+        self.lock = threading.Lock()
+
+        self._cached_columns = [attr.key for attr in inspect(User).column_attrs if attr.key not in UNCACHED_COLUMNS]
+
+        event.listen(User, "after_update", self._on_user_updated)
+        event.listen(User, "after_delete", self._on_user_deleted)
+
+    def _on_user_updated(self, mapper, connection, target: User) -> None:
+        db_session = object_session(target)
+        if db_session is not None and not db_session.is_modified(target, include_collections=False):
+            # after_update also fires for users whose only changes were moved out of the session by _write_behind
+            return
+
+        self.invalidate(target.id)
+
+    def _on_user_deleted(self, mapper, connection, target: User) -> None:
+        self.invalidate(target.id)
+
+    def invalidate(self, user_id: str) -> None:
+        with self.lock:
+            self.entries.pop(user_id, None)
+            if user_id in self.open_scopes:
+                self.invalidations[user_id] = self.invalidations.get(user_id, 0) + 1
+
+    def clear(self) -> None:
+        """Evicts every user, e.g. after a bulk update that didn't go through the ORM"""
+        with self.lock:
+            self.entries.clear()
+            for user_id in self.open_scopes:
+                self.invalidations[user_id] = self.invalidations.get(user_id, 0) + 1
+
+    def on_user_update(self, data: dict[str, Any]) -> None:
+        # Sent by the web interface whenever it changes a user, see publish_user_updates
+        self.invalidate(data["user_id"])
+
+    def _get_entry(self, user_id: str) -> Optional[UserCacheEntry]:
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return None
+
+            if time.monotonic() - entry.loaded_at > self.ttl:
+                del self.entries[user_id]
+                return None
+
+            self.entries.move_to_end(user_id)
+            return entry
+
+    def _open_scope(self, user_id: str) -> int:
+        """Returns the number of times the user was invalidated so far, to be passed to _store and _close_scope"""
+        with self.lock:
+            self.open_scopes[user_id] = self.open_scopes.get(user_id, 0) + 1
+            return self.invalidations.get(user_id, 0)
+
+    def _close_scope(self, user_id: str) -> None:
+        with self.lock:
+            self.open_scopes[user_id] -= 1
+            if self.open_scopes[user_id] == 0:
+                del self.open_scopes[user_id]
+                self.invalidations.pop(user_id, None)
+
+    def _store(self, user: User, invalidations: int) -> None:
+        state = inspect(user)
+        assert state is not None
+        unloaded = state.unloaded
+        values = {key: getattr(user, key) for key in self._cached_columns if key not in unloaded}
+
+        with self.lock:
+            if self.invalidations.get(user.id, 0) != invalidations:
+                # The user was changed somewhere else while we used them, the values we have might be stale
+                return
+
+            self.entries[user.id] = UserCacheEntry(values)
+            self.entries.move_to_end(user.id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def _attach(self, db_session: Session, entry: UserCacheEntry, basics: UserBasics) -> User:
+        # new_instance skips User.__init__, so no defaults are applied on top of the cached values
+        user: User = inspect(User).class_manager.new_instance()
+        for key, value in entry.values.items():
+            setattr(user, key, value)
+        user._login = basics.login
+        user.name = basics.name
+
+        # Marks every set value as committed and every missing value (points & tokens) as expired,
+        # then attaching it to the session makes it persistent without talking to the database
+        make_transient_to_detached(user)
+        db_session.add(user)
+        return user
+
+    def _overlay_pending(self, user: User) -> None:
+        # A user reloaded from the database might still have coalesced writes that have not been flushed yet
+        with self.lock:
+            pending = self.pending.get(user.id)
+            if pending is None:
+                return
+
+            if pending.last_seen is not None:
+                set_committed_value(user, "last_seen", pending.last_seen)
+            if pending.last_active is not None:
+                set_committed_value(user, "last_active", pending.last_active)
+            if pending.add_num_lines != 0 and user.num_lines is not None:
+                set_committed_value(user, "num_lines", user.num_lines + pending.add_num_lines)
+
+    def _write_behind(self, user: User, basics: UserBasics) -> None:
+        state = inspect(user)
+        assert state is not None
+        if state.pending:
+            # Brand new user, the INSERT will include everything anyway
+            return
+
+        with self.lock:
+            pending = self.pending.get(user.id)
+            if pending is None:
+                pending = self.pending[user.id] = PendingUserWrite(basics)
+            else:
+                pending.login = basics.login
+                pending.name = basics.name
+
+            for key in WRITE_BEHIND_COLUMNS:
+                history = state.attrs[key].history
+                if not history.added:
+                    continue
+
+                new_value = history.added[0]
+                if key == "num_lines":
+                    old_value = history.deleted[0] if history.deleted else 0
+                    pending.add_num_lines += new_value - (old_value or 0)
+                else:
+                    setattr(pending, key, new_value)
+
+                # Pretend the new value was already loaded from the database so the session does not UPDATE it
+                set_committed_value(user, key, new_value)
+
+    @contextmanager
+    def user_scope(self, basics: UserBasics) -> Iterator[User]:
+        """
+        Drop-in replacement for opening a session and calling User.from_basics on the chat message hot path.
+        The yielded user is attached to a session that is committed when the scope exits.
+        """
+
+        invalidations = self._open_scope(basics.id)
+        try:
+            with DBManager.create_session_scope(expire_on_commit=False) as db_session:
+                entry = self._get_entry(basics.id)
+                if entry is None:
+                    user = User.from_basics(db_session, basics)
+                    self._overlay_pending(user)
+                else:
+                    user = self._attach(db_session, entry, basics)
+
+                try:
+                    yield user
+                    self._write_behind(user, basics)
+                except:
+                    self.invalidate(basics.id)
+                    raise
+
+            self._store(user, invalidations)
+        finally:
+            self._close_scope(basics.id)
+
+    def commit(self) -> None:
+        with self.lock:
+            pending_writes = list(self.pending.values())
+            self.pending = {}
+
+        if not pending_writes:
+            return
+
+        try:
+            with DBManager.create_session_scope() as db_session:
+                db_session.execute(
+                    text(
+                        """
+INSERT INTO "user"(id, login, name, last_seen, last_active, num_lines)
+    VALUES (:id, :login, :name, :last_seen, :last_active, :add_num_lines)
+ON CONFLICT (id) DO UPDATE SET
+    login = :login,
+    name = :name,
+    last_seen = COALESCE(:last_seen, "user".last_seen),
+    last_active = COALESCE(:last_active, "user".last_active),
+    num_lines = "user".num_lines + :add_num_lines
+                """
+                    ),
+                    [pending.jsonify() for pending in pending_writes],
+                )
+        except:
+            log.exception(f"Failed to write {len(pending_writes)} cached user updates, will retry on next commit")
+            with self.lock:
+                for pending in pending_writes:
+                    self._requeue(pending)
+            return
+
+        log.debug(f"Wrote {len(pending_writes)} cached user updates")
+
+    def _requeue(self, failed: PendingUserWrite) -> None:
+        # Must be called with self.lock held. Newer writes for the same user win, line counts are added up
+        pending = self.pending.get(failed.id)
+        if pending is None:
+            self.pending[failed.id] = failed
+            return
+
+        if pending.last_seen is None:
+            pending.last_seen = failed.last_seen
+        if pending.last_active is None:
+            pending.last_active = failed.last_active
+        pending.add_num_lines += failed.add_num_lines
+
+
+def publish_user_updates() -> None:
+    """
+    Makes users changed through the ORM in this process get evicted from the bot's user cache once the change is
+    committed. Used by the web interface, SocketClientManager must be initialized first
+    """
+    event.listen(User, "after_update", _queue_user_update)
+    event.listen(User, "after_delete", _queue_user_update)
+    event.listen(Session, "after_commit", _send_user_updates)
+    event.listen(Session, "after_rollback", _forget_user_updates)
+
+
+def _queue_user_update(mapper, connection, target: User) -> None:
+    db_session = object_session(target)
+    if db_session is not None:
+        db_session.info.setdefault(UPDATED_USER_IDS_KEY, set()).add(target.id)
+
+
+def _send_user_updates(db_session: Session) -> None:
+    for user_id in db_session.info.pop(UPDATED_USER_IDS_KEY, ()):
+        try:
+            SocketClientManager.send("user.update", {"user_id": user_id})
+        except:
+            log.exception(f"Failed to tell the bot that user {user_id} was changed")
+
+
+def _forget_user_updates(db_session: Session) -> None:
+    db_session.info.pop(UPDATED_USER_IDS_KEY, None)
@@ -1,5 +1,9 @@
+from typing import Optional
+
 import logging
 import random
+import threading
+from concurrent.futures import Future
 
 import pajbot.config as cfg
 from pajbot.managers.db import DBManager
@@ -18,6 +22,10 @@ class UserRanksRefreshManager:
             log.exception("Bad rank_refresh_delay in your config")
             self.delay = 5 * 60
 
+        # The refresh that is waiting for, or running on, the background pool
+        self.pending_refresh: Optional[Future[None]] = None
+        self.lock = threading.Lock()
+
     def _jitter(self) -> int:
         return random.randint(0, self.jitter)
 
@@ -26,30 +34,30 @@ class UserRanksRefreshManager:
         # The jitter is added to both the initial refresh, and the scheduled one every 5 minutes.
 
         # Initial refresh
-        ScheduleManager.execute_delayed(
-            self._jitter(),
-            lambda: action_queue.submit(self._refresh, action_queue),
+        ScheduleManager.execute_delayed(self._jitter(), self._submit_refresh, args=[action_queue], executor="reactor")
+
+        # Refresh every 5-6 minutes. The schedule doesn't depend on the refreshes themselves, so a refresh that was
+        # rejected by a full background pool is simply tried again next time
+        ScheduleManager.execute_every(
+            self.delay, self._submit_refresh, args=[action_queue], executor="reactor", jitter=self.jitter
         )
 
     def run_once(self, action_queue) -> None:
         # Initial refresh, run only once on startup
         ScheduleManager.execute_delayed(
-            self._jitter() * 5,
-            lambda: action_queue.submit(self._refresh, action_queue, once_only=True),
+            self._jitter() * 5, self._submit_refresh, args=[action_queue], executor="reactor"
         )
 
-    @time_method
-    def _refresh(self, action_queue, once_only: bool = False) -> None:
-        try:
-            with DBManager.create_dbapi_cursor_scope(autocommit=True) as cursor:
-                cursor.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY user_rank")
-                cursor.execute("VACUUM user_rank")
-        finally:
-            if once_only:
+    def _submit_refresh(self, action_queue) -> None:
+        with self.lock:
+            if self.pending_refresh is not None and not self.pending_refresh.done():
+                # The previous refresh hasn't finished yet, there's no point in queueing up another one
                 return
 
-            # Queue up the refresh in 5-6 minutes
-            ScheduleManager.execute_delayed(
-                self.delay + self._jitter(),
-                lambda: action_queue.submit(self._refresh, action_queue),
-            )
+            self.pending_refresh = action_queue.submit_to("background", self._refresh)
+
+    @time_method
+    def _refresh(self) -> None:
+        with DBManager.create_dbapi_cursor_scope(autocommit=True) as cursor:
+            cursor.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY user_rank")
+            cursor.execute("VACUUM user_rank")
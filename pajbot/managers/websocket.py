@@ -1,44 +1,128 @@
-from typing import Any
+from typing import TYPE_CHECKING, Any, Optional, cast
 
 import json
 import logging
 import threading
+import time
+from collections import deque
 from pathlib import Path
 
+if TYPE_CHECKING:
+    from twisted.internet.interfaces import IReactorThreads
+
 log = logging.getLogger("pajbot")
 
+# Maximum number of events waiting to be broadcast. If the reactor falls this far behind, the oldest events are dropped
+MAX_QUEUED_EVENTS = 1000
 
-class WebSocketServer:
-    clients: list[Any] = []
+# A client whose connection can't keep up is disconnected once this many messages are stuck in its send buffer,
+# or once it hasn't accepted any data for this many seconds
+MAX_FRAMES_BEHIND = 200
+MAX_SECONDS_BEHIND = 30
+
+
+def parse_topics(value: Any) -> Optional[frozenset[str]]:
+    """Returns the set of events a client subscribed to, or None if the value isn't a valid list of topics"""
+    if isinstance(value, str):
+        value = value.split(",")
+
+    if not isinstance(value, list) or not all(isinstance(topic, str) for topic in value):
+        return None
 
+    return frozenset(topic.strip() for topic in value if topic.strip())
+
+
+class WebSocketServer:
     def __init__(self, manager, port, secure=False, key_path=None, crt_path=None, unix_socket_path=None):
         self.manager = manager
         from autobahn.twisted.websocket import WebSocketServerFactory, WebSocketServerProtocol
         from twisted.internet import reactor, ssl
 
+        # Only ever touched from the reactor thread
+        self.clients: list[Any] = []
+
+        self.queue: deque[tuple[str, bytes]] = deque(maxlen=MAX_QUEUED_EVENTS)
+        self.drain_scheduled = False
+        self.lock = threading.Lock()
+
+        server = self
+
         class MyServerProtocol(WebSocketServerProtocol):
             def onConnect(self, request):
                 # log.info(self.factory)
                 # log.info('Client connecting: {0}'.format(request.peer))
-                pass
+
+                # Events this client wants to receive, e.g. ws://host/?topics=new_sub,resub. None means all events
+                self.topics = None
+                if "topics" in request.params:
+                    self.topics = parse_topics(",".join(request.params["topics"]))
+
+                self.paused_at = None
+                self.frames_behind = 0
 
             def onOpen(self):
                 log.info("WebSocket connection open")
-                WebSocketServer.clients.append(self)
+                # The transport calls pauseProducing/resumeProducing as its send buffer fills up and drains
+                self.registerProducer(self, True)
+                server.clients.append(self)
 
             def onMessage(self, payload, isBinary):
                 if isBinary:
                     log.info(f"Binary message received: {len(payload)} bytes")
-                else:
-                    log.info(f"Text message received: {payload.decode('utf8')}")
+                    return
+
+                message = payload.decode("utf8")
+                log.info(f"Text message received: {message}")
+
+                # Clients can change their subscription with {"type": "subscribe", "topics": ["new_sub", "resub"]}
+                try:
+                    json_message = json.loads(message)
+                except ValueError:
+                    return
+
+                if isinstance(json_message, dict) and json_message.get("type", None) == "subscribe":
+                    topics = parse_topics(json_message.get("topics", None))
+                    if topics is None:
+                        log.warning(f"Invalid WebSocket subscription: {message}")
+                        return
+
+                    self.topics = topics
 
             def onClose(self, wasClean, code, reason):
                 log.info(f"WebSocket connection closed: {reason}")
                 try:
-                    WebSocketServer.clients.remove(self)
+                    server.clients.remove(self)
                 except:
                     pass
 
+            def pauseProducing(self):
+                if self.paused_at is None:
+                    self.paused_at = time.monotonic()
+
+            def resumeProducing(self):
+                self.paused_at = None
+                self.frames_behind = 0
+
+            def stopProducing(self):
+                pass
+
+            def wants(self, event):
+                return self.topics is None or event in self.topics
+
+            def send_prepared(self, prepared):
+                if self.paused_at is not None:
+                    self.frames_behind += 1
+                    if self.frames_behind > MAX_FRAMES_BEHIND or time.monotonic() - self.paused_at > MAX_SECONDS_BEHIND:
+                        log.warning("Disconnecting WebSocket client that can't keep up with events")
+                        try:
+                            server.clients.remove(self)
+                        except ValueError:
+                            pass
+                        self.dropConnection(abort=True)
+                        return
+
+                self.sendPreparedMessage(prepared)
+
         factory = WebSocketServerFactory()
         factory.setProtocolOptions(autoPingInterval=15, autoPingTimeout=5)
         factory.protocol = MyServerProtocol
@@ -69,6 +153,38 @@ class WebSocketServer:
         reactor_thread.daemon = True
         reactor_thread.start()
 
+        self.reactor = cast("IReactorThreads", reactor)
+        self.factory = factory
+
+    def broadcast(self, event: str, payload: bytes) -> None:
+        """Queues the event to be sent to all clients. Can be called from any thread"""
+        with self.lock:
+            self.queue.append((event, payload))
+            if self.drain_scheduled:
+                return
+            self.drain_scheduled = True
+
+        self.reactor.callFromThread(self._drain)
+
+    def _drain(self) -> None:
+        # Runs on the reactor thread
+        with self.lock:
+            queue = self.queue
+            self.queue = deque(maxlen=MAX_QUEUED_EVENTS)
+            self.drain_scheduled = False
+
+        for event, payload in queue:
+            # The frame is only built once, no matter how many clients receive it
+            prepared = None
+            for client in list(self.clients):
+                if not client.wants(event):
+                    continue
+
+                if prepared is None:
+                    prepared = self.factory.prepareMessage(payload)
+
+                client.send_prepared(prepared)
+
 
 class WebSocketManager:
     def __init__(self, bot):
@@ -117,8 +233,7 @@ class WebSocketManager:
     def emit(self, event: Any, data: dict[str, Any] = {}) -> None:
         if self.server:
             payload = json.dumps({"event": event, "data": data}).encode("utf8")
-            for client in self.server.clients:
-                client.sendMessage(payload, False)
+            self.server.broadcast(event, payload)
 
     @staticmethod
     def on_log_message(message, isError=False, printed=False):
@@ -0,0 +1,3 @@
+def up(cursor, bot):
+    # new: timer.min_lines
+    cursor.execute("ALTER TABLE timer ADD COLUMN min_lines INTEGER NOT NULL DEFAULT 0")
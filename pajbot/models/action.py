@@ -2,7 +2,6 @@ from __future__ import annotations
 
 from typing import TYPE_CHECKING, Any, Callable, Optional
 
-import cgi
 import collections
 import json
 import logging
@@ -10,13 +9,13 @@ import sys
 
 import irc
 import regex as re
-import requests
 
 if TYPE_CHECKING:
     from pajbot.bot import Bot
     from pajbot.models.user import User
 
 from pajbot.managers.schedule import ScheduleManager
+from pajbot.managers.urlfetch import URLFetchError
 
 log = logging.getLogger(__name__)
 
@@ -72,16 +71,26 @@ class ActionParser:
 
             data = json_data
 
+        # Optional override of how long $(urlfetch ...) responses are cached for, in seconds
+        urlfetch_cache_ttl: Optional[int] = None
+        if "urlfetch_cache_ttl" in data:
+            try:
+                urlfetch_cache_ttl = int(data["urlfetch_cache_ttl"])
+            except (TypeError, ValueError):
+                log.warning(
+                    f'Bad urlfetch_cache_ttl "{data["urlfetch_cache_ttl"]}" in action for command "{command}", using the default'
+                )
+
         if data["type"] == "say":
-            return SayAction(data["message"], ActionParser.bot)
+            return SayAction(data["message"], ActionParser.bot, urlfetch_cache_ttl)
         elif data["type"] == "me":
-            return MeAction(data["message"], ActionParser.bot)
+            return MeAction(data["message"], ActionParser.bot, urlfetch_cache_ttl)
         elif data["type"] == "whisper":
-            return WhisperAction(data["message"], ActionParser.bot)
+            return WhisperAction(data["message"], ActionParser.bot, urlfetch_cache_ttl)
         elif data["type"] == "reply":
-            return ReplyAction(data["message"], ActionParser.bot)
+            return ReplyAction(data["message"], ActionParser.bot, urlfetch_cache_ttl)
         elif data["type"] == "announce":
-            return AnnounceAction(data["message"], ActionParser.bot)
+            return AnnounceAction(data["message"], ActionParser.bot, urlfetch_cache_ttl)
         elif data["type"] == "func":
             try:
                 return FuncAction(getattr(Dispatch, data["cb"]))
@@ -465,8 +474,10 @@ def is_message_good(bot, message, extra):
 class MessageAction(BaseAction):
     type = "message"
 
-    def __init__(self, response: str, bot: Optional[Bot]):
+    def __init__(self, response: str, bot: Optional[Bot], urlfetch_cache_ttl: Optional[int] = None):
         self.response = response
+        # Overrides how many seconds the responses of $(urlfetch ...) substitutions in this action are cached for
+        self.urlfetch_cache_ttl = urlfetch_cache_ttl
 
         self.argument_subs: list[Substitution] = []
         self.subs: dict[str, Substitution] = {}
@@ -510,7 +521,7 @@ class MessageAction(BaseAction):
         raise NotImplementedError("Please implement the run method.")
 
 
-def urlfetch_msg(method, message, num_urlfetch_subs, bot, extra={}, args=[], kwargs={}):
+def urlfetch_msg(method, message, num_urlfetch_subs, bot, extra={}, args=[], kwargs={}, cache_ttl=None):
     urlfetch_subs = get_urlfetch_substitutions(message)
 
     if len(urlfetch_subs) > num_urlfetch_subs:
@@ -518,23 +529,11 @@ def urlfetch_msg(method, message, num_urlfetch_subs, bot, extra={}, args=[], kwa
         return False
 
     for needle, url in urlfetch_subs.items():
-        headers = {
-            "Accept": "text/plain",
-            "Accept-Language": "en-US, en;q=0.9, *;q=0.5",
-            "User-Agent": bot.user_agent,
-        }
-        r = requests.get(url, allow_redirects=True, headers=headers)
-        if r.status_code == requests.codes.ok:
-            # For "legacy" reasons, we don't check the content type of ok status codes
-            value = r.text.strip().replace("\n", "").replace("\r", "")[:400]
-        else:
-            # An error code was returned, ensure the response is plain text
-            content_type = r.headers["Content-Type"]
-            if content_type is not None and cgi.parse_header(content_type)[0] != "text/plain":
-                # The content type is not plain text, return a generic error showing the status code returned
-                value = f"urlfetch error {r.status_code}"
-            else:
-                value = r.text.strip().replace("\n", "").replace("\r", "")[:400]
+        try:
+            value = bot.url_fetcher.fetch(url, cache_ttl=cache_ttl)
+        except URLFetchError:
+            log.exception("urlfetch failed")
+            value = "urlfetch error"
 
         message = message.replace(needle, value)
 
@@ -571,6 +570,7 @@ class SayAction(MessageAction):
                 "extra": extra,
                 "message": resp,
                 "num_urlfetch_subs": self.num_urlfetch_subs,
+                "cache_ttl": self.urlfetch_cache_ttl,
             },
         )
 
@@ -599,6 +599,7 @@ class MeAction(MessageAction):
                 "extra": extra,
                 "message": resp,
                 "num_urlfetch_subs": self.num_urlfetch_subs,
+                "cache_ttl": self.urlfetch_cache_ttl,
             },
         )
 
@@ -627,6 +628,7 @@ class WhisperAction(MessageAction):
                 "extra": extra,
                 "message": resp,
                 "num_urlfetch_subs": self.num_urlfetch_subs,
+                "cache_ttl": self.urlfetch_cache_ttl,
             },
         )
 
@@ -655,6 +657,7 @@ class AnnounceAction(MessageAction):
                 "extra": extra,
                 "message": resp,
                 "num_urlfetch_subs": self.num_urlfetch_subs,
+                "cache_ttl": self.urlfetch_cache_ttl,
             },
         )
 
@@ -684,6 +687,7 @@ class ReplyAction(MessageAction):
                     "extra": extra,
                     "message": resp,
                     "num_urlfetch_subs": self.num_urlfetch_subs,
+                    "cache_ttl": self.urlfetch_cache_ttl,
                 },
             )
 
@@ -701,11 +705,26 @@ class ReplyAction(MessageAction):
                 "extra": extra,
                 "message": resp,
                 "num_urlfetch_subs": self.num_urlfetch_subs,
+                "cache_ttl": self.urlfetch_cache_ttl,
             },
         )
 
 
+def prefetch_kvi_values(substitutions: dict[Any, Substitution], bot: Bot, extra) -> None:
+    try:
+        kvi_ids = list({sub.key for sub in substitutions.values() if sub.key and sub.cb == bot.get_kvi_value})
+        if len(kvi_ids) < 2:
+            # Nothing to gain over reading the value when it's needed
+            return
+
+        extra["kvi_values"] = bot.kvi.get_many(kvi_ids)
+    except:
+        log.exception("Failed to prefetch KVI values")
+
+
 def apply_substitutions(text, substitutions: dict[Any, Substitution], bot: Bot, extra):
+    prefetch_kvi_values(substitutions, bot, extra)
+
     for needle, sub in substitutions.items():
         if sub.key and sub.argument:
             param = sub.key
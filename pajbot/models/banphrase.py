@@ -12,14 +12,15 @@ Banphrases must update their operator properly when the operator is changed
 
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Literal, Optional, Union
+from typing import TYPE_CHECKING, Iterator, Literal, Optional, Union
 
 import argparse
 import logging
 
 from pajbot.managers.db import Base, DBManager
+from pajbot.models.sock import SocketClientManager
 from pajbot.models.user import User
-from pajbot.utils import find
+from pajbot.utils import AhoCorasick, find
 
 import regex as re
 from sqlalchemy import Boolean, ForeignKey, Integer, Text, event
@@ -31,6 +32,16 @@ if TYPE_CHECKING:
 
 log = logging.getLogger("pajbot")
 
+# Operators that compare the message against the phrase as a plain string
+LITERAL_OPERATORS = ("contains", "startswith", "endswith", "exact")
+
+# Maximum number of regex banphrases that are combined into a single pattern
+REGEX_CHUNK_SIZE = 50
+
+# Regex banphrases using backreferences, named groups or inline flags can change meaning when they're combined
+# with other patterns, so they are always checked on their own
+UNCOMBINABLE_REGEX = re.compile(r"\\[1-9]|\\g<|\(\?[a-zA-Z]")
+
 
 class Banphrase(Base):
     __tablename__ = "banphrase"
@@ -227,11 +238,151 @@ class BanphraseData(Base):
         self.edited_by = options.get("edited_by", self.edited_by)
 
 
+class BanphraseVariant:
+    """
+    All enabled banphrases that share the same case_sensitive & remove_accents options,
+    so the message only has to be formatted once for all of them
+    """
+
+    def __init__(self, case_sensitive: bool, remove_accents: bool) -> None:
+        self.case_sensitive = case_sensitive
+        self.remove_accents = remove_accents
+
+        self.literals: list[tuple[str, tuple[int, Banphrase]]] = []
+        # Regex banphrases with the pattern they compiled to
+        self.regexes: list[tuple[int, Banphrase, re.Pattern]] = []
+
+        self.automaton: Optional[AhoCorasick[tuple[int, Banphrase]]] = None
+        self.combined_regexes: list[tuple[re.Pattern, list[tuple[int, Banphrase, re.Pattern]]]] = []
+        self.single_regexes: list[tuple[int, Banphrase, re.Pattern]] = []
+
+    def compile(self) -> None:
+        if self.literals:
+            self.automaton = AhoCorasick(self.literals)
+
+        # Same flags as Banphrase.refresh_operator
+        flags = 0 if self.case_sensitive else re.IGNORECASE
+        combinable = []
+        for index, banphrase, pattern in self.regexes:
+            if UNCOMBINABLE_REGEX.search(banphrase.phrase):
+                self.single_regexes.append((index, banphrase, pattern))
+            else:
+                combinable.append((index, banphrase, pattern))
+
+        for chunk_start in range(0, len(combinable), REGEX_CHUNK_SIZE):
+            chunk = combinable[chunk_start : chunk_start + REGEX_CHUNK_SIZE]
+            try:
+                combined = re.compile("|".join(f"(?:{banphrase.phrase})" for _, banphrase, _ in chunk), flags=flags)
+            except Exception:
+                log.warning("Unable to combine regex banphrases, checking them one by one instead")
+                self.single_regexes.extend(chunk)
+                continue
+
+            self.combined_regexes.append((combined, chunk))
+
+    def format_message(self, message: str) -> str:
+        # Same as Banphrase.format_message
+        if self.case_sensitive is False:
+            message = message.lower()
+        if self.remove_accents:
+            message = unidecode(message).strip()
+
+        return message
+
+    def matches(self, message: str) -> Iterator[tuple[int, Banphrase]]:
+        message = self.format_message(message)
+
+        if self.automaton is not None:
+            for start, end, (index, banphrase) in self.automaton.iter(message):
+                operator = banphrase.operator
+                if operator == "contains":
+                    yield index, banphrase
+                elif operator == "startswith":
+                    if start == 0:
+                        yield index, banphrase
+                elif operator == "endswith":
+                    if end == len(message):
+                        yield index, banphrase
+                elif start == 0 and end == len(message):
+                    yield index, banphrase
+
+        for combined, chunk in self.combined_regexes:
+            # The combined pattern only tells us whether any of them matches
+            if not combined.search(message):
+                continue
+
+            for index, banphrase, pattern in chunk:
+                if pattern.search(message):
+                    yield index, banphrase
+
+        for index, banphrase, pattern in self.single_regexes:
+            if pattern.search(message):
+                yield index, banphrase
+
+
+class CompiledBanphrases:
+    """
+    Matches a message against all enabled banphrases at once.
+    The plain string banphrases are matched in a single pass with an Aho-Corasick automaton,
+    and the regex banphrases are OR'd together into a few combined patterns.
+    """
+
+    def __init__(self, banphrases: list[Banphrase]) -> None:
+        self.banphrases = list(banphrases)
+        self.variants: dict[tuple[bool, bool], BanphraseVariant] = {}
+        # Banphrases we can't compile, e.g. with an unknown operator, keep using Banphrase.match
+        self.fallback: list[tuple[int, Banphrase]] = []
+
+        for index, banphrase in enumerate(self.banphrases):
+            key = (banphrase.case_sensitive, banphrase.remove_accents)
+            if banphrase.operator in LITERAL_OPERATORS and banphrase.phrase:
+                variant = self._get_variant(key)
+                variant.literals.append((banphrase.get_phrase(), (index, banphrase)))
+            elif banphrase.operator == "regex":
+                if banphrase.compiled_regex is not None:
+                    self._get_variant(key).regexes.append((index, banphrase, banphrase.compiled_regex))
+            else:
+                self.fallback.append((index, banphrase))
+
+        for variant in self.variants.values():
+            variant.compile()
+
+    def _get_variant(self, key: tuple[bool, bool]) -> BanphraseVariant:
+        variant = self.variants.get(key)
+        if variant is None:
+            variant = self.variants[key] = BanphraseVariant(*key)
+        return variant
+
+    def check_message(self, message: str, user: Optional[User]) -> Union[Banphrase, Literal[False]]:
+        is_subscriber = user is not None and user.subscriber is True
+
+        matches: dict[int, Banphrase] = {}
+        for variant in self.variants.values():
+            for index, banphrase in variant.matches(message):
+                if is_subscriber and banphrase.sub_immunity is True:
+                    continue
+                matches[index] = banphrase
+
+        for index, banphrase in self.fallback:
+            if banphrase.match(message, user):
+                matches[index] = banphrase
+
+        # Same result as checking every banphrase in order
+        matched_banphrase = None
+        for index in sorted(matches):
+            banphrase = matches[index]
+            if matched_banphrase is None or banphrase.greater_than(matched_banphrase):
+                matched_banphrase = banphrase
+
+        return matched_banphrase or False
+
+
 class BanphraseManager:
     def __init__(self, bot: Optional[Bot]) -> None:
         self.bot = bot
         self.banphrases: list[Banphrase] = []
         self.enabled_banphrases: list[Banphrase] = []
+        self.matcher = CompiledBanphrases([])
         self.db_session = DBManager.create_session(expire_on_commit=False)
 
         if self.bot:
@@ -264,9 +415,8 @@ class BanphraseManager:
             if updated_banphrase.enabled is True and updated_banphrase not in self.enabled_banphrases:
                 self.enabled_banphrases.append(updated_banphrase)
 
-        for banphrase in self.enabled_banphrases:
-            if banphrase.enabled is False:
-                self.enabled_banphrases.remove(banphrase)
+        self.enabled_banphrases = [banphrase for banphrase in self.enabled_banphrases if banphrase.enabled is True]
+        self.refresh_matcher()
 
     def on_banphrase_remove(self, data) -> None:
         try:
@@ -286,11 +436,14 @@ class BanphraseManager:
             if removed_banphrase in self.banphrases:
                 self.banphrases.remove(removed_banphrase)
 
+            self.refresh_matcher()
+
     def load(self) -> BanphraseManager:
         self.banphrases = self.db_session.query(Banphrase).all()
         for banphrase in self.banphrases:
             self.db_session.expunge(banphrase)
         self.enabled_banphrases = [banphrase for banphrase in self.banphrases if banphrase.enabled is True]
+        self.refresh_matcher()
         return self
 
     def commit(self) -> None:
@@ -311,6 +464,8 @@ class BanphraseManager:
 
         self.banphrases.append(banphrase)
         self.enabled_banphrases.append(banphrase)
+        self.refresh_matcher()
+        SocketClientManager.send("banphrase.update", {"id": banphrase.id})
 
         return banphrase, True
 
@@ -318,11 +473,13 @@ class BanphraseManager:
         self.banphrases.remove(banphrase)
         if banphrase in self.enabled_banphrases:
             self.enabled_banphrases.remove(banphrase)
+        self.refresh_matcher()
 
         self.db_session.expunge(banphrase.data)
         self.db_session.delete(banphrase)
         self.db_session.delete(banphrase.data)
         self.commit()
+        SocketClientManager.send("banphrase.remove", {"id": banphrase.id})
 
     def punish(self, user, banphrase) -> None:
         """
@@ -353,19 +510,12 @@ class BanphraseManager:
             # Finally, time out the user for whatever timeout length was required.
             self.bot.timeout(user, timeout_length, reason=reason)
 
-    def check_message(self, message: str, user: Optional[User]) -> Union[Banphrase, Literal[False]]:
-        matched_banphrase = None
-        for banphrase in self.enabled_banphrases:
-            if banphrase.match(message, user):
-                if not matched_banphrase:
-                    matched_banphrase = banphrase
-                    continue
-
-                if banphrase.greater_than(matched_banphrase):
-                    matched_banphrase = banphrase
-                    continue
+    def refresh_matcher(self) -> None:
+        # Built from scratch and swapped in, so a message being checked on another thread keeps using the old one
+        self.matcher = CompiledBanphrases(self.enabled_banphrases)
 
-        return matched_banphrase or False
+    def check_message(self, message: str, user: Optional[User]) -> Union[Banphrase, Literal[False]]:
+        return self.matcher.check_message(message, user)
 
     def find_match(self, message: str, banphrase_id: Optional[str] = None) -> Optional[Banphrase]:
         match = None
@@ -46,6 +46,46 @@ def _combine_reasons(a: Optional[str], b: Optional[str]) -> Optional[str]:
     return f"{a} + {b}"
 
 
+def combine_actions(existing_action: ModerationAction, action: ModerationAction) -> ModerationAction:
+    """Combine two actions for the same user into the single action that should be executed"""
+    if isinstance(action, Ban):
+        if isinstance(existing_action, Ban):
+            # combine the two
+            return Ban(reason=_combine_reasons(existing_action.reason, action.reason))
+
+        # ban wins over lower-tier action
+        return action
+
+    if isinstance(action, Timeout):
+        if isinstance(existing_action, Ban):
+            # Existing action is higher-tier
+            return existing_action
+
+        if isinstance(existing_action, Timeout):
+            # combine the two
+            return Timeout(
+                duration=max(action.duration, existing_action.duration),
+                reason=_combine_reasons(existing_action.reason, action.reason),
+            )
+
+        # timeout wins over lower-tier action
+        return action
+
+    if isinstance(action, Unban):
+        if isinstance(existing_action, Ban) or isinstance(existing_action, Timeout):
+            # Existing action is higher-tier
+            return existing_action
+
+        # unban wins over lower-tier untimeout, and there's nothing to combine for two unbans
+        return action
+
+    # we have an untimeout action
+    # if the current action was higher-tier we wouldn't have to do anything
+    # if the current action was also an untimeout we wouldn't have to do anything
+    # there are no tiers below an untimeout
+    return existing_action
+
+
 class ModerationActions:
     # Maps login -> action to execute
     actions: dict[str, ModerationAction]
@@ -59,63 +99,12 @@ class ModerationActions:
             self.actions[login] = action
             return
 
-        existing_action = self.actions[login]
-
-        if isinstance(action, Ban):
-            if isinstance(existing_action, Ban):
-                # combine the two
-                self.actions[login] = Ban(reason=_combine_reasons(existing_action.reason, action.reason))
-            else:
-                # ban wins over lower-tier action
-                self.actions[login] = action
-            return
-
-        if isinstance(action, Timeout):
-            if isinstance(existing_action, Ban):
-                # Existing action is higher-tier
-                return
-
-            if isinstance(existing_action, Timeout):
-                # combine the two
-                self.actions[login] = Timeout(
-                    duration=max(action.duration, existing_action.duration),
-                    reason=_combine_reasons(existing_action.reason, action.reason),
-                )
-            else:
-                # timeout wins over lower-tier action
-                self.actions[login] = action
-            return
-
-        if isinstance(action, Unban):
-            if isinstance(existing_action, Ban) or isinstance(existing_action, Timeout):
-                # Existing action is higher-tier
-                return
-
-            if isinstance(existing_action, Unban):
-                # two unbans, nothing to combine
-                pass
-            else:
-                # unban wins over lower-tier untimeout
-                self.actions[login] = action
-            return
-
-        # we have an untimeout action
-        # if the current action was higher-tier we wouldn't have to do anything
-        # if the current action was also an untimeout we wouldn't have to do anything
-        # there are no tiers below an untimeout
-        # the case where there is no pre-existing action is already handled way at the top of this method
-        # so, in essence, there is nothing to do here.
+        self.actions[login] = combine_actions(self.actions[login], action)
 
     def execute(self, bot) -> None:
+        # Hand the merged actions to the moderation worker, so the IRC thread doesn't wait for the Helix requests
         for login, action in self.actions.items():
-            if isinstance(action, Ban):
-                bot.ban_login(login, action.reason)
-            if isinstance(action, Timeout):
-                bot.timeout_login(login, action.duration, action.reason)
-            if isinstance(action, Unban):
-                bot.unban_login(login)
-            if isinstance(action, Untimeout):
-                bot.untimeout_login(login)
+            bot.moderation_queue.add(login, action)
 
 
 @contextmanager
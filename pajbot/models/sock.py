@@ -13,7 +13,7 @@ Handler = Callable[[HandlerParam], None]
 
 
 class SocketManager:
-    def __init__(self, streamer_name: str, callback: Callable[[Handler, Any], None]) -> None:
+    def __init__(self, streamer_name: str, callback: Callable[[Handler, Any], Any]) -> None:
         self.handlers: dict[str, list[Handler]] = {}
         self.pubsub = RedisManager.get().pubsub()
         self.running = True
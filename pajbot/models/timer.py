@@ -7,15 +7,19 @@ Timers should run after being created
 
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Any, Optional, TypedDict
+from typing import TYPE_CHECKING, Any, Callable, Optional, TypedDict
 
+import heapq
+import itertools
 import json
 import logging
+import time
 
 from pajbot.managers.db import Base, DBManager
+from pajbot.managers.handler import HandlerManager
 from pajbot.models.action import ActionParser, BaseAction
 from pajbot.models.user import User
-from pajbot.utils import find
+from pajbot.tmi import SendPriority
 
 from sqlalchemy import Boolean, Integer, Text, event
 from sqlalchemy.orm import Mapped, QueryContext, mapped_column
@@ -26,10 +30,18 @@ if TYPE_CHECKING:
 log = logging.getLogger("pajbot")
 
 
+# Timers are checked once per second, and at most one timer message is sent per check
+TIMER_TICK_INTERVAL = 1
+
+# How long a timer that's due, but waiting for more chat activity, waits before it checks again (in seconds)
+TIMER_ACTIVITY_RECHECK_INTERVAL = 30
+
+
 class TimerOptions(TypedDict):
     name: str
     interval_online: int
     interval_offline: int
+    min_lines: int
     action: dict[str, Any]
 
 
@@ -41,6 +53,8 @@ class Timer(Base):
     action_json: Mapped[str] = mapped_column("action", Text)
     interval_online: Mapped[int]
     interval_offline: Mapped[int]
+    # Number of chat messages that must have been sent since the timer last ran before it runs again
+    min_lines: Mapped[int] = mapped_column(Integer, default=0)
     enabled: Mapped[bool] = mapped_column(Boolean, default=True)
 
     def __init__(self) -> None:
@@ -49,10 +63,9 @@ class Timer(Base):
         self.action_json = "{}"
         self.interval_online = 5
         self.interval_offline = 30
+        self.min_lines = 0
         self.enabled = True
 
-        self.refresh_tts()
-
     def set(self, options: TimerOptions) -> None:
         self.name = options.get("name", self.name)
         log.debug(options)
@@ -62,10 +75,7 @@ class Timer(Base):
             self.action = ActionParser.parse(self.action_json)
         self.interval_online = options.get("interval_online", self.interval_online)
         self.interval_offline = options.get("interval_offline", self.interval_offline)
-
-    def refresh_tts(self) -> None:
-        self.time_to_send_online = self.interval_online
-        self.time_to_send_offline = self.interval_offline
+        self.min_lines = options.get("min_lines", self.min_lines)
 
     def refresh_action(self) -> None:
         self.action = ActionParser.parse(self.action_json)
@@ -76,29 +86,125 @@ class Timer(Base):
             return
 
         dummy_user = User()
-        self.action.run(bot, dummy_user, "")
+        with bot.send_priority_scope(SendPriority.TIMER):
+            self.action.run(bot, dummy_user, "")
 
 
 @event.listens_for(Timer, "load")
 def on_timer_load(target: Timer, context: QueryContext) -> None:
     log.info("REFRESHING TIMER SINCE IT UPDATED")
     target.action = ActionParser.parse(target.action_json)
-    target.refresh_tts()
+
+
+class TimerQueue:
+    """
+    Timer IDs ordered by when they are due next, in a heap.
+    Time only counts towards the timers while the queue isn't paused (i.e. online timers only count down while the
+    stream is online).
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic) -> None:
+        self.clock = clock
+
+        # [due at, insertion order, timer ID]. The timer ID is set to None when the entry is no longer valid
+        self.heap: list[list[Any]] = []
+        self.entries: dict[int, list[Any]] = {}
+        self.counter = itertools.count()
+        self.paused_at: Optional[float] = None
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, timer_id: int) -> bool:
+        return timer_id in self.entries
+
+    @property
+    def paused(self) -> bool:
+        return self.paused_at is not None
+
+    def now(self) -> float:
+        # A paused queue is frozen at the moment it was paused
+        return self.paused_at if self.paused_at is not None else self.clock()
+
+    def schedule(self, timer_id: int, delay: float) -> None:
+        """Makes the timer due in `delay` seconds of unpaused time, replacing when it was due before"""
+        self.remove(timer_id)
+        entry = [self.now() + delay, next(self.counter), timer_id]
+        self.entries[timer_id] = entry
+        heapq.heappush(self.heap, entry)
+
+    def remove(self, timer_id: int) -> None:
+        entry = self.entries.pop(timer_id, None)
+        if entry is not None:
+            entry[2] = None
+
+    def time_until_due(self, timer_id: int) -> Optional[float]:
+        entry = self.entries.get(timer_id)
+        if entry is None:
+            return None
+        return entry[0] - self.now()
+
+    def pop_due(self) -> Optional[int]:
+        """Removes and returns the timer that has been due the longest, if any timer is due"""
+        if self.paused:
+            return None
+
+        now = self.clock()
+        while self.heap:
+            due_at, _, timer_id = self.heap[0]
+            if timer_id is None:
+                heapq.heappop(self.heap)
+                continue
+
+            if due_at > now:
+                return None
+
+            heapq.heappop(self.heap)
+            del self.entries[timer_id]
+            return timer_id
+
+        return None
+
+    def pause(self) -> None:
+        if self.paused_at is None:
+            self.paused_at = self.clock()
+
+    def resume(self) -> None:
+        if self.paused_at is None:
+            return
+
+        # Moving every timer by the same amount keeps the heap ordered
+        paused_for = self.clock() - self.paused_at
+        for entry in self.heap:
+            entry[0] += paused_for
+        self.paused_at = None
 
 
 class TimerManager:
-    def __init__(self, bot: Bot) -> None:
+    def __init__(self, bot: Bot, clock: Callable[[], float] = time.monotonic) -> None:
         self.bot = bot
 
-        self.timers: list[Timer] = []
-        self.online_timers: list[Timer] = []
-        self.offline_timers: list[Timer] = []
+        self.timers: dict[int, Timer] = {}
+        self.online_timers = TimerQueue(clock)
+        self.offline_timers = TimerQueue(clock)
+        # Whether the online timers were running on the last tick
+        self.running_online: Optional[bool] = None
 
-        self.bot.execute_every(60, self.tick)
+        # Number of chat messages seen, and the number that had been seen when each timer last ran
+        self.num_lines = 0
+        self.num_lines_at_last_run: dict[int, int] = {}
+
+        self.bot.execute_every(TIMER_TICK_INTERVAL, self.tick)
 
         if self.bot:
             self.bot.socket_manager.add_handler("timer.update", self.on_timer_update)
             self.bot.socket_manager.add_handler("timer.remove", self.on_timer_remove)
+            HandlerManager.add_handler("on_message", self.on_message, run_if_propagation_stopped=True)
+
+    def on_message(self, whisper: bool, **rest: Any) -> bool:
+        if not whisper:
+            self.num_lines += 1
+        return True
 
     def on_timer_update(self, data: dict[str, Any]) -> None:
         try:
@@ -107,7 +213,7 @@ class TimerManager:
             log.warning("No timer ID found in on_timer_update")
             return
 
-        updated_timer = find(lambda timer: timer.id == timer_id, self.timers)
+        updated_timer = self.timers.get(timer_id)
         if updated_timer:
             with DBManager.create_session_scope(expire_on_commit=False) as db_session:
                 db_session.add(updated_timer)
@@ -118,28 +224,9 @@ class TimerManager:
             with DBManager.create_session_scope(expire_on_commit=False) as db_session:
                 updated_timer = db_session.query(Timer).filter_by(id=timer_id).one_or_none()
 
-        # Add the updated timer to the timer lists if required
         if updated_timer:
-            if updated_timer not in self.timers:
-                self.timers.append(updated_timer)
-
-            if updated_timer not in self.online_timers:
-                if updated_timer.interval_online > 0:
-                    self.online_timers.append(updated_timer)
-                    updated_timer.refresh_tts()
-
-            if updated_timer not in self.offline_timers:
-                if updated_timer.interval_offline > 0:
-                    self.offline_timers.append(updated_timer)
-                    updated_timer.refresh_tts()
-
-        for timer in self.online_timers:
-            if timer.enabled is False or timer.interval_online <= 0:
-                self.online_timers.remove(timer)
-
-        for timer in self.offline_timers:
-            if timer.enabled is False or timer.interval_offline <= 0:
-                self.offline_timers.remove(timer)
+            self.timers[updated_timer.id] = updated_timer
+            self.update_schedule(updated_timer)
 
     def on_timer_remove(self, data: dict[str, Any]) -> None:
         try:
@@ -148,57 +235,89 @@ class TimerManager:
             log.warning("No timer ID found in on_timer_update")
             return
 
-        removed_timer = find(lambda timer: timer.id == timer_id, self.timers)
+        removed_timer = self.timers.pop(timer_id, None)
         if removed_timer:
-            if removed_timer in self.timers:
-                self.timers.remove(removed_timer)
-            if removed_timer in self.online_timers:
-                self.online_timers.remove(removed_timer)
-            if removed_timer in self.offline_timers:
-                self.offline_timers.remove(removed_timer)
+            self.num_lines_at_last_run.pop(removed_timer.id, None)
+            self.update_schedule(removed_timer)
 
     def tick(self) -> None:
-        if self.bot.is_online:
-            for active_timer in self.online_timers:
-                active_timer.time_to_send_online -= 1
-
-            timer = find(lambda timer: timer.time_to_send_online <= 0, self.online_timers)
-            if timer:
-                timer.run(self.bot)
-                timer.time_to_send_online = timer.interval_online
-                self.online_timers.remove(timer)
-                self.online_timers.append(timer)
-        else:
-            for active_timer in self.offline_timers:
-                active_timer.time_to_send_offline -= 1
+        is_online = self.bot.is_online
+        if is_online != self.running_online:
+            # Only the timers for the current stream status count down
+            self.running_online = is_online
+            if is_online:
+                self.offline_timers.pause()
+                self.online_timers.resume()
+            else:
+                self.online_timers.pause()
+                self.offline_timers.resume()
+
+        queue = self.online_timers if is_online else self.offline_timers
+        timer_id = queue.pop_due()
+        if timer_id is None:
+            return
 
-            timer = find(lambda timer: timer.time_to_send_offline <= 0, self.offline_timers)
-            if timer:
-                timer.run(self.bot)
-                timer.time_to_send_offline = timer.interval_offline
-                self.offline_timers.remove(timer)
-                self.offline_timers.append(timer)
+        timer = self.timers.get(timer_id)
+        if timer is None:
+            return
 
-    def redistribute_timers(self) -> None:
-        for x in range(0, len(self.offline_timers)):
-            timer = self.offline_timers[x]
-            timer.time_to_send_offline = int(timer.interval_offline * ((x + 1) / len(self.offline_timers)))
+        num_lines_since_last_run = self.num_lines - self.num_lines_at_last_run.get(timer.id, 0)
+        if num_lines_since_last_run < timer.min_lines:
+            # Not enough chat activity since we last ran this timer, keep it waiting
+            queue.schedule(timer.id, TIMER_ACTIVITY_RECHECK_INTERVAL)
+            return
 
-        for x in range(0, len(self.online_timers)):
-            timer = self.online_timers[x]
-            timer.time_to_send_online = int(timer.interval_online * ((x + 1) / len(self.online_timers)))
+        timer.run(self.bot)
+        self.num_lines_at_last_run[timer.id] = self.num_lines
+        queue.schedule(timer.id, self.get_interval(timer, is_online))
+
+    @staticmethod
+    def get_interval(timer: Timer, online: bool) -> int:
+        """Returns how often the timer runs while the stream is online or offline, in seconds (0 means never)"""
+        return (timer.interval_online if online else timer.interval_offline) * 60
+
+    def get_queue(self, online: bool) -> TimerQueue:
+        return self.online_timers if online else self.offline_timers
+
+    def update_schedule(self, timer: Timer) -> None:
+        """
+        Reschedules a timer that was added, changed or removed. The other timers keep their schedule, unless the
+        timer joined or left one of the queues, in which case that queue is spread out again.
+        """
+        for online in (True, False):
+            queue = self.get_queue(online)
+            interval = self.get_interval(timer, online)
+            wanted = timer.id in self.timers and timer.enabled and interval > 0
+
+            if wanted != (timer.id in queue):
+                self.redistribute_queue(online)
+            elif wanted:
+                time_until_due = queue.time_until_due(timer.id)
+                if time_until_due is None or time_until_due > interval:
+                    # The interval was shortened
+                    queue.schedule(timer.id, interval)
+
+    def redistribute_queue(self, online: bool) -> None:
+        """Spreads the enabled timers out evenly over their intervals, so they don't all run at the same time"""
+        queue = self.get_queue(online)
+        timers = [timer for timer in self.timers.values() if timer.enabled and self.get_interval(timer, online) > 0]
+
+        for timer_id in list(queue.entries):
+            queue.remove(timer_id)
+
+        for x, timer in enumerate(timers):
+            queue.schedule(timer.id, self.get_interval(timer, online) * ((x + 1) / len(timers)))
+
+    def redistribute_timers(self) -> None:
+        self.redistribute_queue(True)
+        self.redistribute_queue(False)
 
     def load(self) -> TimerManager:
-        self.timers = []
         with DBManager.create_session_scope(expire_on_commit=False) as db_session:
-            self.timers = (
-                db_session.query(Timer).order_by(Timer.interval_online, Timer.interval_offline, Timer.name).all()
-            )
+            timers = db_session.query(Timer).order_by(Timer.interval_online, Timer.interval_offline, Timer.name).all()
             db_session.expunge_all()
 
-        self.online_timers = [timer for timer in self.timers if timer.interval_online > 0 and timer.enabled]
-        self.offline_timers = [timer for timer in self.timers if timer.interval_offline > 0 and timer.enabled]
-
+        self.timers = {timer.id: timer for timer in timers}
         self.redistribute_timers()
 
         log.info(
@@ -4,8 +4,9 @@ import logging
 
 from pajbot.managers.adminlog import AdminLogManager
 from pajbot.managers.db import DBManager
-from pajbot.managers.handler import HandlerManager
+from pajbot.managers.message_filter import FilterCost, FilterPunishment, MessageFilterManager
 from pajbot.models.command import Command, CommandExample
+from pajbot.models.sock import SocketClientManager
 from pajbot.modules.base import BaseModule
 
 log = logging.getLogger(__name__)
@@ -17,32 +18,30 @@ class BanphraseModule(BaseModule):
     DESCRIPTION = "Looks at each message for banned phrases, and takes actions accordingly"
     ENABLED_DEFAULT = True
     CATEGORY = "Moderation"
+    FILTER_COST = FilterCost.CHEAP
     SETTINGS: list[Any] = []
 
-    def is_message_bad(self, source, msg_raw, _event):
-        res = self.bot.banphrase_manager.check_message(msg_raw, source)
-        if res is not False:
-            self.bot.banphrase_manager.punish(source, res)
-            return True
-
-        return False  # message was ok
-
     def enable(self, bot):
-        HandlerManager.add_handler("on_message", self.on_message, priority=150, run_if_propagation_stopped=True)
+        MessageFilterManager.add_filter(self)
 
     def disable(self, bot):
-        HandlerManager.remove_handler("on_message", self.on_message)
-
-    def on_message(self, source, message, whisper, event, **rest):
-        if whisper:
-            return
-        if source.level >= 500 or source.moderator:
-            return
-
-        if self.is_message_bad(source, message, event):
-            # we matched a filter.
-            # return False so no more code is run for this message
-            return False
+        MessageFilterManager.remove_filter(self)
+
+    def filter_message(self, message):
+        if message.whisper:
+            return None
+        if message.source.level >= 500 or message.source.moderator:
+            return None
+
+        banphrase = self.bot.banphrase_manager.check_message(message.message, message.source)
+        if banphrase is False:
+            return None
+
+        return FilterPunishment(
+            lambda: self.bot.banphrase_manager.punish(message.source, banphrase),
+            banphrase.length,
+            permanent=banphrase.permanent,
+        )
 
     @staticmethod
     def add_banphrase(bot, source, message, **rest):
@@ -74,6 +73,8 @@ class BanphraseModule(BaseModule):
             banphrase.data.set(edited_by=options["edited_by"])
             DBManager.session_add_expunge(banphrase)
             bot.banphrase_manager.commit()
+            bot.banphrase_manager.refresh_matcher()
+            SocketClientManager.send("banphrase.update", {"id": banphrase.id})
             bot.whisper(
                 source,
                 f"Updated your banphrase (ID: {banphrase.id}) with ({', '.join([key for key in options if key != 'added_by'])})",
@@ -244,7 +244,8 @@ class FollowAgeModule(BaseModule):
         bot.execute_now(bot.send_message_to_user, source, message, event, method=message_method)
 
     def follow_age(self, bot: Bot, source: User, message: str, event: Any, **rest: Any) -> None:
-        bot.action_queue.submit(
+        bot.action_queue.submit_to(
+            "interactive",
             self._handle_command,
             bot,
             source,
@@ -255,7 +256,8 @@ class FollowAgeModule(BaseModule):
         )
 
     def follow_since(self, bot: Bot, source: User, message: str, event: Any, **rest: Any) -> None:
-        bot.action_queue.submit(
+        bot.action_queue.submit_to(
+            "interactive",
             self._handle_command,
             bot,
             source,
@@ -4,8 +4,7 @@ from typing import TYPE_CHECKING, Optional
 
 import logging
 
-from pajbot.managers.handler import HandlerManager
-from pajbot.models.user import User
+from pajbot.managers.message_filter import FilterCost, FilteredMessage, FilterPunishment, MessageFilterManager
 from pajbot.modules import BaseModule, ModuleSetting
 
 if TYPE_CHECKING:
@@ -19,6 +18,7 @@ class CaseCheckerModule(BaseModule):
     NAME = "Case Checker"
     DESCRIPTION = "Times out users who post messages that contain lowercase/uppercase letters."
     CATEGORY = "Moderation"
+    FILTER_COST = FilterCost.CHEAP
     SETTINGS = [
         ModuleSetting(
             key="online_chat_only", label="Only enabled in online chat", type="boolean", required=True, default=True
@@ -162,83 +162,79 @@ class CaseCheckerModule(BaseModule):
         ),
     ]
 
-    def on_message(self, source: User, message: str, msg_id: str, **rest) -> bool:
+    def filter_message(self, message: FilteredMessage) -> Optional[FilterPunishment]:
         if self.bot is None:
             log.warning("Module bot is None")
-            return True
+            return None
 
-        if source.level >= self.settings["bypass_level"] or source.moderator is True:
-            return True
+        if message.source.level >= self.settings["bypass_level"] or message.source.moderator is True:
+            return None
 
         if (self.settings["online_chat_only"] and not self.bot.is_online) or (
             self.settings["offline_chat_only"] and self.bot.is_online
         ):
-            return True
+            return None
 
-        if self.settings["subscriber_exemption"] and source.subscriber is True:
-            return True
+        if self.settings["subscriber_exemption"] and message.source.subscriber is True:
+            return None
 
-        if self.settings["vip_exemption"] and source.vip is True:
-            return True
+        if self.settings["vip_exemption"] and message.source.vip is True:
+            return None
 
-        amount_lowercase = sum(1 for c in message if c.islower())
+        amount_lowercase = message.character_stats.lowercase
         if self.settings["lowercase_timeouts"] is True:
             if amount_lowercase >= self.settings["max_lowercase"]:
-                self.bot.delete_or_timeout(
-                    source,
+                return FilterPunishment.delete_or_timeout(
+                    self.bot,
+                    message,
                     self.settings["moderation_action"],
-                    msg_id,
                     self.settings["lowercase_timeout_duration"],
                     reason=self.settings["lowercase_timeout_reason"],
                     disable_warnings=self.settings["disable_warnings"],
                 )
-                return False
 
             if (
                 amount_lowercase >= self.settings["min_lowercase_characters"]
-                and (amount_lowercase / len(message)) * 100 >= self.settings["lowercase_percentage"]
+                and (amount_lowercase / len(message.message)) * 100 >= self.settings["lowercase_percentage"]
             ):
-                self.bot.delete_or_timeout(
-                    source,
+                return FilterPunishment.delete_or_timeout(
+                    self.bot,
+                    message,
                     self.settings["moderation_action"],
-                    msg_id,
                     self.settings["lowercase_timeout_duration"],
                     reason=self.settings["lowercase_timeout_reason"],
                     disable_warnings=self.settings["disable_warnings"],
                 )
-                return False
 
-        amount_uppercase = sum(1 for c in message if c.isupper())
+        amount_uppercase = message.character_stats.uppercase
         if self.settings["uppercase_timeouts"] is True:
             if amount_uppercase >= self.settings["max_uppercase"]:
-                self.bot.delete_or_timeout(
-                    source,
+                return FilterPunishment.delete_or_timeout(
+                    self.bot,
+                    message,
                     self.settings["moderation_action"],
-                    msg_id,
                     self.settings["uppercase_timeout_duration"],
                     reason=self.settings["uppercase_timeout_reason"],
                     disable_warnings=self.settings["disable_warnings"],
                 )
-                return False
 
             if (
                 amount_uppercase >= self.settings["min_uppercase_characters"]
-                and (amount_uppercase / len(message)) * 100 >= self.settings["uppercase_percentage"]
+                and (amount_uppercase / len(message.message)) * 100 >= self.settings["uppercase_percentage"]
             ):
-                self.bot.delete_or_timeout(
-                    source,
+                return FilterPunishment.delete_or_timeout(
+                    self.bot,
+                    message,
                     self.settings["moderation_action"],
-                    msg_id,
                     self.settings["uppercase_timeout_duration"],
                     reason=self.settings["uppercase_timeout_reason"],
                     disable_warnings=self.settings["disable_warnings"],
                 )
-                return False
 
-        return True
+        return None
 
     def enable(self, bot: Optional[Bot]) -> None:
-        HandlerManager.add_handler("on_message", self.on_message, priority=150, run_if_propagation_stopped=True)
+        MessageFilterManager.add_filter(self)
 
     def disable(self, bot: Optional[Bot]) -> None:
-        HandlerManager.remove_handler("on_message", self.on_message)
+        MessageFilterManager.remove_filter(self)
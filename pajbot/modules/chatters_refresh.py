@@ -60,7 +60,7 @@ class ChattersRefreshModule(BaseModule):
         # TODO if you wanted to improve this: Provide the user with feedback
         #   whether the update succeeded, and if yes, how many users were updated
         bot.whisper(source, "Reloading list of chatters...")
-        bot.action_queue.submit(self._update_chatters, only_last_seen=True)
+        bot.action_queue.submit_to("background", self._update_chatters, only_last_seen=True)
 
     @time_method
     def _update_chatters(self, only_last_seen: bool = False) -> None:
@@ -122,6 +122,11 @@ ON CONFLICT (id) DO UPDATE SET
                 update_values,
             )
 
+        # Cached users would keep their old time in chat
+        self.bot.user_cache.clear()
+
+        self.bot.recent_chatters.add_many(chatters)
+
         log.info(f"Successfully updated {len(chatters)} chatters")
 
     def load_commands(self, **options):
@@ -152,7 +157,7 @@ ON CONFLICT (id) DO UPDATE SET
 
         # every 10 minutes, add the chatters update to the action queue
         self.scheduled_job = ScheduleManager.execute_every(
-            self.UPDATE_INTERVAL * 60, lambda: self.bot.action_queue.submit(self._update_chatters)
+            self.UPDATE_INTERVAL * 60, lambda: self.bot.action_queue.submit_to("background", self._update_chatters)
         )
 
     def disable(self, bot):
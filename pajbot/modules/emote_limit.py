@@ -4,9 +4,8 @@ from typing import TYPE_CHECKING, Optional
 
 import logging
 
-from pajbot.managers.handler import HandlerManager
-from pajbot.models.emote import EmoteInstance
-from pajbot.models.user import User
+from pajbot.emoji import EMOJI_MATCHER
+from pajbot.managers.message_filter import FilterCost, FilteredMessage, FilterPunishment, MessageFilterManager
 from pajbot.modules import BaseModule, ModuleSetting
 
 if TYPE_CHECKING:
@@ -20,6 +19,7 @@ class EmoteLimitModule(BaseModule):
     NAME = "Emote Limit"
     DESCRIPTION = "Times out users who post too many emotes"
     CATEGORY = "Moderation"
+    FILTER_COST = FilterCost.CHEAP
     SETTINGS = [
         ModuleSetting(
             key="max_emotes",
@@ -78,6 +78,13 @@ class EmoteLimitModule(BaseModule):
             default="Too many emotes in your message",
             constraints={},
         ),
+        ModuleSetting(
+            key="count_emoji",
+            label="Count unicode emoji as emotes",
+            type="boolean",
+            required=True,
+            default=False,
+        ),
         ModuleSetting(
             key="disable_warnings",
             label="Disable warning timeouts",
@@ -87,39 +94,41 @@ class EmoteLimitModule(BaseModule):
         ),
     ]
 
-    def on_message(self, source: User, message: str, emote_instances: list[EmoteInstance], msg_id: str, **rest) -> bool:
+    def filter_message(self, message: FilteredMessage) -> Optional[FilterPunishment]:
         if self.bot is None:
             log.warning("Module bot is None")
-            return True
+            return None
 
-        if source.level >= self.settings["bypass_level"] or source.moderator is True:
-            return True
+        if message.source.level >= self.settings["bypass_level"] or message.source.moderator is True:
+            return None
 
         if self.bot.is_online and not self.settings["enable_in_online_chat"]:
-            return True
+            return None
 
         if not self.bot.is_online and not self.settings["enable_in_offline_chat"]:
-            return True
+            return None
+
+        if self.settings["allow_subs_to_bypass"] and message.source.subscriber is True:
+            return None
 
-        if self.settings["allow_subs_to_bypass"] and source.subscriber is True:
-            return True
+        num_emotes = len(message.emote_instances)
+        if self.settings["count_emoji"]:
+            num_emotes += EMOJI_MATCHER.count(message.message)
 
-        if len(emote_instances) > self.settings["max_emotes"]:
-            self.bot.delete_or_timeout(
-                source,
+        if num_emotes > self.settings["max_emotes"]:
+            return FilterPunishment.delete_or_timeout(
+                self.bot,
+                message,
                 self.settings["moderation_action"],
-                msg_id,
                 self.settings["timeout_duration"],
                 self.settings["timeout_reason"],
                 disable_warnings=self.settings["disable_warnings"],
             )
 
-            return False
-
-        return True
+        return None
 
     def enable(self, bot: Optional[Bot]) -> None:
-        HandlerManager.add_handler("on_message", self.on_message, priority=150, run_if_propagation_stopped=True)
+        MessageFilterManager.add_filter(self)
 
     def disable(self, bot: Optional[Bot]) -> None:
-        HandlerManager.remove_handler("on_message", self.on_message)
+        MessageFilterManager.remove_filter(self)
@@ -4,7 +4,7 @@ from typing import TYPE_CHECKING, Optional
 
 import logging
 
-from pajbot.emoji import ALL_EMOJI
+from pajbot.emoji import EMOJI_MATCHER
 from pajbot.managers.handler import HandlerManager
 from pajbot.models.emote import EmoteInstance
 from pajbot.models.user import User
@@ -177,7 +177,7 @@ class EmoteTimeoutModule(BaseModule):
             )
             return False
 
-        if self.settings["timeout_emoji"] and any(emoji in message for emoji in ALL_EMOJI):
+        if self.settings["timeout_emoji"] and EMOJI_MATCHER.contains(message):
             self.bot.delete_or_timeout(
                 source,
                 self.settings["moderation_action"],
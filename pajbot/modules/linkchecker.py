@@ -1,35 +1,69 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Any, Literal, Optional, Union
+from typing import TYPE_CHECKING, Any, Callable, Literal, Optional, Union, cast
 
 import argparse
+import codecs
+import concurrent.futures
+import functools
+import hashlib
 import logging
+import math
+import re
+import threading
+import time
 import urllib.parse
+from collections import OrderedDict
+from dataclasses import dataclass
+from html.parser import HTMLParser
 
 import pajbot.managers
 import pajbot.models
 import pajbot.utils
+from pajbot.action_queue import ActionQueueFull
 from pajbot.apiwrappers.safebrowsing import SafeBrowsingAPI
 from pajbot.managers.adminlog import AdminLogManager
 from pajbot.managers.db import Base, DBManager
 from pajbot.managers.handler import HandlerManager
+from pajbot.managers.redis import RedisManager
+from pajbot.managers.schedule import ScheduledJob, ScheduleManager
 from pajbot.models.command import Command, CommandExample
 from pajbot.modules import BaseModule, ModuleSetting
+from pajbot.streamhelper import StreamHelper
 
 import requests
-from bs4 import BeautifulSoup
+import urllib3
 from sqlalchemy import Integer
 from sqlalchemy.orm import Mapped, Session, mapped_column
 from urlextract import URLExtract
 
 if TYPE_CHECKING:
     from pajbot.bot import Bot
+    from pajbot.managers.redis import RedisType
 
 log = logging.getLogger(__name__)
 
+# Maximum number of link checker verdicts kept in memory
+LINK_CACHE_SIZE = 10000
+
+# How often expired verdicts are dropped from the link checker cache, in seconds
+LINK_CACHE_SWEEP_INTERVAL = 60
+
+# Pages are downloaded and scanned for links in chunks of this many bytes
+PAGE_CHUNK_SIZE = 16 * 1024
+
+META_CHARSET_REGEX = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?([a-zA-Z0-9_:.-]+)""", re.IGNORECASE)
+
 extractor = URLExtract()
 extractor.update_when_older(14)
 
+# Matches wherever URLExtract could find a TLD, i.e. anywhere a message could contain a URL.
+# Uses the same case-insensitive matching as URLExtract's TLD regex
+URL_CANDIDATE_REGEX = re.compile(r"\.\w|localhost", re.IGNORECASE)
+
+# Number of recent messages whose URLs are cached
+URL_CACHE_SIZE = 1024
+
 
 def is_subdomain(x: str, y: str) -> bool:
     """Returns True if x is a subdomain of y, otherwise return False.
@@ -71,6 +105,17 @@ def is_same_url(x: Url, y: Url) -> bool:
 
 
 def find_unique_urls(message: str) -> set[str]:
+    # Every TLD URLExtract looks for starts with a dot followed by a letter or digit, except for "localhost".
+    # Most chat messages have neither, so they can't contain a URL
+    if URL_CANDIDATE_REGEX.search(message) is None:
+        return set()
+
+    return set(_find_unique_urls(message))
+
+
+@functools.lru_cache(maxsize=URL_CACHE_SIZE)
+def _find_unique_urls(message: str) -> frozenset[str]:
+    # Cached, because spam waves repeat the same message over and over
     urls = []
     for url in extractor.gen_urls(message):
         if not (url.startswith("http://") or url.startswith("https://")):
@@ -79,7 +124,69 @@ def find_unique_urls(message: str) -> set[str]:
             url = url[:-1]
         urls.append(url)
 
-    return set(urls)
+    return frozenset(urls)
+
+
+def get_declared_charset(content_type: Optional[str], head: bytes) -> str:
+    """
+    Returns the charset declared in the Content-Type header, or in a <meta> tag at the start of the document.
+    Falls back to UTF-8 if neither declares a charset we know.
+    """
+    charset: Optional[str] = None
+    if content_type is not None:
+        for param in content_type.split(";")[1:]:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "charset":
+                charset = value.strip().strip("\"'")
+                break
+
+    if charset is None:
+        match = META_CHARSET_REGEX.search(head[:1024])
+        if match is not None:
+            charset = match.group(1).decode("ascii")
+
+    if charset is not None:
+        try:
+            codec_info = codecs.lookup(charset)
+        except LookupError:
+            pass
+        else:
+            # codecs also knows bytes-to-bytes codecs like base64 and zlib, which can't decode a page into text
+            if codec_info._is_text_encoding:
+                return codec_info.name
+
+    return "utf-8"
+
+
+class LinkExtractor(HTMLParser):
+    """
+    Collects the unique absolute http(s) links of <a href> tags from HTML that's fed to it piece by piece.
+    Stops collecting once max_links links have been found.
+    """
+
+    def __init__(self, max_links: int) -> None:
+        super().__init__(convert_charrefs=True)
+        self.max_links = max_links
+        # Used as an ordered set
+        self.links: dict[str, None] = {}
+
+    @property
+    def full(self) -> bool:
+        return len(self.links) >= self.max_links
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, Optional[str]]]) -> None:
+        if tag != "a" or self.full:
+            return
+
+        for name, value in attrs:
+            if name != "href" or value is None:
+                continue
+
+            if value.startswith("//"):
+                self.links["http:" + value] = None
+            elif value.startswith("http://") or value.startswith("https://"):
+                self.links[value] = None
+            return
 
 
 class Url:
@@ -89,21 +196,264 @@ class Url:
 
 
 class LinkCheckerCache:
+    """
+    Recent verdicts of the link checker (True means the URL is safe, False means it's bad), in a bounded LRU.
+    Every verdict expires after its own TTL. Expired verdicts are dropped when they're read, and by a periodic sweep.
+    Verdicts can also be shared through redis, so other bot processes and restarted bots can reuse them.
+    Shared verdicts are stored under a generation number, and clearing them bumps the generation instead of deleting
+    every key: the old verdicts can no longer be found and expire on their own. Other processes pick up the new
+    generation on their next sweep.
+    """
+
+    def __init__(
+        self,
+        max_size: int = LINK_CACHE_SIZE,
+        redis: Optional[RedisType] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.max_size = max_size
+        self.redis = redis
+        self.clock = clock
+
+        # normalized url -> (expires at, safe)
+        self.cache: OrderedDict[str, tuple[float, bool]] = OrderedDict()
+        self.lock = threading.Lock()
+        # Generation of the shared verdicts, read from redis when it's needed
+        self.generation: Optional[str] = None
+
+    def __len__(self) -> int:
+        return len(self.cache)
+
+    @staticmethod
+    def normalize(url: str) -> str:
+        return url.strip("/").lower()
+
+    @staticmethod
+    def redis_generation_key() -> str:
+        return f"{StreamHelper.get_streamer()}:linkchecker:generation"
+
+    def redis_key(self, key: str) -> str:
+        assert self.redis is not None
+        generation = self.generation
+        if generation is None:
+            generation = self.generation = cast(Optional[str], self.redis.get(self.redis_generation_key())) or "0"
+
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return f"{StreamHelper.get_streamer()}:linkchecker:verdict:{generation}:{digest}"
+
+    def get(self, url: str, shared: bool = False) -> Optional[bool]:
+        """Returns the cached verdict for the URL, or None if there's no verdict for it"""
+        key = self.normalize(url)
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is not None:
+                expires_at, safe = entry
+                if expires_at > self.clock():
+                    self.cache.move_to_end(key)
+                    return safe
+
+                del self.cache[key]
+
+        if not shared or self.redis is None:
+            return None
+
+        try:
+            redis_key = self.redis_key(key)
+            with self.redis.pipeline() as pipeline:
+                pipeline.get(redis_key)
+                pipeline.ttl(redis_key)
+                value, ttl = pipeline.execute()
+        except:
+            log.exception("Failed to read link checker verdict from redis")
+            return None
+
+        if value is None or ttl is None or ttl <= 0:
+            return None
+
+        safe = value == "1"
+        self._store(key, safe, ttl)
+        return safe
+
+    def set(self, url: str, safe: bool, ttl: float, shared: bool = False) -> None:
+        if ttl <= 0:
+            return
+
+        key = self.normalize(url)
+        self._store(key, safe, ttl)
+
+        if not shared or self.redis is None:
+            return
+
+        try:
+            self.redis.setex(self.redis_key(key), math.ceil(ttl), "1" if safe else "0")
+        except:
+            log.exception("Failed to write link checker verdict to redis")
+
+    def _store(self, key: str, safe: bool, ttl: float) -> None:
+        with self.lock:
+            self.cache[key] = (self.clock() + ttl, safe)
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+
+    def delete(self, url: str) -> None:
+        with self.lock:
+            self.cache.pop(self.normalize(url), None)
+
+    def clear(self, shared: bool = False) -> None:
+        """Drops every verdict, and the ones shared through redis if shared is set"""
+        with self.lock:
+            self.cache.clear()
+
+        if not shared or self.redis is None:
+            return
+
+        try:
+            self.generation = str(self.redis.incr(self.redis_generation_key()))
+        except:
+            log.exception("Failed to clear link checker verdicts from redis")
+
+    def sweep(self) -> None:
+        """Drops every expired verdict"""
+        # Picks up shared verdicts being cleared by other processes
+        self.generation = None
+
+        now = self.clock()
+        with self.lock:
+            expired = [key for key, (expires_at, _) in self.cache.items() if expires_at <= now]
+            for key in expired:
+                del self.cache[key]
+
+
+@dataclass(frozen=True)
+class LinkRule:
+    """A blacklisted or whitelisted link, detached from the database session"""
+
+    id: int
+    domain: str
+    path: str
+    # Blacklisting level, 0 = shallow, 1 = deep. Always 0 for whitelisted links
+    level: int = 0
+
+    def __str__(self) -> str:
+        return f"#{self.id} {self.domain}{self.path} (level {self.level})"
+
+
+class _PathNode:
+    __slots__ = ("children", "rules")
+
     def __init__(self) -> None:
-        self.cache: dict[str, bool] = {}
-        return
+        self.children: dict[str, _PathNode] = {}
+        self.rules: list[LinkRule] = []
+
+
+class _DomainNode:
+    __slots__ = ("children", "paths")
 
-    def __getitem__(self, url: str) -> bool:
-        return self.cache[url.strip("/").lower()]
+    def __init__(self) -> None:
+        self.children: dict[str, _DomainNode] = {}
+        # Set once a rule uses this exact domain
+        self.paths: Optional[_PathNode] = None
+
+
+class LinkRuleIndex:
+    """
+    Blacklisted or whitelisted links, indexed by the labels of their domain in reverse (com -> pajlada -> www),
+    and then by the segments of their path.
+    A rule matches a URL if its domain is the URL's domain or a parent domain of it, and its path is the URL's path
+    or a parent path of it. Finding the rules that match a URL takes time proportional to the number of labels and
+    segments of the URL, no matter how many rules there are.
+    """
 
-    def __setitem__(self, url: str, safe: bool) -> None:
-        self.cache[url.strip("/").lower()] = safe
+    def __init__(self) -> None:
+        self.root = _DomainNode()
+        self.rules: dict[int, LinkRule] = {}
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    @staticmethod
+    def _domain_labels(domain: str) -> list[str]:
+        return domain.split(".")[::-1]
+
+    @staticmethod
+    def _path_segments(path: str) -> list[str]:
+        # A rule for /a or /a/ matches /a, /a/ and everything below /a/
+        if path.endswith("/"):
+            path = path[:-1]
+        return path.split("/")
+
+    def add(self, rule: LinkRule) -> None:
+        if rule.domain is None or rule.path is None:
+            # Rows with a missing domain or path never match anything
+            return
 
-    def __contains__(self, url: str) -> bool:
-        return url.strip("/").lower() in self.cache
+        self.remove(rule.id)
+        self.rules[rule.id] = rule
 
-    def __delitem__(self, url: str) -> None:
-        del self.cache[url.strip("/").lower()]
+        domain = rule.domain[4:] if rule.domain.startswith("www.") else rule.domain
+        domain_node = self.root
+        for label in self._domain_labels(domain):
+            domain_node = domain_node.children.setdefault(label, _DomainNode())
+
+        if domain_node.paths is None:
+            domain_node.paths = _PathNode()
+        path_node = domain_node.paths
+        for segment in self._path_segments(rule.path):
+            path_node = path_node.children.setdefault(segment, _PathNode())
+
+        # The lists are replaced instead of modified, so lookups from other threads never see a half-updated list
+        path_node.rules = path_node.rules + [rule]
+
+    def remove(self, rule_id: int) -> Optional[LinkRule]:
+        rule = self.rules.pop(rule_id, None)
+        if rule is None:
+            return None
+
+        domain = rule.domain[4:] if rule.domain.startswith("www.") else rule.domain
+        domain_node = self.root
+        for label in self._domain_labels(domain):
+            domain_node = domain_node.children[label]
+
+        assert domain_node.paths is not None
+        path_node = domain_node.paths
+        for segment in self._path_segments(rule.path):
+            path_node = path_node.children[segment]
+
+        # Emptied nodes are left in place, they only cost a little memory
+        path_node.rules = [r for r in path_node.rules if r.id != rule_id]
+
+        return rule
+
+    def find(self, domain: str, path: str) -> list[LinkRule]:
+        """Returns the rules matching the given domain and path, the most specific rule first"""
+        matches: list[LinkRule] = []
+        path_segments: Optional[list[str]] = None
+
+        domain_node = self.root
+        for label in self._domain_labels(domain):
+            next_domain_node = domain_node.children.get(label)
+            if next_domain_node is None:
+                break
+
+            domain_node = next_domain_node
+            if domain_node.paths is None:
+                continue
+
+            if path_segments is None:
+                path_segments = path.split("/")
+
+            path_node = domain_node.paths
+            for segment in path_segments:
+                next_path_node = path_node.children.get(segment)
+                if next_path_node is None:
+                    break
+
+                path_node = next_path_node
+                matches.extend(path_node.rules)
+
+        matches.reverse()
+        return matches
 
 
 class LinkCheckerLink:
@@ -223,16 +573,69 @@ class LinkCheckerModule(BaseModule):
             required=True,
             default=False,
         ),
+        ModuleSetting(
+            key="max_page_size",
+            label="Only scan this much of a linked page for more links (KB)",
+            type="number",
+            required=True,
+            placeholder="",
+            default=1024,
+            constraints={"min_value": 1, "max_value": 10240},
+        ),
+        ModuleSetting(
+            key="max_page_links",
+            label="Only check this many of the links found on a linked page",
+            type="number",
+            required=True,
+            placeholder="",
+            default=50,
+            constraints={"min_value": 0, "max_value": 500},
+        ),
+        ModuleSetting(
+            key="check_time_limit",
+            label="Stop checking a link and the links on its page after (seconds)",
+            type="number",
+            required=True,
+            placeholder="",
+            default=10,
+            constraints={"min_value": 1, "max_value": 60},
+        ),
+        ModuleSetting(
+            key="safe_link_cache_ttl",
+            label="Remember safe links for (seconds)",
+            type="number",
+            required=True,
+            placeholder="",
+            default=20,
+            constraints={"min_value": 0, "max_value": 86400},
+        ),
+        ModuleSetting(
+            key="bad_link_cache_ttl",
+            label="Remember bad links for (seconds)",
+            type="number",
+            required=True,
+            placeholder="",
+            default=600,
+            constraints={"min_value": 0, "max_value": 86400},
+        ),
+        ModuleSetting(
+            key="share_link_cache",
+            label="Share remembered links with other bot processes through redis",
+            type="boolean",
+            required=True,
+            default=False,
+        ),
     ]
 
     def __init__(self, bot: Bot) -> None:
         super().__init__(bot)
         self.db_session: Optional[Session] = None
 
-        self.blacklisted_links: list[BlacklistedLink] = []
-        self.whitelisted_links: list[WhitelistedLink] = []
+        self.blacklist = LinkRuleIndex()
+        self.whitelist = LinkRuleIndex()
 
-        self.cache = LinkCheckerCache()  # cache[url] = True means url is safe, False means the link is bad
+        self.cache = LinkCheckerCache(redis=RedisManager.get() if bot else None)
+        self.cache_sweep_job: Optional[ScheduledJob] = None
 
         self.safe_browsing_api: Optional[SafeBrowsingAPI] = None
 
@@ -249,18 +652,25 @@ class LinkCheckerModule(BaseModule):
         HandlerManager.add_handler("on_message", self.on_message, priority=150, run_if_propagation_stopped=True)
         HandlerManager.add_handler("on_commit", self.on_commit)
 
+        if self.cache_sweep_job is None:
+            self.cache_sweep_job = ScheduleManager.execute_every(LINK_CACHE_SWEEP_INTERVAL, self.cache.sweep)
+
         if self.db_session is not None:
             self.db_session.commit()
             self.db_session.close()
             self.db_session = None
         self.db_session = DBManager.create_session()
-        self.blacklisted_links = []
-        for blacklisted_link in self.db_session.query(BlacklistedLink):
-            self.blacklisted_links.append(blacklisted_link)
-
-        self.whitelisted_links = []
-        for link in self.db_session.query(WhitelistedLink):
-            self.whitelisted_links.append(link)
+        self.blacklist = LinkRuleIndex()
+        for link_id, domain, path, level in self.db_session.query(BlacklistedLink).with_entities(
+            BlacklistedLink.id, BlacklistedLink.domain, BlacklistedLink.path, BlacklistedLink.level
+        ):
+            self.blacklist.add(LinkRule(link_id, domain, path, level or 0))
+
+        self.whitelist = LinkRuleIndex()
+        for link_id, domain, path in self.db_session.query(WhitelistedLink).with_entities(
+            WhitelistedLink.id, WhitelistedLink.domain, WhitelistedLink.path
+        ):
+            self.whitelist.add(LinkRule(link_id, domain, path))
 
     def disable(self, bot):
         if not bot:
@@ -269,15 +679,19 @@ class LinkCheckerModule(BaseModule):
         pajbot.managers.handler.HandlerManager.remove_handler("on_message", self.on_message)
         pajbot.managers.handler.HandlerManager.remove_handler("on_commit", self.on_commit)
 
+        if self.cache_sweep_job is not None:
+            self.cache_sweep_job.cancel()
+            self.cache_sweep_job = None
+
         if self.db_session is not None:
             self.db_session.commit()
             self.db_session.close()
             self.db_session = None
-            self.blacklisted_links = []
-            self.whitelisted_links = []
+            self.blacklist = LinkRuleIndex()
+            self.whitelist = LinkRuleIndex()
 
     def reload(self):
-        log.info(f"Loaded {len(self.blacklisted_links)} bad links and {len(self.whitelisted_links)} good links")
+        log.info(f"Loaded {len(self.blacklist)} bad links and {len(self.whitelist)} good links")
         return self
 
     super_whitelist = ["pajlada.se", "pajlada.com", "forsen.tv", "pajbot.com"]
@@ -340,22 +754,25 @@ class LinkCheckerModule(BaseModule):
             # First we perform a basic check
             if self.simple_check(url, action) == self.RET_FURTHER_ANALYSIS:
                 # If the basic check returns no relevant data, we queue up a proper check on the URL
-                self.bot.action_queue.submit(self.check_url, url, action)
+                check = self.bot.action_queue.submit_to("link_check", self.check_url, url, action)
+                if check.done() and isinstance(check.exception(), ActionQueueFull):
+                    # We can't check the link, so we treat it as bad. Otherwise flooding chat with links would
+                    # let them through unchecked
+                    log.warning(f"LinkChecker: Too many links waiting to be checked, counteracting {url}")
+                    action()
+                    return
 
     def on_commit(self, **rest):
         if self.db_session is not None:
             self.db_session.commit()
 
-    def delete_from_cache(self, url):
-        if url in self.cache:
-            del self.cache[url]
-
-    def cache_url(self, url, safe):
-        if url in self.cache and self.cache[url] == safe:
-            return
+    def get_cached_verdict(self, url: str) -> Optional[bool]:
+        """Returns True if the URL was found to be safe recently, False if it was found to be bad, otherwise None"""
+        return self.cache.get(url, shared=self.settings["share_link_cache"])
 
-        self.cache[url] = safe
-        self.bot.execute_delayed(20, self.delete_from_cache, url)
+    def cache_url(self, url: str, safe: bool) -> None:
+        ttl = self.settings["safe_link_cache_ttl"] if safe else self.settings["bad_link_cache_ttl"]
+        self.cache.set(url, safe, ttl, shared=self.settings["share_link_cache"])
 
     def counteract_bad_url(self, url, action=None, want_to_cache=True, want_to_blacklist=False):
         log.debug(f"LinkChecker: BAD URL FOUND {url.url}")
@@ -389,8 +806,10 @@ class LinkCheckerModule(BaseModule):
 
         link = BlacklistedLink(domain, path, level)
         self.db_session.add(link)
-        self.blacklisted_links.append(link)
         self.db_session.commit()
+        self.blacklist.add(LinkRule(link.id, domain, path, level))
+        # Links that were checked before may be covered by the new rule
+        self.cache.clear(shared=self.settings["share_link_cache"])
 
     def whitelist_url(self, url, parsed_url=None):
         if not (url.lower().startswith("http://") or url.lower().startswith("https://")):
@@ -412,10 +831,12 @@ class LinkCheckerModule(BaseModule):
 
         link = WhitelistedLink(domain, path)
         self.db_session.add(link)
-        self.whitelisted_links.append(link)
         self.db_session.commit()
+        self.whitelist.add(LinkRule(link.id, domain, path))
+        self.cache.clear(shared=self.settings["share_link_cache"])
 
-    def is_blacklisted(self, url, parsed_url=None, sublink=False):
+    @staticmethod
+    def _get_domain_and_path(url, parsed_url=None) -> Optional[tuple[str, str]]:
         if parsed_url is None:
             parsed_url = urllib.parse.urlparse(url)
         domain = parsed_url.netloc.lower()
@@ -423,40 +844,38 @@ class LinkCheckerModule(BaseModule):
         if path == "":
             path = "/"
 
-        domain_split = domain.split(".")
-        if len(domain_split) < 2:
-            return False
+        if len(domain.split(".")) < 2:
+            return None
 
-        for link in self.blacklisted_links:
-            if link.is_subdomain(domain):
-                if link.is_subpath(path):
-                    if not sublink:
-                        return True
+        return domain, path
 
-                    # if it's a sublink, but the blacklisting level is 0, we don't consider it blacklisted
-                    if link.level >= 1:
-                        return True
+    def find_blacklist_rule(self, url, parsed_url=None, sublink=False) -> Optional[LinkRule]:
+        """Returns the most specific blacklisted link the URL matches, if any"""
+        domain_and_path = self._get_domain_and_path(url, parsed_url)
+        if domain_and_path is None:
+            return None
 
-        return False
+        for rule in self.blacklist.find(*domain_and_path):
+            # if it's a sublink, but the blacklisting level is 0, we don't consider it blacklisted
+            if not sublink or rule.level >= 1:
+                return rule
 
-    def is_whitelisted(self, url, parsed_url=None):
-        if parsed_url is None:
-            parsed_url = urllib.parse.urlparse(url)
-        domain = parsed_url.netloc.lower()
-        path = parsed_url.path.lower()
-        if path == "":
-            path = "/"
+        return None
 
-        domain_split = domain.split(".")
-        if len(domain_split) < 2:
-            return False
+    def find_whitelist_rule(self, url, parsed_url=None) -> Optional[LinkRule]:
+        """Returns the most specific whitelisted link the URL matches, if any"""
+        domain_and_path = self._get_domain_and_path(url, parsed_url)
+        if domain_and_path is None:
+            return None
+
+        rules = self.whitelist.find(*domain_and_path)
+        return rules[0] if rules else None
 
-        for link in self.whitelisted_links:
-            if link.is_subdomain(domain):
-                if link.is_subpath(path):
-                    return True
+    def is_blacklisted(self, url, parsed_url=None, sublink=False) -> bool:
+        return self.find_blacklist_rule(url, parsed_url, sublink) is not None
 
-        return False
+    def is_whitelisted(self, url, parsed_url=None) -> bool:
+        return self.find_whitelist_rule(url, parsed_url) is not None
 
     RET_BAD_LINK = -1
     RET_FURTHER_ANALYSIS = 0
@@ -470,18 +889,23 @@ class LinkCheckerModule(BaseModule):
         -1 = Link is bad
         0 = Link needs further analysis
         """
-        if url.url in self.cache:
-            if not self.cache[url.url]:  # link is bad
+        verdict = self.get_cached_verdict(url.url)
+        if verdict is not None:
+            if not verdict:  # link is bad
                 self.counteract_bad_url(url, action, False, False)
                 return self.RET_BAD_LINK
 
             return self.RET_GOOD_LINK
 
-        if self.is_blacklisted(url.url, url.parsed, sublink):
+        blacklist_rule = self.find_blacklist_rule(url.url, url.parsed, sublink)
+        if blacklist_rule is not None:
+            log.debug(f"LinkChecker: {url.url} matches blacklisted link {blacklist_rule}")
             self.counteract_bad_url(url, action, want_to_blacklist=False)
             return self.RET_BAD_LINK
 
-        if self.is_whitelisted(url.url, url.parsed):
+        whitelist_rule = self.find_whitelist_rule(url.url, url.parsed)
+        if whitelist_rule is not None:
+            log.debug(f"LinkChecker: {url.url} matches whitelisted link {whitelist_rule}")
             self.cache_url(url.url, True)
             return self.RET_GOOD_LINK
 
@@ -506,22 +930,46 @@ class LinkCheckerModule(BaseModule):
         except:
             log.exception("LinkChecker unhandled exception while _check_url")
 
-    def _bs_get_site_links(self, html) -> list[str]:
-        # Checks the HTML content of the site and parses out any links
-        urls: list[str] = []
-
-        soup = BeautifulSoup(html, "html.parser")
-
-        for link in soup.find_all("a"):  # get a list of links to external sites
-            url = link.get("href")
-            if url is None:
-                continue
-            if url.startswith("//"):
-                urls.append("http:" + url)
-            elif url.startswith("http://") or url.startswith("https://"):
-                urls.append(url)
-
-        return urls
+    def _get_site_links(self, response: requests.Response, deadline: float) -> list[str]:
+        # Scans the HTML content of the site for links while it's being downloaded, up to the size and link limits
+        max_size = self.settings["max_page_size"] * 1024
+        extractor = LinkExtractor(self.settings["max_page_links"])
+        decoder: Optional[codecs.IncrementalDecoder] = None
+        size = 0
+
+        while True:
+            if time.monotonic() > deadline:
+                log.warning(f"The site took too long to load, only scanned the first {size} bytes")
+                break
+
+            # read1 returns whatever has arrived, waiting at most the read timeout for it, so a site that sends its
+            # page a few bytes at a time can't hold the check past the deadline
+            chunk = response.raw.read1(PAGE_CHUNK_SIZE, decode_content=True)
+            if not chunk:
+                break
+
+            if decoder is None:
+                charset = get_declared_charset(response.headers.get("content-type"), chunk)
+                decoder = codecs.getincrementaldecoder(charset)(errors="replace")
+
+            chunk = chunk[: max_size - size]
+            size += len(chunk)
+            extractor.feed(decoder.decode(chunk))
+
+            if size >= max_size or extractor.full:
+                break
+
+        extractor.close()
+        return list(extractor.links)
+
+    def _is_url_bad(self, url: str, deadline: float) -> bool:
+        """Looks up the URL with the Safe Browsing API, and counts it as safe if the verdict doesn't arrive in time"""
+        assert self.safe_browsing_api is not None
+        try:
+            return self.safe_browsing_api.is_url_bad(url, timeout=max(0.0, deadline - time.monotonic()))
+        except concurrent.futures.TimeoutError:
+            log.warning(f"Safe Browsing API didn't respond in time while checking {url}")
+            return False
 
     def _check_url(self, url, action):
         # XXX: The basic check is currently performed twice on links found in messages. Solve
@@ -531,6 +979,8 @@ class LinkCheckerModule(BaseModule):
         elif res == self.RET_BAD_LINK:
             return
 
+        # The whole check, including the links found on the site, has to finish before the deadline
+        deadline = time.monotonic() + self.settings["check_time_limit"]
         connection_timeout = 2
         read_timeout = 1
         try:
@@ -556,7 +1006,7 @@ class LinkCheckerModule(BaseModule):
             elif res == self.RET_BAD_LINK:
                 return
 
-        if self.safe_browsing_api and self.safe_browsing_api.is_url_bad(redirected_url.url):  # harmful url detected
+        if self.safe_browsing_api and self._is_url_bad(redirected_url.url, deadline):  # harmful url detected
             log.debug("Google Safe Browsing API lists URL")
             self.counteract_bad_url(url, action, want_to_blacklist=False)
             self.counteract_bad_url(redirected_url, want_to_blacklist=False)
@@ -564,59 +1014,36 @@ class LinkCheckerModule(BaseModule):
 
         if "content-type" not in r.headers or not r.headers["content-type"].startswith("text/html"):
             return  # can't analyze non-html content
-        maximum_size = 1024 * 1024 * 10  # 10 MB
-        receive_timeout = 3
 
-        html = ""
+        urls: list[str] = []
         try:
-            response = requests.get(
+            with requests.get(
                 url=url.url,
                 stream=True,
                 timeout=(connection_timeout, read_timeout),
                 headers={"User-Agent": self.bot.user_agent},
-            )
-
-            content_length = response.headers.get("Content-Length")
-            if content_length and int(response.headers.get("Content-Length")) > maximum_size:
-                log.error("This file is too big!")
-                return
-
-            size = 0
-            start = pajbot.utils.now().timestamp()
-
-            for chunk in response.iter_content(1024):
-                if pajbot.utils.now().timestamp() - start > receive_timeout:
-                    log.error("The site took too long to load")
-                    return
-
-                size += len(chunk)
-                if size > maximum_size:
-                    log.error("This file is too big! (fake header)")
-                    return
-                html += str(chunk)
-
+            ) as response:
+                urls = self._get_site_links(response, deadline)
         except requests.exceptions.ConnectTimeout:
             log.warning(f"Connection timed out while checking {url.url}")
             self.cache_url(url.url, True)
             return
-        except requests.exceptions.ReadTimeout:
+        except (requests.exceptions.ReadTimeout, urllib3.exceptions.ReadTimeoutError):
             log.warning(f"Reading timed out while checking {url.url}")
             self.cache_url(url.url, True)
             return
         except:
-            log.exception("Unhandled exception")
+            log.exception("Something went wrong scanning the site for links")
             return
 
         original_url = url
         original_redirected_url = redirected_url
-        urls = []
-
-        try:
-            urls = self._bs_get_site_links(html)
-        except:
-            log.exception("Something went wrong parsing links")
 
         for url in urls:  # check if the site links to anything dangerous
+            if time.monotonic() > deadline:
+                log.warning(f"Ran out of time checking the links on {original_url.url}")
+                return
+
             url = Url(url)
 
             if is_subdomain(url.parsed.netloc, original_url.parsed.netloc):
@@ -636,7 +1063,7 @@ class LinkCheckerModule(BaseModule):
                 r = requests.head(
                     url.url,
                     allow_redirects=True,
-                    timeout=connection_timeout,
+                    timeout=max(0.1, min(connection_timeout, deadline - time.monotonic())),
                     headers={"User-Agent": self.bot.user_agent},
                 )
             except:
@@ -653,7 +1080,7 @@ class LinkCheckerModule(BaseModule):
                 elif res == self.RET_GOOD_LINK:
                     continue
 
-            if self.safe_browsing_api and self.safe_browsing_api.is_url_bad(redirected_url.url):  # harmful url detected
+            if self.safe_browsing_api and self._is_url_bad(redirected_url.url, deadline):  # harmful url detected
                 log.debug(f"Evil sublink {url} by google API")
                 self.counteract_bad_url(original_url, action)
                 self.counteract_bad_url(original_redirected_url)
@@ -828,9 +1255,10 @@ class LinkCheckerModule(BaseModule):
         link = self.db_session.query(BlacklistedLink).filter_by(id=id).one_or_none()
 
         if link:
-            self.blacklisted_links.remove(link)
+            self.blacklist.remove(link.id)
             self.db_session.delete(link)
             self.db_session.commit()
+            self.cache.clear(shared=self.settings["share_link_cache"])
         else:
             bot.whisper(source, "No link with the given id found")
             return False
@@ -857,9 +1285,10 @@ class LinkCheckerModule(BaseModule):
         link = self.db_session.query(WhitelistedLink).filter_by(id=id).one_or_none()
 
         if link:
-            self.whitelisted_links.remove(link)
+            self.whitelist.remove(link.id)
             self.db_session.delete(link)
             self.db_session.commit()
+            self.cache.clear(shared=self.settings["share_link_cache"])
         else:
             bot.whisper(source, "No link with the given id found")
             return False
@@ -1,15 +1,9 @@
 import logging
 import re
-from datetime import timedelta
 
-from pajbot.managers.db import DBManager
-from pajbot.managers.handler import HandlerManager
-from pajbot.models.user import User
+from pajbot.managers.message_filter import FilterCost, FilterPunishment, MessageFilterManager
 from pajbot.modules import BaseModule, ModuleSetting
 
-from sqlalchemy import and_, or_
-from sqlalchemy.sql.functions import count, func
-
 log = logging.getLogger(__name__)
 
 USERNAME_IN_MESSAGE_PATTERN = re.compile("[A-Za-z0-9_]{4,}")
@@ -20,6 +14,7 @@ class MassPingProtectionModule(BaseModule):
     NAME = "Mass Ping Protection"
     DESCRIPTION = "Times out users who post messages that mention too many users at once."
     CATEGORY = "Moderation"
+    FILTER_COST = FilterCost.CHEAP
     SETTINGS = [
         ModuleSetting(
             key="moderation_action",
@@ -92,54 +87,16 @@ class MassPingProtectionModule(BaseModule):
     ]
 
     @staticmethod
-    def count_known_users(usernames):
-        if len(usernames) < 1:
-            return 0
-        with DBManager.create_session_scope() as db_session:
-            # quick EXPLAIN ANALYZE for this query:
-            #
-            # pajbot=# EXPLAIN ANALYZE SELECT count(*) AS count_1
-            # FROM "user"
-            # WHERE ("user".login IN ('randers', 'lul', 'xd', 'penis', 'asd', 'hello', 'world') OR lower("user".name) IN ('randers', 'lul', 'xd', 'penis', 'asd', 'hello', 'world')) AND "user".last_seen IS NOT NULL AND now() - "user".last_seen <= make_interval(weeks := 2);
-            #                                                                              QUERY PLAN
-            # --------------------------------------------------------------------------------------------------------------------------------------------------------------------
-            #  Aggregate  (cost=37.45..37.46 rows=1 width=8) (actual time=0.113..0.113 rows=1 loops=1)
-            #    ->  Bitmap Heap Scan on "user"  (cost=21.53..37.43 rows=5 width=0) (actual time=0.110..0.110 rows=1 loops=1)
-            #          Recheck Cond: ((login = ANY ('{randers,lul,xd,penis,asd,hello,world}'::text[])) OR (lower(name) = ANY ('{randers,lul,xd,penis,asd,hello,world}'::text[])))
-            #          Filter: ((last_seen IS NOT NULL) AND ((now() - last_seen) <= '14 days'::interval))
-            #          Heap Blocks: exact=6
-            #          ->  BitmapOr  (cost=21.53..21.53 rows=14 width=0) (actual time=0.101..0.101 rows=0 loops=1)
-            #                ->  Bitmap Index Scan on user_login_idx  (cost=0.00..10.76 rows=7 width=0) (actual time=0.054..0.054 rows=1 loops=1)
-            #                      Index Cond: (login = ANY ('{randers,lul,xd,penis,asd,hello,world}'::text[]))
-            #                ->  Bitmap Index Scan on user_lower_idx  (cost=0.00..10.76 rows=7 width=0) (actual time=0.046..0.047 rows=6 loops=1)
-            #                      Index Cond: (lower(name) = ANY ('{randers,lul,xd,penis,asd,hello,world}'::text[]))
-            #  Planning Time: 0.092 ms
-            #  Execution Time: 0.140 ms
-            # (12 rows)
-
-            return (
-                db_session.query(User)
-                .with_entities(count())
-                .filter(or_(User.login.in_(usernames), func.lower(User.name).in_(usernames)))
-                .filter(and_(User.last_seen.isnot(None), (func.now() - User.last_seen) <= timedelta(weeks=2)))
-                .scalar()
-            )
-
-    @staticmethod
-    def count_pings(message, source, emote_instances):
+    def count_pings(recent_chatters, message, source, emote_instances):
         potential_users = set()
+        emote_positions = {(e.start, e.end) for e in emote_instances}
 
         for match in USERNAME_IN_MESSAGE_PATTERN.finditer(message):
-            matched_part = match.group()
-            start_idx = match.start()
-            end_idx = match.end()
-
-            potential_emote = next((e for e in emote_instances if e.start == start_idx and e.end == end_idx), None)
             # this "username" is an emote. skip
-            if potential_emote is not None:
+            if match.span() in emote_positions:
                 continue
 
-            matched_part = matched_part.lower()
+            matched_part = match.group().lower()
 
             # this is the sending user. We allow people to "ping" themselves
             if matched_part == source.login or matched_part == source.name.lower():
@@ -149,10 +106,10 @@ class MassPingProtectionModule(BaseModule):
 
         # check how many of the words in `potential_users` refer to known users
         # (i.e. we have seen this username before & user was recently seen in chat)
-        return MassPingProtectionModule.count_known_users(potential_users)
+        return recent_chatters.count_known_users(potential_users)
 
     def determine_timeout_length(self, message, source, emote_instances):
-        ping_count = MassPingProtectionModule.count_pings(message, source, emote_instances)
+        ping_count = MassPingProtectionModule.count_pings(self.bot.recent_chatters, message, source, emote_instances)
         pings_too_many = ping_count - self.settings["max_ping_count"]
 
         if pings_too_many <= 0:
@@ -167,37 +124,36 @@ class MassPingProtectionModule(BaseModule):
         # True if message is bad.
         return self.determine_timeout_length(message, source, emote_instances) > 0
 
-    def on_message(self, source, message, emote_instances, msg_id, **rest) -> bool:
+    def filter_message(self, message):
         if self.bot is None:
-            log.warning("on_message failed because bot is None")
-            return False
+            log.warning("filter_message failed because bot is None")
+            return None
 
-        if source.level >= self.settings["bypass_level"] or source.moderator is True:
-            return True
+        if message.source.level >= self.settings["bypass_level"] or message.source.moderator is True:
+            return None
 
         if self.settings["stream_status"] == "Online" and self.bot.is_online:
-            return True
+            return None
 
         if self.settings["stream_status"] == "Offline" and not self.bot.is_online:
-            return True
+            return None
 
-        timeout_duration = self.determine_timeout_length(message, source, emote_instances)
+        timeout_duration = self.determine_timeout_length(message.message, message.source, message.emote_instances)
 
         if timeout_duration <= 0:
-            return True
+            return None
 
-        self.bot.delete_or_timeout(
-            source,
+        return FilterPunishment.delete_or_timeout(
+            self.bot,
+            message,
             self.settings["moderation_action"],
-            msg_id,
             timeout_duration,
             self.settings["timeout_reason"],
             disable_warnings=self.settings["disable_warnings"],
         )
-        return False
 
     def enable(self, bot):
-        HandlerManager.add_handler("on_message", self.on_message, priority=150, run_if_propagation_stopped=True)
+        MessageFilterManager.add_filter(self)
 
     def disable(self, bot):
-        HandlerManager.remove_handler("on_message", self.on_message)
+        MessageFilterManager.remove_filter(self)
@@ -4,8 +4,7 @@ from typing import TYPE_CHECKING, Optional
 
 import logging
 
-from pajbot.managers.handler import HandlerManager
-from pajbot.models.user import User
+from pajbot.managers.message_filter import FilterCost, FilteredMessage, FilterPunishment, MessageFilterManager
 from pajbot.modules import BaseModule, ModuleSetting
 
 if TYPE_CHECKING:
@@ -19,6 +18,7 @@ class MaxMsgLengthModule(BaseModule):
     NAME = "Maximum Message Length"
     DESCRIPTION = "Times out users who post messages that contain too many characters."
     CATEGORY = "Moderation"
+    FILTER_COST = FilterCost.CHEAP
     SETTINGS = [
         ModuleSetting(
             key="moderation_action",
@@ -82,43 +82,35 @@ class MaxMsgLengthModule(BaseModule):
         ),
     ]
 
-    def on_message(self, source: User, message: str, whisper: bool, msg_id: str, **rest) -> bool:
+    def filter_message(self, message: FilteredMessage) -> Optional[FilterPunishment]:
         if self.bot is None:
             log.warning("Module bot is None")
-            return True
+            return None
 
-        if whisper:
-            return True
-        if source.level >= self.settings["bypass_level"] or source.moderator:
-            return True
+        if message.whisper:
+            return None
+        if message.source.level >= self.settings["bypass_level"] or message.source.moderator:
+            return None
 
         if self.bot.is_online:
-            if len(message) > self.settings["max_msg_length"]:
-                self.bot.delete_or_timeout(
-                    source,
-                    self.settings["moderation_action"],
-                    msg_id,
-                    self.settings["timeout_length"],
-                    self.settings["timeout_reason"],
-                    disable_warnings=self.settings["disable_warnings"],
-                )
-                return False
+            max_msg_length = self.settings["max_msg_length"]
         else:
-            if len(message) > self.settings["max_msg_length_offline"]:
-                self.bot.delete_or_timeout(
-                    source,
-                    self.settings["moderation_action"],
-                    msg_id,
-                    self.settings["timeout_length"],
-                    self.settings["timeout_reason"],
-                    disable_warnings=self.settings["disable_warnings"],
-                )
-                return False
+            max_msg_length = self.settings["max_msg_length_offline"]
 
-        return True
+        if len(message.message) > max_msg_length:
+            return FilterPunishment.delete_or_timeout(
+                self.bot,
+                message,
+                self.settings["moderation_action"],
+                self.settings["timeout_length"],
+                self.settings["timeout_reason"],
+                disable_warnings=self.settings["disable_warnings"],
+            )
+
+        return None
 
     def enable(self, bot: Optional[Bot]) -> None:
-        HandlerManager.add_handler("on_message", self.on_message, priority=150, run_if_propagation_stopped=True)
+        MessageFilterManager.add_filter(self)
 
     def disable(self, bot: Optional[Bot]) -> None:
-        HandlerManager.remove_handler("on_message", self.on_message)
+        MessageFilterManager.remove_filter(self)
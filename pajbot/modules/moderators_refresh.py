@@ -40,7 +40,7 @@ class ModeratorsRefreshModule(BaseModule):
         # TODO if you wanted to improve this: Provide the user with feedback
         #   whether the update succeeded, and if yes, how many users were updated
         bot.whisper(source, "Reloading list of moderators...")
-        bot.action_queue.submit(self._update_moderators)
+        bot.action_queue.submit_to("background", self._update_moderators)
 
         return True
 
@@ -118,6 +118,9 @@ WHERE
                 )
             )
 
+        # Demodded users must not keep their cached moderator status
+        self.bot.user_cache.clear()
+
         log.info(f"Successfully updated {len(moderators)} moderators")
 
     def load_commands(self, **options) -> None:
@@ -284,7 +284,7 @@ class QueUpModule(BaseModule):
             except Exception as e:
                 self.bot.execute_now(on_error, e)
 
-        self.bot.action_queue.submit(action_queue_action)
+        self.bot.action_queue.submit_to("interactive", action_queue_action)
 
     def process_queue_song_to_song_info(self, queue_song: Optional[QueUpQueueSong]) -> Optional[QueUpSongInfo]:
         """Processes a QueUpQueueSong instance (from the API) into a QueUpSongInfo object (for output to chat)"""
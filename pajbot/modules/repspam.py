@@ -1,11 +1,15 @@
 from __future__ import annotations, print_function
 
-from typing import TYPE_CHECKING, Optional
+from typing import TYPE_CHECKING, Callable, Optional
 
 import logging
+import random
+import threading
+import time
+from collections import Counter, deque
+from itertools import islice
 
-from pajbot.managers.handler import HandlerManager
-from pajbot.models.user import User
+from pajbot.managers.message_filter import FilterCost, FilteredMessage, FilterPunishment, MessageFilterManager
 from pajbot.modules.base import BaseModule, ModuleSetting
 
 if TYPE_CHECKING:
@@ -13,6 +17,128 @@ if TYPE_CHECKING:
 
 log = logging.getLogger(__name__)
 
+# Characters that don't count towards a word, e.g. the invisible character used to bypass Twitch's duplicate message check
+IGNORED_CHARACTERS = str.maketrans("", "", "\U000e0000.-")
+
+# Number of consecutive words that make up one shingle of a message
+SHINGLE_SIZE = 3
+
+# The MinHash signature of a message is split into bands. Messages that share at least one band are compared
+NUM_BANDS = 8
+ROWS_PER_BAND = 4
+
+# Maximum number of messages remembered by the cross-message spam detection, no matter how long the window is
+MAX_FINGERPRINTS = 5000
+
+# Only this many of the newest fingerprints in each band are looked at for every message
+MAX_BAND_SCAN = 200
+
+MERSENNE_PRIME = (1 << 61) - 1
+
+
+class SpamFingerprint:
+    def __init__(self, user_id: str, signature: tuple[int, ...], seen_at: float) -> None:
+        self.user_id = user_id
+        self.signature = signature
+        self.seen_at = seen_at
+
+
+class SpamFingerprintStore:
+    """
+    Remembers a MinHash fingerprint of recent messages, to find out how many different users posted a similar
+    message recently. Messages are compared by their word shingles, so a template with a few words changed
+    (e.g. a different name pinged, or some random characters appended) still matches.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic) -> None:
+        self.clock = clock
+
+        # Random but fixed permutations (a * x + b) mod p, one for every row of the signature
+        rng = random.Random(0)
+        self.permutations = [
+            (rng.randrange(1, MERSENNE_PRIME), rng.randrange(0, MERSENNE_PRIME))
+            for _ in range(NUM_BANDS * ROWS_PER_BAND)
+        ]
+
+        self.fingerprints: deque[SpamFingerprint] = deque()
+        self.bands: dict[tuple[int, ...], deque[SpamFingerprint]] = {}
+        self.lock = threading.Lock()
+
+    def signature(self, words: list[str]) -> tuple[int, ...]:
+        if len(words) <= SHINGLE_SIZE:
+            shingles = {hash(tuple(words))}
+        else:
+            shingles = {hash(tuple(words[i : i + SHINGLE_SIZE])) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+        return tuple(min((a * shingle + b) % MERSENNE_PRIME for shingle in shingles) for a, b in self.permutations)
+
+    @staticmethod
+    def band_keys(signature: tuple[int, ...]) -> list[tuple[int, ...]]:
+        return [(band,) + signature[band * ROWS_PER_BAND : (band + 1) * ROWS_PER_BAND] for band in range(NUM_BANDS)]
+
+    def add(
+        self, user_id: str, words: list[str], window: float, min_similarity: float, max_users: Optional[int] = None
+    ) -> int:
+        """
+        Remembers the message, and returns the number of different users (including this one) that posted a message
+        at least min_similarity (0-1) similar to it in the last window seconds.
+        Stops counting at max_users, so a spam wave doesn't make every message compare against the whole wave.
+        Only the newest message of every other user in a band is compared, and only the newest MAX_BAND_SCAN
+        messages of a band are looked at.
+        """
+
+        signature = self.signature(words)
+        band_keys = self.band_keys(signature)
+        now = self.clock()
+
+        with self.lock:
+            self._expire(now - window)
+
+            user_ids = {user_id}
+            # Users whose message we compared, similar or not
+            compared_user_ids = {user_id}
+            for key in band_keys:
+                # Newest first, those are the most likely to be part of the same spam wave
+                for fingerprint in islice(reversed(self.bands.get(key, ())), MAX_BAND_SCAN):
+                    if max_users is not None and len(user_ids) >= max_users:
+                        break
+
+                    if fingerprint.user_id in compared_user_ids:
+                        continue
+                    compared_user_ids.add(fingerprint.user_id)
+
+                    same = sum(1 for x, y in zip(signature, fingerprint.signature) if x == y)
+                    if same / len(signature) >= min_similarity:
+                        user_ids.add(fingerprint.user_id)
+
+            fingerprint = SpamFingerprint(user_id, signature, now)
+            self.fingerprints.append(fingerprint)
+            for key in band_keys:
+                band = self.bands.get(key)
+                if band is None:
+                    band = self.bands[key] = deque()
+                band.append(fingerprint)
+
+            if len(self.fingerprints) > MAX_FINGERPRINTS:
+                self._remove_oldest()
+
+        return len(user_ids)
+
+    def _expire(self, cutoff: float) -> None:
+        # Must be called with self.lock held
+        while self.fingerprints and self.fingerprints[0].seen_at < cutoff:
+            self._remove_oldest()
+
+    def _remove_oldest(self) -> None:
+        # Must be called with self.lock held
+        fingerprint = self.fingerprints.popleft()
+        for key in self.band_keys(fingerprint.signature):
+            band = self.bands[key]
+            # The oldest fingerprint is always first in its bands
+            band.popleft()
+            if not band:
+                del self.bands[key]
+
 
 class RepspamModule(BaseModule):
     ID = __name__.split(".")[-1]
@@ -20,6 +146,7 @@ class RepspamModule(BaseModule):
     DESCRIPTION = "Times out messages containing repetitive spam"
     ENABLED_DEFAULT = False
     CATEGORY = "Moderation"
+    FILTER_COST = FilterCost.CHEAP
     SETTINGS = [
         ModuleSetting(
             key="enabled_by_stream_status",
@@ -74,6 +201,40 @@ class RepspamModule(BaseModule):
             default=2,
             constraints={"min_value": 1, "max_value": 100},
         ),
+        ModuleSetting(
+            key="cross_message_spam",
+            label="Also time out users posting the same spam as many other users (e.g. bot nets)",
+            type="boolean",
+            required=True,
+            default=False,
+        ),
+        ModuleSetting(
+            key="cross_message_min_users",
+            label="Number of users that have to post the same spam before it's timed out",
+            type="number",
+            required=True,
+            placeholder="",
+            default=5,
+            constraints={"min_value": 2, "max_value": 100},
+        ),
+        ModuleSetting(
+            key="cross_message_window",
+            label="Seconds in which the users have to post the same spam",
+            type="number",
+            required=True,
+            placeholder="",
+            default=60,
+            constraints={"min_value": 5, "max_value": 3600},
+        ),
+        ModuleSetting(
+            key="cross_message_similarity",
+            label="How similar the messages have to be to count as the same spam (percent)",
+            type="number",
+            required=True,
+            placeholder="",
+            default=80,
+            constraints={"min_value": 50, "max_value": 100},
+        ),
         ModuleSetting(
             key="timeout_length",
             label="Timeout length",
@@ -101,81 +262,90 @@ class RepspamModule(BaseModule):
         ),
     ]
 
+    def __init__(self, bot: Optional[Bot]) -> None:
+        super().__init__(bot)
+        self.fingerprints = SpamFingerprintStore()
+
     def enable(self, bot: Optional[Bot]) -> None:
-        HandlerManager.add_handler("on_message", self.on_message, priority=150, run_if_propagation_stopped=True)
+        MessageFilterManager.add_filter(self)
 
     def disable(self, bot: Optional[Bot]) -> None:
-        HandlerManager.remove_handler("on_message", self.on_message)
-
-    ignored_characters = ["\U000e0000", ".", "-"]
+        MessageFilterManager.remove_filter(self)
 
     @staticmethod
-    def is_word_ignored(word):
-        for c in RepspamModule.ignored_characters:
-            word = word.replace(c, "")
-
-        word = word.strip()
+    def is_word_ignored(word: str) -> bool:
+        return not word.translate(IGNORED_CHARACTERS).strip()
 
-        return len(word) <= 0
-
-    def on_message(self, source: User, message: str, whisper: bool, **rest) -> bool:
+    def filter_message(self, message: FilteredMessage) -> Optional[FilterPunishment]:
         if self.bot is None:
             log.warning("Module bot is None")
-            return True
+            return None
 
         if self.settings["enabled_by_stream_status"] == "Online Only" and not self.bot.is_online:
-            return True
+            return None
 
         if self.settings["enabled_by_stream_status"] == "Offline Only" and self.bot.is_online:
-            return True
+            return None
 
-        if whisper:
-            return True
+        if message.whisper:
+            return None
 
-        if source.level >= self.settings["bypass_level"] or source.moderator:
-            return True
+        if message.source.level >= self.settings["bypass_level"] or message.source.moderator:
+            return None
 
-        if len(message) < self.settings["min_message_length"]:
+        if len(message.message) < self.settings["min_message_length"]:
             # Message too short
-            return True
+            return None
 
-        word_list = [word for word in message.split(" ") if not self.is_word_ignored(word)]
-        word_set = set(word_list)
+        word_list = [word for word in message.words if not self.is_word_ignored(word)]
 
-        if len(word_set) < self.settings["min_unique_words"]:
-            # There needs to be at least X unique words
-            return True
+        if self.is_repetitive(word_list) or self.is_repeated_by_others(message, word_list):
+            return FilterPunishment.delete_or_timeout(
+                self.bot,
+                message,
+                "Timeout",
+                self.settings["timeout_length"],
+                self.settings["timeout_reason"],
+                disable_warnings=self.settings["disable_warnings"],
+            )
 
+        return None
+
+    def is_repetitive(self, word_list: list[str]) -> bool:
         # create a mapping word -> count/frequency
-        word_freq = {word: word_list.count(word) for word in word_set}
+        word_freq = Counter(word_list)
+
+        if len(word_freq) < self.settings["min_unique_words"]:
+            # There needs to be at least X unique words
+            return False
 
-        # reverse the mapping to frequency -> set of words that repeat that amount
-        # (sorted by frequency, from most frequent to lowest frequent)
-        freq_to_word: dict[int, set[str]] = {}
-        for word, freq in word_freq.items():
-            freq_to_word.setdefault(freq, set()).add(word)
+        # count how many different words repeat each amount of times
+        # ("group of words that repeat the same amount of times")
+        freq_to_num_words = Counter(word_freq.values())
 
-        # iterate frequency -> set of words ("group of words that repeat the same amount of times")
-        for freq, words in freq_to_word.items():
-            if len(words) < self.settings["min_unique_words_in_spam"]:
+        for freq, num_words in freq_to_num_words.items():
+            if num_words < self.settings["min_unique_words_in_spam"]:
                 continue
 
             if freq <= self.settings["max_spam_repetitions"]:
                 continue
 
             # found a group of equally repeating words (a repeating spam) that repeats more than allowed
-            if self.settings["disable_warnings"] is True:
-                self.bot.timeout(
-                    source,
-                    self.settings["timeout_length"],
-                    self.settings["timeout_reason"],
-                )
-            else:
-                self.bot.timeout_warn(
-                    source,
-                    self.settings["timeout_length"],
-                    self.settings["timeout_reason"],
-                )
+            return True
+
+        return False
+
+    def is_repeated_by_others(self, message: FilteredMessage, word_list: list[str]) -> bool:
+        if not self.settings["cross_message_spam"] or not word_list:
             return False
 
-        return True
+        # Remembering the message is the only side effect of this filter, it doesn't change whether the user is punished
+        num_users = self.fingerprints.add(
+            message.source.id,
+            [word.translate(IGNORED_CHARACTERS).lower() for word in word_list],
+            self.settings["cross_message_window"],
+            self.settings["cross_message_similarity"] / 100,
+            max_users=self.settings["cross_message_min_users"],
+        )
+
+        return num_users >= self.settings["cross_message_min_users"]
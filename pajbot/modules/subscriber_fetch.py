@@ -28,7 +28,7 @@ class SubscriberFetchModule(BaseModule):
         # TODO if you wanted to improve this: Provide the user with feedback
         #   whether the update succeeded, and if yes, how many users were updated
         bot.whisper(source, "Reloading list of subscribers...")
-        bot.action_queue.submit(self._update_subscribers)
+        bot.action_queue.submit_to("background", self._update_subscribers)
 
     @time_method
     def _update_subscribers(self) -> None:
@@ -110,6 +110,9 @@ WHERE
                 )
             )
 
+        # Cached users might still have their old subscriber status
+        self.bot.user_cache.clear()
+
         log.info(f"Successfully updated {len(subscribers)} subscribers")
 
     def load_commands(self, **options):
@@ -139,4 +142,6 @@ WHERE
             return
 
         # every 10 minutes, add the subscribers update to the action queue
-        ScheduleManager.execute_every(10 * 60, lambda: self.bot.action_queue.submit(self._update_subscribers))
+        ScheduleManager.execute_every(
+            10 * 60, lambda: self.bot.action_queue.submit_to("background", self._update_subscribers)
+        )
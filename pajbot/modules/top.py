@@ -1,11 +1,10 @@
 import logging
 
 from pajbot.managers.db import DBManager
-from pajbot.managers.redis import RedisManager
+from pajbot.managers.emote import EcountManager
 from pajbot.models.command import Command
 from pajbot.models.user import User
 from pajbot.modules import BaseModule, ModuleSetting
-from pajbot.streamhelper import StreamHelper
 from pajbot.utils import time_since
 
 log = logging.getLogger(__name__)
@@ -109,18 +108,11 @@ class TopModule(BaseModule):
         bot.say(f"Top {self.settings['num_top']} banks: {', '.join(data)}")
 
     def top_emotes(self, bot, **rest):
-        redis = RedisManager.get()
-        streamer = StreamHelper.get_streamer()
         num_emotes = self.settings["num_top_emotes"]
 
-        top_emotes = {
-            emote: emote_count
-            for emote, emote_count in sorted(
-                redis.zscan_iter(f"{streamer}:emotes:count"), key=lambda e_ecount_pair: e_ecount_pair[1], reverse=True
-            )[:num_emotes]
-        }
+        top_emotes = EcountManager.get_top_emotes(num_emotes)
         if top_emotes:
-            top_list_str = ", ".join(f"{emote} ({emote_count:,.0f})" for emote, emote_count in top_emotes.items())
+            top_list_str = ", ".join(f"{emote} ({emote_count:,.0f})" for emote, emote_count in top_emotes)
             bot.say(f"Top {num_emotes} emotes: {top_list_str}")
         else:
             bot.say("No emote data available")
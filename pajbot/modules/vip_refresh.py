@@ -32,7 +32,7 @@ class VIPRefreshModule(BaseModule):
         # TODO if you wanted to improve this: Provide the user with feedback
         #   whether the update succeeded, and if yes, how many users were updated
         bot.whisper(source, "Reloading list of VIPs...")
-        bot.action_queue.submit(self._update_vips)
+        bot.action_queue.submit_to("background", self._update_vips)
 
     @time_method
     def _update_vips(self):
@@ -106,6 +106,9 @@ WHERE
                 )
             )
 
+        # The query above doesn't go through the ORM, so the user cache can't tell whose VIP status changed
+        self.bot.user_cache.clear()
+
         log.info(f"Successfully updated {len(vips)} VIPs")
 
     def load_commands(self, **options):
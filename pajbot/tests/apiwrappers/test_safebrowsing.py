@@ -0,0 +1,107 @@
+import json
+import threading
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+class StubSafeBrowsingHandler(BaseHTTPRequestHandler):
+    def do_POST(self) -> None:
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        urls = [entry["url"] for entry in body["threatInfo"]["threatEntries"]]
+
+        server = self.server
+        with server.lock:  # type: ignore
+            server.requests.append(urls)  # type: ignore
+
+        matches = [
+            {"threatType": "MALWARE", "threat": {"url": url}, "cacheDuration": "300s"} for url in urls if "evil" in url
+        ]
+        response = json.dumps({"matches": matches} if matches else {}).encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubSafeBrowsingHandler)
+    server.requests = []  # type: ignore
+    server.lock = threading.Lock()  # type: ignore
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _make_api(stub_server, **kwargs):
+    from pajbot.apiwrappers.safebrowsing import SafeBrowsingAPI
+
+    return SafeBrowsingAPI("test", base_url=f"http://127.0.0.1:{stub_server.server_port}/v4/", **kwargs)
+
+
+def test_safebrowsing_batches_concurrent_lookups(stub_server):
+    api = _make_api(stub_server, batch_window=0.2)
+    urls = [f"https://site{i}.com/" for i in range(10)] + ["https://evil.com/"]
+    results = {}
+
+    def look_up(url: str) -> None:
+        results[url] = api.is_url_bad(url)
+
+    threads = [threading.Thread(target=look_up, args=(url,)) for url in urls]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(stub_server.requests) == 1
+    assert sorted(stub_server.requests[0]) == sorted(urls)
+    assert results["https://evil.com/"] is True
+    assert not any(bad for url, bad in results.items() if url != "https://evil.com/")
+
+
+def test_safebrowsing_caches_verdicts(stub_server, fake_clock):
+    clock = fake_clock
+    api = _make_api(stub_server, batch_window=0, clock=clock)
+
+    assert api.is_url_bad("https://evil.com/") is True
+    assert api.is_url_bad("https://good.com/") is False
+    assert len(stub_server.requests) == 2
+
+    assert api.is_url_bad("https://evil.com/") is True
+    assert api.is_url_bad("https://good.com/") is False
+    assert len(stub_server.requests) == 2
+    assert list(api.verdict_cache) == ["https://evil.com/", "https://good.com/"]
+
+    # Both verdicts expire after 300 seconds
+    clock.now += 300
+    assert api.is_url_bad("https://evil.com/") is True
+    assert len(stub_server.requests) == 3
+
+
+def test_safebrowsing_splits_large_lookups(stub_server):
+    from pajbot.apiwrappers.safebrowsing import MAX_ENTRIES_PER_REQUEST
+
+    api = _make_api(stub_server, batch_window=0)
+    api.pending = {f"https://site{i}.com/": Future() for i in range(1200)}
+    api.batch_scheduled = True
+    api._send_batch()
+
+    assert [len(urls) for urls in stub_server.requests] == [MAX_ENTRIES_PER_REQUEST, MAX_ENTRIES_PER_REQUEST, 200]
+
+
+def test_parse_cache_duration():
+    from pajbot.apiwrappers.safebrowsing import parse_cache_duration
+
+    assert parse_cache_duration("300s") == 300
+    assert parse_cache_duration("1.5s") == 1.5
+    assert parse_cache_duration("300") is None
+    assert parse_cache_duration(None) is None
@@ -0,0 +1,16 @@
+import pytest
+
+
+class FakeClock:
+    """A monotonic clock that only moves when a test moves it"""
+
+    def __init__(self, now: float = 1000.0) -> None:
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def fake_clock() -> FakeClock:
+    return FakeClock()
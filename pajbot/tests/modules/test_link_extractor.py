@@ -0,0 +1,44 @@
+def test_link_extractor_collects_unique_absolute_links():
+    from pajbot.modules.linkchecker import LinkExtractor
+
+    html = (
+        '<html><body><a href="https://pajlada.se/">a</a><A HREF="//forsen.tv/x">b</A>'
+        '<a href="/relative">c</a><a>d</a><a href="https://pajlada.se/">again</a>'
+        '<a href="http://evil.com/?a=1&amp;b=2">e</a></body></html>'
+    )
+
+    extractor = LinkExtractor(100)
+    # Tags split over several chunks are still found
+    for i in range(0, len(html), 7):
+        extractor.feed(html[i : i + 7])
+    extractor.close()
+
+    assert list(extractor.links) == ["https://pajlada.se/", "http://forsen.tv/x", "http://evil.com/?a=1&b=2"]
+
+
+def test_link_extractor_stops_at_max_links():
+    from pajbot.modules.linkchecker import LinkExtractor
+
+    extractor = LinkExtractor(2)
+    extractor.feed("".join(f'<a href="https://{i}.com/">x</a>' for i in range(10)))
+
+    assert extractor.full
+    assert list(extractor.links) == ["https://0.com/", "https://1.com/"]
+
+
+def test_get_declared_charset():
+    from pajbot.modules.linkchecker import get_declared_charset
+
+    assert get_declared_charset("text/html; charset=ISO-8859-1", b"") == "iso8859-1"
+    assert get_declared_charset('text/html; charset="Shift_JIS"', b"") == "shift_jis"
+    assert get_declared_charset("text/html", b'<html><head><meta charset="windows-1251">') == "cp1251"
+    assert get_declared_charset("text/html", b"<html>") == "utf-8"
+    assert get_declared_charset("text/html; charset=nonsense", b"") == "utf-8"
+    assert get_declared_charset(None, b"") == "utf-8"
+
+    # Codecs that aren't text encodings
+    assert get_declared_charset("text/html; charset=base64", b"") == "utf-8"
+    assert get_declared_charset("text/html; charset=zlib", b"") == "utf-8"
+    assert get_declared_charset("text/html; charset=hex", b"") == "utf-8"
+    assert get_declared_charset("text/html; charset=rot13", b"") == "utf-8"
+    assert get_declared_charset("text/html", b'<meta charset="base64">') == "utf-8"
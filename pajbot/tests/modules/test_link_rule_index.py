@@ -0,0 +1,47 @@
+def test_link_rule_index_matches_domains_and_paths():
+    from pajbot.modules.linkchecker import LinkRule, LinkRuleIndex
+
+    index = LinkRuleIndex()
+    index.add(LinkRule(1, "evil.com", "/"))
+    index.add(LinkRule(2, "www.pajlada.se", "/scam", 1))
+    index.add(LinkRule(3, "a.pajlada.se", "/"))
+
+    assert [rule.id for rule in index.find("evil.com", "/")] == [1]
+    assert [rule.id for rule in index.find("www.evil.com", "/anything")] == [1]
+    assert index.find("notevil.com", "/") == []
+
+    assert [rule.id for rule in index.find("pajlada.se", "/scam")] == [2]
+    assert [rule.id for rule in index.find("pajlada.se", "/scam/deeper")] == [2]
+    assert index.find("pajlada.se", "/scammer") == []
+    assert index.find("pajlada.se", "/") == []
+
+    # The most specific rule comes first
+    assert [rule.id for rule in index.find("a.pajlada.se", "/scam/x")] == [3, 2]
+
+    assert index.remove(2) is not None
+    assert index.remove(2) is None
+    assert [rule.id for rule in index.find("a.pajlada.se", "/scam/x")] == [3]
+    assert len(index) == 2
+
+
+def test_link_rule_index_agrees_with_linear_scan():
+    import itertools
+
+    from pajbot.modules.linkchecker import BlacklistedLink, LinkRule, LinkRuleIndex
+
+    domains = ["pajlada.se", "www.pajlada.se", "a.pajlada.se", "se", "forsen.tv", "b.a.pajlada.se"]
+    paths = ["/", "/a", "/a/", "/a/b", "/ab", "/b/"]
+
+    index = LinkRuleIndex()
+    links = []
+    for link_id, (domain, path) in enumerate(itertools.product(domains, paths)):
+        if link_id % 3 == 0:
+            continue
+        links.append(BlacklistedLink(domain, path, 0))
+        index.add(LinkRule(link_id, domain, path))
+
+    url_domains = ["pajlada.se", "a.pajlada.se", "c.b.a.pajlada.se", "forsen.tv", "xforsen.tv", "pajlada.com"]
+    url_paths = ["/", "/a", "/a/", "/a/b", "/a/bc", "/ab/", "/b", "/c"]
+    for domain, path in itertools.product(url_domains, url_paths):
+        expected = sum(1 for link in links if link.is_subdomain(domain) and link.is_subpath(path))
+        assert len(index.find(domain, path)) == expected, (domain, path)
@@ -0,0 +1,128 @@
+def test_link_checker_cache_expires_verdicts(fake_clock):
+    from pajbot.modules.linkchecker import LinkCheckerCache
+
+    clock = fake_clock
+    cache = LinkCheckerCache(clock=clock)
+    cache.set("https://pajlada.se/", True, 20)
+    cache.set("http://evil.com", False, 600)
+
+    # URLs are normalized
+    assert cache.get("HTTPS://PAJLADA.SE") is True
+    assert cache.get("http://evil.com/") is False
+    assert cache.get("http://other.com") is None
+
+    clock.now += 20
+    assert cache.get("https://pajlada.se") is None
+    assert cache.get("http://evil.com") is False
+
+
+def test_link_checker_cache_sweep(fake_clock):
+    from pajbot.modules.linkchecker import LinkCheckerCache
+
+    clock = fake_clock
+    cache = LinkCheckerCache(clock=clock)
+    cache.set("http://a.com", True, 10)
+    cache.set("http://b.com", True, 30)
+    # A TTL of 0 disables caching
+    cache.set("http://c.com", False, 0)
+    assert len(cache) == 2
+
+    clock.now += 10
+    cache.sweep()
+    assert len(cache) == 1
+    assert cache.get("http://b.com") is True
+
+
+def test_link_checker_cache_evicts_least_recently_used(fake_clock):
+    from pajbot.modules.linkchecker import LinkCheckerCache
+
+    cache = LinkCheckerCache(max_size=2, clock=fake_clock)
+    cache.set("http://a.com", True, 60)
+    cache.set("http://b.com", True, 60)
+    assert cache.get("http://a.com") is True
+    cache.set("http://c.com", True, 60)
+
+    assert cache.get("http://b.com") is None
+    assert cache.get("http://a.com") is True
+    assert cache.get("http://c.com") is True
+
+
+class FakeVerdictRedis:
+    def __init__(self) -> None:
+        self.data: dict[str, str] = {}
+
+    def get(self, key: str):
+        return self.data.get(key)
+
+    def setex(self, key: str, ttl: int, value: str) -> None:
+        self.data[key] = value
+
+    def incr(self, key: str) -> int:
+        self.data[key] = str(int(self.data.get(key, "0")) + 1)
+        return int(self.data[key])
+
+    def pipeline(self):
+        return FakeVerdictPipeline(self)
+
+
+class FakeVerdictPipeline:
+    def __init__(self, redis: FakeVerdictRedis) -> None:
+        self.redis = redis
+        self.results: list = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        pass
+
+    def get(self, key: str) -> None:
+        self.results.append(self.redis.data.get(key))
+
+    def ttl(self, key: str) -> None:
+        self.results.append(600 if key in self.redis.data else -2)
+
+    def execute(self) -> list:
+        return self.results
+
+
+def test_link_checker_cache_clear(fake_clock, monkeypatch):
+    from pajbot.modules.linkchecker import LinkCheckerCache
+    from pajbot.streamhelper import StreamHelper
+
+    monkeypatch.setattr(StreamHelper, "streamer", "pajlada")
+
+    redis = FakeVerdictRedis()
+    cache = LinkCheckerCache(redis=redis, clock=fake_clock)  # type: ignore[arg-type]
+    cache.set("http://evil.com", False, 600, shared=True)
+    cache.set("http://good.com", True, 20)
+    assert len(redis.data) == 1
+
+    # Without sharing, redis is left alone
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.get("http://evil.com") is None
+    assert cache.get("http://evil.com", shared=True) is False
+    assert len(redis.data) == 1
+
+    # Shared verdicts are dropped by moving to a new generation, not by deleting them
+    cache.clear(shared=True)
+    assert len(cache) == 0
+    assert cache.get("http://evil.com", shared=True) is None
+    assert redis.data["pajlada:linkchecker:generation"] == "1"
+    assert len(redis.data) == 2
+
+
+def test_link_checker_cache_sweep_picks_up_new_generation(fake_clock):
+    from pajbot.modules.linkchecker import LinkCheckerCache
+
+    redis = FakeVerdictRedis()
+    cache = LinkCheckerCache(redis=redis, clock=fake_clock)  # type: ignore[arg-type]
+    other_cache = LinkCheckerCache(redis=redis, clock=fake_clock)  # type: ignore[arg-type]
+    cache.set("http://evil.com", False, 600, shared=True)
+    assert other_cache.get("http://evil.com", shared=True) is False
+
+    cache.clear(shared=True)
+    other_cache.delete("http://evil.com")
+    other_cache.sweep()
+    assert other_cache.get("http://evil.com", shared=True) is None
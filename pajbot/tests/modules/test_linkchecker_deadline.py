@@ -0,0 +1,87 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+class SlowDripHandler(BaseHTTPRequestHandler):
+    """Sends the start of a page, and then the rest one byte at a time, each byte well within the read timeout"""
+
+    def do_GET(self) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.end_headers()
+        self.wfile.write(b'<a href="https://pajlada.se/">x</a>')
+        self.wfile.flush()
+
+        try:
+            for _ in range(100000):
+                if self.server.stopped.is_set():  # type: ignore
+                    return
+                self.wfile.write(b" ")
+                self.wfile.flush()
+                time.sleep(0.05)
+        except OSError:
+            pass
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+@pytest.fixture
+def slow_drip_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SlowDripHandler)
+    server.daemon_threads = True
+    server.stopped = threading.Event()  # type: ignore
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.stopped.set()  # type: ignore
+    server.shutdown()
+    server.server_close()
+
+
+def _make_module():
+    from pajbot.modules.linkchecker import LinkCheckerModule
+
+    module = LinkCheckerModule(None)  # type: ignore[arg-type]
+    module.settings = dict(module.default_settings)
+    return module
+
+
+def test_get_site_links_stops_at_deadline(slow_drip_server):
+    import requests
+
+    module = _make_module()
+    started_at = time.monotonic()
+    with requests.get(f"http://127.0.0.1:{slow_drip_server.server_port}/", stream=True, timeout=(2, 1)) as response:
+        links = module._get_site_links(response, started_at + 0.5)
+
+    # The read timeout is the most the check can run past its deadline
+    assert time.monotonic() - started_at < 1.5
+    assert links == ["https://pajlada.se/"]
+
+
+class HangingSafeBrowsingAPI:
+    def __init__(self) -> None:
+        self.timeouts: list = []
+
+    def is_url_bad(self, url: str, timeout=None) -> bool:
+        import concurrent.futures
+
+        self.timeouts.append(timeout)
+        raise concurrent.futures.TimeoutError()
+
+
+def test_safe_browsing_lookup_is_bounded_by_deadline():
+    module = _make_module()
+    api = HangingSafeBrowsingAPI()
+    module.safe_browsing_api = api  # type: ignore[assignment]
+
+    # A verdict that doesn't arrive before the deadline counts as safe
+    assert module._is_url_bad("https://pajlada.se/", time.monotonic() + 3) is False
+    assert 0 < api.timeouts[0] <= 3
+
+    assert module._is_url_bad("https://pajlada.se/", time.monotonic() - 1) is False
+    assert api.timeouts[1] == 0
@@ -0,0 +1,71 @@
+from pajbot.modules.repspam import RepspamModule, SpamFingerprintStore
+
+TEMPLATE = "join my totally legit giveaway at scam dot com to win a free gaming chair today only hurry up".split(" ")
+
+
+def test_is_word_ignored():
+    assert RepspamModule.is_word_ignored("")
+    assert RepspamModule.is_word_ignored("...")
+    assert RepspamModule.is_word_ignored("-.\U000e0000")
+    assert not RepspamModule.is_word_ignored("Kappa")
+    assert not RepspamModule.is_word_ignored(".a.")
+
+
+def test_same_template_from_many_users(fake_clock):
+    store = SpamFingerprintStore(clock=fake_clock)
+
+    for i in range(5):
+        assert store.add(f"user{i}", TEMPLATE, 60, 0.8) == i + 1
+
+    # Appending a random word still matches
+    assert store.add("user5", TEMPLATE + ["xqzj"], 60, 0.5) == 6
+
+
+def test_same_user_and_different_messages_count_once(fake_clock):
+    store = SpamFingerprintStore(clock=fake_clock)
+
+    for _ in range(5):
+        assert store.add("user", TEMPLATE, 60, 0.8) == 1
+
+    assert store.add("other", "completely different message about the stream and the game".split(" "), 60, 0.8) == 1
+
+
+def test_fingerprints_expire(fake_clock):
+    clock = fake_clock
+    store = SpamFingerprintStore(clock=clock)
+
+    store.add("user1", TEMPLATE, 60, 0.8)
+    clock.now += 30
+    store.add("user2", TEMPLATE, 60, 0.8)
+    clock.now += 31
+    assert store.add("user3", TEMPLATE, 60, 0.8) == 2
+
+    clock.now += 120
+    assert store.add("user4", TEMPLATE, 60, 0.8) == 1
+    assert len(store.fingerprints) == 1
+    assert len(store.bands) == 8
+
+
+def test_counting_stops_at_max_users(fake_clock):
+    store = SpamFingerprintStore(clock=fake_clock)
+
+    for i in range(50):
+        assert store.add(f"user{i}", TEMPLATE, 60, 0.8, max_users=5) == min(i + 1, 5)
+
+    assert store.add("user50", TEMPLATE, 60, 0.8) == 51
+
+
+def test_band_scan_is_bounded(fake_clock):
+    from pajbot.modules.repspam import MAX_BAND_SCAN
+
+    store = SpamFingerprintStore(clock=fake_clock)
+
+    # Two accounts alternating the same spam count as two users, however many messages they send
+    for i in range(100):
+        assert store.add(f"user{i % 2}", TEMPLATE, 60, 0.8) == min(i + 1, 2)
+
+    for i in range(MAX_BAND_SCAN):
+        store.add(f"other{i}", TEMPLATE, 60, 0.8)
+
+    # Only the newest fingerprints of every band are looked at
+    assert store.add("last", TEMPLATE, 60, 0.8) == MAX_BAND_SCAN + 1
@@ -79,3 +79,14 @@ def test_substitutions(input_message: str, expected_substitutions: dict[str, Sub
     from pajbot.models.action import get_substitutions
 
     assert get_substitutions(input_message, None, method_mapping=method_mapping) == expected_substitutions
+
+
+@pytest.mark.parametrize(
+    "input_ttl,expected", [(30, 30), ("30", 30), (0, 0), ("xd", None), (None, None), ("1.5", None), ([], None)]
+)
+def test_parse_urlfetch_cache_ttl(input_ttl, expected: Optional[int]) -> None:
+    from pajbot.models.action import ActionParser, SayAction
+
+    action = ActionParser.parse(dict_data={"type": "say", "message": "xD", "urlfetch_cache_ttl": input_ttl})
+    assert isinstance(action, SayAction)
+    assert action.urlfetch_cache_ttl == expected
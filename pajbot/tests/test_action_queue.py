@@ -0,0 +1,115 @@
+import threading
+
+import pytest
+
+
+def _blocking_pool(shed_policy, max_queued=2):
+    from pajbot.action_queue import ActionPool, PoolOptions
+
+    pool = ActionPool("test", PoolOptions(max_workers=1, max_queued=max_queued, shed_policy=shed_policy))
+    release = threading.Event()
+    started = threading.Event()
+
+    def block() -> None:
+        started.set()
+        release.wait(5)
+
+    blocker = pool.submit(block, (), {})
+    assert started.wait(5)
+    return pool, release, blocker
+
+
+def test_action_pool_rejects_new_tasks_when_full():
+    from pajbot.action_queue import ActionQueueFull, ShedPolicy
+
+    pool, release, blocker = _blocking_pool(ShedPolicy.REJECT_NEW)
+    first = pool.submit(lambda: 1, (), {})
+    second = pool.submit(lambda: 2, (), {})
+    rejected = pool.submit(lambda: 3, (), {})
+
+    with pytest.raises(ActionQueueFull):
+        rejected.result(0)
+
+    release.set()
+    assert first.result(5) == 1
+    assert second.result(5) == 2
+
+
+def test_action_pool_sheds_oldest_task_when_full():
+    from pajbot.action_queue import ActionQueueFull, ShedPolicy
+
+    pool, release, blocker = _blocking_pool(ShedPolicy.SHED_OLDEST)
+    oldest = pool.submit(lambda: 1, (), {})
+    pool.submit(lambda: 2, (), {})
+    newest = pool.submit(lambda: 3, (), {})
+
+    with pytest.raises(ActionQueueFull):
+        oldest.result(0)
+
+    release.set()
+    assert newest.result(5) == 3
+
+
+def test_action_pool_records_task_stats():
+    from pajbot.action_queue import ShedPolicy
+
+    def fail() -> None:
+        raise ValueError("xd")
+
+    pool, release, blocker = _blocking_pool(ShedPolicy.REJECT_NEW)
+    failing = pool.submit(fail, (), {})
+    release.set()
+    with pytest.raises(ValueError):
+        failing.result(5)
+    blocker.result(5)
+
+    stats = pool.jsonify()
+    assert stats["workers"] == 1
+    fail_stats = [task_stats for task_type, task_stats in stats["tasks"].items() if task_type.endswith("fail")][0]
+    assert fail_stats["submitted"] == 1
+    assert fail_stats["failed"] == 1
+    assert fail_stats["run_time"]["count"] == 1
+    assert fail_stats["wait_time"]["count"] == 1
+
+
+def test_histogram_buckets():
+    from pajbot.action_queue import Histogram
+
+    histogram = Histogram((1, 5))
+    histogram.observe(0.5)
+    histogram.observe(1)
+    histogram.observe(3)
+    histogram.observe(10)
+
+    assert histogram.jsonify()["buckets"] == [[1, 2], [5, 1], ["+Inf", 1]]
+    assert histogram.max == 10
+
+
+def test_action_queue_publishes_pool_and_scheduled_job_stats(monkeypatch):
+    import json
+
+    from pajbot.action_queue import ActionQueue, PoolOptions, ShedPolicy
+    from pajbot.managers.redis import RedisManager
+    from pajbot.managers.schedule import ScheduleManager, Scheduler
+
+    class FakeRedis:
+        def __init__(self) -> None:
+            self.values: dict[str, str] = {}
+
+        def set(self, key, value, ex=None) -> None:
+            self.values[key] = value
+
+    redis = FakeRedis()
+    monkeypatch.setattr(RedisManager, "redis", redis)
+    scheduler = Scheduler()
+    monkeypatch.setattr(ScheduleManager, "scheduler", scheduler)
+    with scheduler.lock:
+        scheduler._get_stats("refresh").record(0.5, 2.0, False)
+
+    action_queue = ActionQueue({"test": PoolOptions(max_workers=1, max_queued=1, shed_policy=ShedPolicy.REJECT_NEW)})
+    action_queue.publish_stats()
+
+    (data,) = [json.loads(value) for value in redis.values.values()]
+    assert "test" in data["pools"]
+    assert data["scheduled_jobs"]["refresh"]["runs"] == 1
+    assert data["scheduled_jobs"]["refresh"]["max_lag"] == 0.5
@@ -0,0 +1,93 @@
+import pytest
+
+
+def make_banphrases():
+    from pajbot.models.banphrase import Banphrase
+
+    options = [
+        dict(phrase="forsen", operator="contains"),
+        dict(phrase="Kappa", operator="contains", case_sensitive=True, length=600),
+        dict(phrase="hello", operator="startswith"),
+        dict(phrase="bye", operator="endswith", permanent=True),
+        dict(phrase="exact message", operator="exact"),
+        dict(phrase="ÉCOLE", operator="contains", remove_accents=True),
+        dict(phrase="cafe", operator="exact", remove_accents=True, length=30),
+        dict(phrase=r"\bbad(word)?s?\b", operator="regex", length=1200),
+        dict(phrase=r"(a)\1{3}", operator="regex"),
+        dict(phrase=r"[unclosed", operator="regex"),
+        dict(phrase="SeCrEt", operator="regex", case_sensitive=True),
+        dict(phrase="forsen", operator="endswith", sub_immunity=True, length=900),
+        dict(phrase="whatever", operator="nonexistent"),
+    ]
+
+    banphrases = []
+    for index, banphrase_options in enumerate(options):
+        banphrase = Banphrase(**{"case_sensitive": False, **banphrase_options})
+        banphrase.id = index + 1
+        banphrases.append(banphrase)
+
+    return banphrases
+
+
+def check_message_naive(banphrases, message, user):
+    # BanphraseManager.check_message before it was compiled
+    matched_banphrase = None
+    for banphrase in banphrases:
+        if banphrase.match(message, user):
+            if not matched_banphrase or banphrase.greater_than(matched_banphrase):
+                matched_banphrase = banphrase
+
+    return matched_banphrase or False
+
+
+MESSAGES = [
+    "",
+    "forsen",
+    "FORSEN is here",
+    "Kappa",
+    "kappa",
+    "hello there",
+    "oh hello",
+    "goodbye",
+    "BYE ",
+    "exact message",
+    "Exact Message",
+    "exact message!",
+    "école",
+    "  Café ",
+    "cafe",
+    "cafes",
+    "badwords",
+    "a badword here forsen",
+    "aaaa",
+    "aaa",
+    "secret",
+    "SeCrEt",
+    "hello forsen bye",
+    "whatever",
+]
+
+
+class FakeUser:
+    def __init__(self, subscriber: bool) -> None:
+        self.subscriber = subscriber
+
+
+@pytest.mark.parametrize("message", MESSAGES)
+@pytest.mark.parametrize("user", [None, FakeUser(False), FakeUser(True)])
+def test_compiled_banphrases_match_naive_check(message, user):
+    from pajbot.models.banphrase import CompiledBanphrases
+
+    banphrases = make_banphrases()
+    matcher = CompiledBanphrases(banphrases)
+
+    assert matcher.check_message(message, user) is check_message_naive(banphrases, message, user)
+
+
+def test_aho_corasick_finds_overlapping_patterns():
+    from pajbot.utils import AhoCorasick
+
+    automaton = AhoCorasick([("he", 1), ("she", 2), ("his", 3), ("hers", 4)])
+
+    assert sorted(automaton.iter("ushers")) == [(1, 4, 2), (2, 4, 1), (2, 6, 4)]
+    assert list(automaton.iter("xyz")) == []
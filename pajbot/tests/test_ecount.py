@@ -0,0 +1,313 @@
+import time
+
+import pytest
+
+
+class FakeEmoteRedis:
+    def __init__(self):
+        self.zsets = {}
+        self.values = {}
+        self.num_top_emotes_reads = 0
+        self.script_calls = []
+        # Called with the queued commands when a pipeline is executed, before they are applied
+        self.on_pipeline_execute = None
+
+    def zincrby(self, key, amount, member):
+        zset = self.zsets.setdefault(key, {})
+        zset[member] = zset.get(member, 0) + amount
+        return zset[member]
+
+    def zadd(self, key, mapping, nx=False):
+        zset = self.zsets.setdefault(key, {})
+        for member, score in mapping.items():
+            if nx and member in zset:
+                continue
+            zset[member] = score
+
+    def zscore(self, key, member):
+        return self.zsets.get(key, {}).get(member)
+
+    def zrem(self, key, member):
+        self.zsets.get(key, {}).pop(member, None)
+
+    def zrevrange(self, key, start, end, withscores=False):
+        self.num_top_emotes_reads += 1
+        members = sorted(self.zsets.get(key, {}).items(), key=lambda item: item[1], reverse=True)[start : end + 1]
+        return [(member, float(score)) for member, score in members]
+
+    def zrangebyscore(self, key, min, max):
+        return [member for member, score in self.zsets.get(key, {}).items() if score <= max]
+
+    def zscan_iter(self, key):
+        yield from list(self.zsets.get(key, {}).items())
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value):
+        self.values[key] = str(value)
+
+    def setex(self, key, ttl, value):
+        self.values[key] = value
+
+    def exists(self, key):
+        return int(key in self.values)
+
+    def register_script(self, script):
+        return FakeRemoveStaleEmotesScript(self)
+
+    def pipeline(self):
+        return FakeEmotePipeline(self)
+
+
+class FakeRemoveStaleEmotesScript:
+    """Does what the Lua script registered by EcountManager does"""
+
+    def __init__(self, redis):
+        self.redis = redis
+
+    def __call__(self, keys, args):
+        self.redis.script_calls.append((keys, args))
+        count_key, last_used_key, epm_record_key = keys
+        cutoff, min_count, *emote_codes = args
+
+        removed = 0
+        for emote_code in emote_codes:
+            last_used = self.redis.zscore(last_used_key, emote_code)
+            count = self.redis.zscore(count_key, emote_code)
+            if (last_used is None or last_used <= cutoff) and (count is None or count < min_count):
+                for key in keys:
+                    self.redis.zrem(key, emote_code)
+                removed += 1
+        return removed
+
+
+class FakeEmotePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def zincrby(self, *args):
+        self.commands.append(("zincrby", args, {}))
+
+    def zadd(self, *args, **kwargs):
+        self.commands.append(("zadd", args, kwargs))
+
+    def execute(self):
+        if self.redis.on_pipeline_execute is not None:
+            self.redis.on_pipeline_execute(self.commands)
+        for name, args, kwargs in self.commands:
+            getattr(self.redis, name)(*args, **kwargs)
+
+
+@pytest.fixture
+def emote_redis(monkeypatch):
+    from pajbot.managers.handler import HandlerManager
+    from pajbot.managers.redis import RedisManager
+    from pajbot.managers.schedule import ScheduleManager
+    from pajbot.streamhelper import StreamHelper
+
+    redis = FakeEmoteRedis()
+    redis.scheduled_jobs = []
+    redis.jobs_run_now = []
+    monkeypatch.setattr(RedisManager, "redis", redis)
+    monkeypatch.setattr(StreamHelper, "streamer", "pajlada")
+    monkeypatch.setattr(
+        ScheduleManager,
+        "execute_every",
+        lambda interval, method, *args, **kwargs: redis.scheduled_jobs.append((interval, method)),
+    )
+    monkeypatch.setattr(
+        ScheduleManager, "execute_now", lambda method, *args, **kwargs: redis.jobs_run_now.append(method)
+    )
+    monkeypatch.setattr(HandlerManager, "add_handler", lambda *args, **kwargs: None)
+    return redis
+
+
+def _emote_counts(**counts):
+    from pajbot.models.emote import EmoteInstanceCount
+
+    return {emote_code: EmoteInstanceCount(count, None, []) for emote_code, count in counts.items()}
+
+
+def test_ecount_flushes_every_few_seconds(emote_redis):
+    from pajbot.managers.emote import ECOUNT_FLUSH_INTERVAL, ECOUNT_RETENTION_INTERVAL, EcountManager
+
+    manager = EcountManager()
+    assert emote_redis.scheduled_jobs == [(ECOUNT_FLUSH_INTERVAL, manager.flush)]
+
+    emote_redis.scheduled_jobs.clear()
+    manager = EcountManager(retention_days=30, retention_min_count=10)
+    assert emote_redis.scheduled_jobs == [
+        (ECOUNT_FLUSH_INTERVAL, manager.flush),
+        (ECOUNT_RETENTION_INTERVAL, manager.prune_stale_emotes),
+    ]
+
+
+def test_ecount_buffers_counts_until_flush(emote_redis):
+    from pajbot.managers.emote import EcountManager
+
+    manager = EcountManager()
+
+    manager.handle_emotes(_emote_counts(Kappa=2, PogChamp=1))
+    manager.handle_emotes(_emote_counts(Kappa=1))
+    manager.handle_emotes({})
+    assert emote_redis.zsets == {}
+    assert manager.get_emote_count("Kappa") == 3
+    assert manager.get_emote_count("LUL") is None
+
+    manager.flush()
+    assert emote_redis.zsets["pajlada:emotes:count"] == {"Kappa": 3, "PogChamp": 1}
+    assert set(emote_redis.zsets["pajlada:emotes:last_used"]) == {"Kappa", "PogChamp"}
+    assert not manager.pending
+    assert not manager.flushing
+    assert manager.get_emote_count("Kappa") == 3
+
+    # Nothing to write, nothing is sent to redis
+    flushed_commands = []
+    emote_redis.on_pipeline_execute = flushed_commands.append
+    manager.flush()
+    assert flushed_commands == []
+
+
+def test_ecount_flushes_after_message_limit(emote_redis):
+    from pajbot.managers.emote import ECOUNT_FLUSH_MESSAGES, EcountManager
+
+    manager = EcountManager()
+
+    for _ in range(ECOUNT_FLUSH_MESSAGES - 1):
+        manager.handle_emotes(_emote_counts(Kappa=1))
+    assert emote_redis.jobs_run_now == []
+
+    manager.handle_emotes(_emote_counts(Kappa=1))
+    assert emote_redis.jobs_run_now == [manager.flush]
+    assert manager.num_pending_messages == 0
+
+    # The flush itself runs off the message thread
+    assert emote_redis.zsets == {}
+    manager.flush()
+    assert emote_redis.zsets["pajlada:emotes:count"] == {"Kappa": ECOUNT_FLUSH_MESSAGES}
+
+
+def test_ecount_counts_stay_visible_while_flushing(emote_redis):
+    from pajbot.managers.emote import EcountManager
+
+    manager = EcountManager()
+    manager.handle_emotes(_emote_counts(Kappa=2))
+
+    # flush logs and swallows exceptions, so look at the state during the flush afterwards
+    during_flush = []
+
+    def add_during_flush(commands):
+        during_flush.append((dict(manager.pending), dict(manager.flushing)))
+        manager.handle_emotes(_emote_counts(Kappa=1))
+        during_flush.append(manager.get_emote_count("Kappa"))
+
+    emote_redis.on_pipeline_execute = add_during_flush
+    manager.flush()
+    emote_redis.on_pipeline_execute = None
+
+    # The counts being written moved from pending to flushing, and new messages are counted in pending
+    assert during_flush == [({}, {"Kappa": 2}), 3]
+    assert not manager.flushing
+    assert manager.pending == {"Kappa": 1}
+    assert manager.get_emote_count("Kappa") == 3
+
+    manager.flush()
+    assert emote_redis.zsets["pajlada:emotes:count"] == {"Kappa": 3}
+
+
+def test_ecount_failed_flush_is_retried(emote_redis):
+    from pajbot.managers.emote import EcountManager
+
+    manager = EcountManager()
+    manager.handle_emotes(_emote_counts(Kappa=2))
+
+    def fail(commands):
+        raise ConnectionError("redis went away")
+
+    emote_redis.on_pipeline_execute = fail
+    manager.flush()
+    assert not manager.flushing
+    assert manager.pending == {"Kappa": 2}
+    assert manager.get_emote_count("Kappa") == 2
+
+    emote_redis.on_pipeline_execute = None
+    manager.flush()
+    assert emote_redis.zsets["pajlada:emotes:count"] == {"Kappa": 2}
+
+
+def test_get_top_emotes_is_cached(emote_redis):
+    from pajbot.managers.emote import EcountManager
+
+    emote_redis.zsets["pajlada:emotes:count"] = {"Kappa": 10, "PogChamp": 30, "LUL": 20}
+
+    assert EcountManager.get_top_emotes(2) == [("PogChamp", 30), ("LUL", 20)]
+    assert EcountManager.get_top_emotes() == [("PogChamp", 30), ("LUL", 20), ("Kappa", 10)]
+    assert emote_redis.num_top_emotes_reads == 1
+
+    # Served from the cache until it expires
+    emote_redis.zsets["pajlada:emotes:count"]["Kappa"] = 40
+    assert EcountManager.get_top_emotes(1) == [("PogChamp", 30)]
+    assert emote_redis.num_top_emotes_reads == 1
+
+    del emote_redis.values["pajlada:cache:top_emotes"]
+    assert EcountManager.get_top_emotes(1) == [("Kappa", 40)]
+    assert emote_redis.num_top_emotes_reads == 2
+
+
+def test_prune_stale_emotes(emote_redis):
+    from pajbot.managers.emote import EcountManager
+
+    day = 24 * 60 * 60
+    now = time.time()
+    manager = EcountManager(retention_days=30, retention_min_count=10)
+
+    emote_redis.zsets["pajlada:emotes:count"] = {"Kappa": 5, "PogChamp": 500, "LUL": 5, "Keepo": 5}
+    emote_redis.zsets["pajlada:emotes:last_used"] = {"Kappa": now - 40 * day}
+    emote_redis.zsets["pajlada:emotes:epmrecord"] = {"Kappa": 3, "LUL": 2}
+
+    # The first run only starts keeping track of emotes that were counted before last used times were stored
+    manager.prune_stale_emotes()
+    last_used = emote_redis.zsets["pajlada:emotes:last_used"]
+    assert last_used["Kappa"] == now - 40 * day
+    assert set(last_used) == {"Kappa", "PogChamp", "LUL", "Keepo"}
+    assert emote_redis.script_calls == []
+
+    last_used["PogChamp"] = now - 40 * day
+    last_used["LUL"] = now - 20 * day
+    manager.prune_stale_emotes()
+
+    # Only emotes that are rarely used and haven't been used in 30 days are removed
+    assert len(emote_redis.script_calls) == 1
+    keys, args = emote_redis.script_calls[0]
+    assert keys == ["pajlada:emotes:count", "pajlada:emotes:last_used", "pajlada:emotes:epmrecord"]
+    assert args[1] == 10
+    assert sorted(args[2:]) == ["Kappa", "PogChamp"]
+    assert set(emote_redis.zsets["pajlada:emotes:count"]) == {"PogChamp", "LUL", "Keepo"}
+    assert set(emote_redis.zsets["pajlada:emotes:last_used"]) == {"PogChamp", "LUL", "Keepo"}
+    assert set(emote_redis.zsets["pajlada:emotes:epmrecord"]) == {"LUL"}
+
+
+def test_prune_stale_emotes_rechecks_emotes_used_while_pruning(emote_redis):
+    from pajbot.managers.emote import EcountManager
+
+    day = 24 * 60 * 60
+    manager = EcountManager(retention_days=30, retention_min_count=10)
+    emote_redis.values["pajlada:emotes:last_used_seeded"] = "1"
+    emote_redis.zsets["pajlada:emotes:count"] = {"Kappa": 5}
+    emote_redis.zsets["pajlada:emotes:last_used"] = {"Kappa": time.time() - 40 * day}
+
+    # Kappa is used after the stale emotes were listed, but before the script runs
+    zrangebyscore = emote_redis.zrangebyscore
+
+    def use_kappa(*args):
+        stale_emote_codes = zrangebyscore(*args)
+        emote_redis.zadd("pajlada:emotes:last_used", {"Kappa": time.time()})
+        return stale_emote_codes
+
+    emote_redis.zrangebyscore = use_kappa
+    manager.prune_stale_emotes()
+
+    assert len(emote_redis.script_calls) == 1
+    assert emote_redis.zsets["pajlada:emotes:count"] == {"Kappa": 5}
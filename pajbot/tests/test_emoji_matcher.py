@@ -0,0 +1,33 @@
+def test_emoji_matcher_longest_match():
+    from pajbot.utils import EmojiMatcher
+
+    matcher = EmojiMatcher(["👍", "👍🏽", "🇿🇼", "🇿"])
+
+    assert matcher.find("👍🏽👍 🇿🇼") == [(0, 2, "👍🏽"), (2, 3, "👍"), (4, 6, "🇿🇼")]
+    # A prefix of a longer emoji that is an emoji itself
+    assert matcher.find("🇿x") == [(0, 1, "🇿")]
+    assert matcher.count("a👍b👍c") == 2
+
+
+def test_emoji_matcher_no_emoji():
+    from pajbot.utils import EmojiMatcher
+
+    matcher = EmojiMatcher(["👍", "🏴󠁧󠁢󠁥󠁮󠁧󠁿"])
+
+    assert matcher.find("") == []
+    assert matcher.find("just a normal message") == []
+    assert matcher.find("Grüße 테스트계정420") == []
+    assert not matcher.contains("🏴")
+    assert matcher.contains("x🏴󠁧󠁢󠁥󠁮󠁧󠁿")
+
+
+def test_emoji_matcher_all_emoji():
+    from pajbot.emoji import ALL_EMOJI, EMOJI_MATCHER
+
+    for emoji in ALL_EMOJI:
+        assert EMOJI_MATCHER.find(f"a {emoji} b") == [(2, 2 + len(emoji), emoji)]
+
+    # Matches the old substring check
+    messages = ["hello", "Kappa 123", "#1 ©", "Grüße", "👍🏽👍🏽", "1️⃣ 2️⃣", "x‍y"]
+    for message in messages:
+        assert EMOJI_MATCHER.contains(message) == any(emoji in message for emoji in ALL_EMOJI)
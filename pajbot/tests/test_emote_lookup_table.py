@@ -0,0 +1,28 @@
+def make_emote(code: str, provider: str):
+    from pajbot.models.emote import Emote
+
+    return Emote(code=code, provider=provider, id=f"{provider}-{code}", urls={}, max_width=28, max_height=28)
+
+
+def test_emote_lookup_table_precedence():
+    from pajbot.managers.emote import EmoteLookupTable
+
+    ffz_channel = {"Kappa": make_emote("Kappa", "ffz")}
+    bttv_global = {"Kappa": make_emote("Kappa", "bttv"), "FeelsBadMan": make_emote("FeelsBadMan", "bttv")}
+
+    lookup_table = EmoteLookupTable([ffz_channel, bttv_global])
+
+    assert lookup_table.match("Kappa") is ffz_channel["Kappa"]
+    assert lookup_table.match("FeelsBadMan") is bttv_global["FeelsBadMan"]
+
+
+def test_emote_lookup_table_no_match():
+    from pajbot.managers.emote import EmoteLookupTable
+
+    lookup_table = EmoteLookupTable([{"Kappa": make_emote("Kappa", "ffz")}])
+
+    assert lookup_table.match("") is None
+    assert lookup_table.match("kappa") is None
+    assert lookup_table.match("Kapp") is None
+    assert lookup_table.match("Kappa123") is None
+    assert EmoteLookupTable([]).match("Kappa") is None
@@ -18,3 +18,167 @@ def test_parse_kvi_arguments(input_str: str, expected: tuple[Optional[str], int]
     from pajbot.managers.kvi import parse_kvi_arguments
 
     assert parse_kvi_arguments(input_str) == expected
+
+
+@pytest.mark.parametrize("raw_value,expected", [(None, 0), ("", 0), ("5", 5), ("-3", -3), ("xd", 0), ("1.5", 0)])
+def test_parse_kvi_value(raw_value: Optional[str], expected: int) -> None:
+    from pajbot.managers.kvi import parse_kvi_value
+
+    assert parse_kvi_value(raw_value) == expected
+
+
+class FakeKVIRedis:
+    def __init__(self) -> None:
+        self.hashes: dict[str, dict[str, str]] = {}
+        self.num_reads = 0
+
+    def hget(self, key, field):
+        self.num_reads += 1
+        return self.hashes.get(key, {}).get(field)
+
+    def hmget(self, key, fields):
+        self.num_reads += 1
+        return [self.hashes.get(key, {}).get(field) for field in fields]
+
+    def hset(self, key, field, value):
+        self.hashes.setdefault(key, {})[field] = str(value)
+
+    def hincrby(self, key, field, amount):
+        from redis.exceptions import ResponseError
+
+        values = self.hashes.setdefault(key, {})
+        try:
+            new_value = int(values.get(field, "0")) + amount
+        except ValueError:
+            raise ResponseError("hash value is not an integer")
+        values[field] = str(new_value)
+        return new_value
+
+    def pipeline(self):
+        return FakeKVIPipeline(self)
+
+
+class FakeKVIPipeline:
+    def __init__(self, redis: FakeKVIRedis) -> None:
+        self.redis = redis
+        self.commands: list = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        pass
+
+    def hincrby(self, key, field, amount) -> None:
+        self.commands.append((key, field, amount))
+
+    def execute(self, raise_on_error=True):
+        results = []
+        for command in self.commands:
+            try:
+                results.append(self.redis.hincrby(*command))
+            except Exception as e:
+                if raise_on_error:
+                    raise
+                results.append(e)
+        return results
+
+
+@pytest.fixture
+def kvi_redis(monkeypatch):
+    from pajbot.managers.handler import HandlerManager
+    from pajbot.managers.redis import RedisManager
+    from pajbot.managers.schedule import ScheduleManager
+    from pajbot.streamhelper import StreamHelper
+
+    redis = FakeKVIRedis()
+    monkeypatch.setattr(RedisManager, "redis", redis)
+    monkeypatch.setattr(StreamHelper, "streamer", "pajlada")
+    monkeypatch.setattr(ScheduleManager, "execute_every", lambda *args, **kwargs: None)
+    monkeypatch.setattr(HandlerManager, "add_handler", lambda *args, **kwargs: None)
+    return redis
+
+
+def test_kvi_inc_resets_non_integer_values(kvi_redis) -> None:
+    from pajbot.managers.kvi import KVIManager
+
+    kvi = KVIManager()
+    assert kvi["foo"].inc() == 1
+    assert kvi["foo"].inc(5) == 6
+    assert kvi["foo"].dec(2) == 4
+
+    kvi_redis.hset("pajlada:kvi", "foo", "xd")
+    assert kvi["foo"].get() == 0
+    assert kvi["foo"].inc(3) == 3
+    assert kvi_redis.hashes["pajlada:kvi"]["foo"] == "3"
+
+
+def test_kvi_coalesces_and_flushes(kvi_redis) -> None:
+    from pajbot.managers.kvi import KVIManager
+
+    kvi = KVIManager(coalesced_ids=["spam"])
+    kvi_redis.hset("pajlada:kvi", "spam", 10)
+
+    assert kvi["spam"].inc() == 11
+    assert kvi["spam"].inc() == 12
+    assert kvi["spam"].dec(5) == 7
+    # Only the first change reads the current value, nothing is written until the flush
+    assert kvi_redis.num_reads == 1
+    assert kvi_redis.hashes["pajlada:kvi"]["spam"] == "10"
+    assert kvi["spam"].get() == 7
+
+    kvi.flush()
+    assert kvi_redis.hashes["pajlada:kvi"]["spam"] == "7"
+    assert kvi.pending == {}
+    assert kvi.flushing == {}
+
+    # The value written by the flush is used for the changes until the next flush
+    num_reads = kvi_redis.num_reads
+    assert kvi["spam"].inc() == 8
+    assert kvi_redis.num_reads == num_reads
+
+    kvi.flush()
+    assert kvi_redis.hashes["pajlada:kvi"]["spam"] == "8"
+
+    # Values changed somewhere else are read again after the next flush
+    kvi_redis.hset("pajlada:kvi", "spam", 100)
+    kvi.flush()
+    assert kvi["spam"].inc() == 101
+    kvi.flush()
+    assert kvi_redis.hashes["pajlada:kvi"]["spam"] == "101"
+
+    # Setting the value discards the changes that haven't been written yet
+    kvi["spam"].inc(5)
+    kvi["spam"].set(50)
+    kvi.flush()
+    assert kvi_redis.hashes["pajlada:kvi"]["spam"] == "50"
+
+
+def test_kvi_flush_resets_non_integer_values(kvi_redis) -> None:
+    from pajbot.managers.kvi import KVIManager
+
+    kvi = KVIManager(coalesced_ids=["spam", "other"])
+    kvi_redis.hset("pajlada:kvi", "spam", "xd")
+
+    assert kvi["spam"].inc(2) == 2
+    assert kvi["other"].inc(3) == 3
+    kvi_redis.hset("pajlada:kvi", "spam", "xd")
+    kvi.flush()
+
+    assert kvi_redis.hashes["pajlada:kvi"] == {"spam": "2", "other": "3"}
+    assert kvi.pending == {}
+
+
+def test_kvi_get_many(kvi_redis) -> None:
+    from pajbot.managers.kvi import KVIManager
+
+    kvi = KVIManager(coalesced_ids=["spam"])
+    kvi_redis.hset("pajlada:kvi", "foo", 5)
+    kvi_redis.hset("pajlada:kvi", "bar", "xd")
+    kvi_redis.hset("pajlada:kvi", "spam", 10)
+    kvi["spam"].inc(3)
+
+    kvi_redis.num_reads = 0
+    assert kvi.get_many(["foo", "bar", "spam", "missing"]) == {"foo": 5, "bar": 0, "spam": 13, "missing": 0}
+    assert kvi_redis.num_reads == 1
+    assert kvi.get_many([]) == {}
@@ -0,0 +1,117 @@
+from typing import Optional
+
+import pytest
+
+
+class FakeFilter:
+    def __init__(self, cost, punishment) -> None:
+        self.FILTER_COST = cost
+        self.punishment = punishment
+        self.num_calls = 0
+
+    def filter_message(self, message):
+        self.num_calls += 1
+        return self.punishment
+
+
+def make_punishment(duration: int, permanent: bool = False):
+    from pajbot.managers.message_filter import FilterPunishment
+
+    return FilterPunishment(lambda: None, duration, permanent=permanent)
+
+
+def make_message(message: str = "hello"):
+    from pajbot.managers.message_filter import FilteredMessage
+
+    return FilteredMessage(None, message, [], [], "msg-id", False)  # type: ignore
+
+
+@pytest.fixture(autouse=True)
+def clear_filters():
+    from pajbot.managers.message_filter import MessageFilterManager
+
+    MessageFilterManager.filters = []
+    yield
+    MessageFilterManager.filters = []
+
+
+def test_harshest_punishment_wins():
+    from pajbot.managers.message_filter import FilterCost, MessageFilterManager
+
+    short = make_punishment(10)
+    long = make_punishment(600)
+    MessageFilterManager.add_filter(FakeFilter(FilterCost.CHEAP, short))
+    MessageFilterManager.add_filter(FakeFilter(FilterCost.CHEAP, None))
+    MessageFilterManager.add_filter(FakeFilter(FilterCost.CHEAP, long))
+
+    assert MessageFilterManager.check_message(make_message()) is long
+
+
+def test_expensive_filters_are_skipped_after_a_violation():
+    from pajbot.managers.message_filter import FilterCost, MessageFilterManager
+
+    expensive = FakeFilter(FilterCost.EXPENSIVE, make_punishment(600))
+    cheap = FakeFilter(FilterCost.CHEAP, make_punishment(10))
+    MessageFilterManager.add_filter(expensive)
+    MessageFilterManager.add_filter(cheap)
+
+    assert MessageFilterManager.check_message(make_message()) is cheap.punishment
+    assert expensive.num_calls == 0
+
+    cheap.punishment = None
+    assert MessageFilterManager.check_message(make_message()) is expensive.punishment
+    assert expensive.num_calls == 1
+
+
+def test_ban_stops_the_pipeline():
+    from pajbot.managers.message_filter import FilterCost, MessageFilterManager
+
+    ban = make_punishment(0, permanent=True)
+    after = FakeFilter(FilterCost.CHEAP, make_punishment(1000))
+    MessageFilterManager.add_filter(FakeFilter(FilterCost.CHEAP, ban))
+    MessageFilterManager.add_filter(after)
+
+    assert MessageFilterManager.check_message(make_message()) is ban
+    assert after.num_calls == 0
+
+
+def test_filtered_message_character_stats():
+    stats = make_message("Hello WORLD 123!").character_stats
+
+    assert stats.lowercase == 4
+    assert stats.uppercase == 6
+    assert stats.non_alnum == 3
+
+
+def test_remove_filter():
+    from pajbot.managers.message_filter import FilterCost, MessageFilterManager
+
+    message_filter = FakeFilter(FilterCost.CHEAP, make_punishment(10))
+    MessageFilterManager.add_filter(message_filter)
+    MessageFilterManager.add_filter(message_filter)
+    assert len(MessageFilterManager.filters) == 1
+
+    MessageFilterManager.remove_filter(message_filter)
+    result: Optional[object] = MessageFilterManager.check_message(make_message())
+    assert result is None
+
+
+class FakeModerationBot:
+    def __init__(self) -> None:
+        self.calls: list[tuple[str, Optional[str]]] = []
+
+    def delete_or_timeout(self, user, moderation_action, msg_id, duration, reason=None, disable_warnings=False) -> None:
+        self.calls.append((moderation_action, msg_id))
+
+
+def test_delete_punishment_without_msg_id():
+    from pajbot.managers.message_filter import FilteredMessage, FilterPunishment
+
+    bot = FakeModerationBot()
+    whisper = FilteredMessage(None, "hello", [], [], None, True)  # type: ignore
+
+    # Whispers can't be deleted, but the user can still be timed out
+    FilterPunishment.delete_or_timeout(bot, whisper, "Delete", 0).apply()  # type: ignore
+    FilterPunishment.delete_or_timeout(bot, whisper, "Timeout", 10).apply()  # type: ignore
+    FilterPunishment.delete_or_timeout(bot, make_message(), "Delete", 0).apply()  # type: ignore
+    assert bot.calls == [("Timeout", None), ("Delete", "msg-id")]
@@ -0,0 +1,233 @@
+import json
+
+import pytest
+
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value
+
+
+class FakeUser:
+    def __init__(self, id):
+        self.id = id
+
+
+class FakeBot:
+    def __init__(self):
+        self.streamer = FakeUser("11")
+        self.bot_user = FakeUser("22")
+        self.app_token_manager = None
+        self.bot_token_manager = None
+        self.streamer_access_token_manager = None
+
+
+class FakeModerationAPI:
+    def __init__(self):
+        self.calls = []
+
+    def get_user_id(self, login):
+        return f"id-{login}"
+
+    def ban_user(self, broadcaster_id, moderator_id, authorization, user_id, reason):
+        self.calls.append(("ban", user_id))
+
+    def timeout_user(self, broadcaster_id, moderator_id, authorization, user_id, duration, reason):
+        self.calls.append(("timeout", user_id, duration))
+
+    def unban_user(self, broadcaster_id, moderator_id, user_id, authorization):
+        self.calls.append(("unban", user_id))
+
+    def delete_single_message(self, broadcaster_id, moderator_id, authorization, msg_id):
+        self.calls.append(("delete", msg_id))
+
+
+class FakeRequest:
+    def __init__(self, method):
+        self.method = method
+
+
+class FakeResponse:
+    def __init__(self, method, headers):
+        self.request = FakeRequest(method)
+        self.headers = headers
+
+
+@pytest.fixture
+def moderation_queue(monkeypatch, fake_clock):
+    from pajbot.managers.moderation import ModerationQueue
+    from pajbot.managers.redis import RedisManager
+    from pajbot.streamhelper import StreamHelper
+
+    monkeypatch.setattr(RedisManager, "redis", FakeRedis())
+    monkeypatch.setattr(StreamHelper, "streamer", "pajlada")
+
+    queue = ModerationQueue(FakeBot(), clock=fake_clock)
+    # The tests drive the queue themselves, stop the dispatcher thread
+    queue.quit()
+    queue.thread.join()
+    queue.api = FakeModerationAPI()
+    return queue
+
+
+def _execute_pending(queue):
+    while True:
+        with queue.condition:
+            item = queue._pop_next()
+        if item is None:
+            return
+        queue._execute(item)
+
+
+def test_moderation_queue_merges_pending_actions(moderation_queue):
+    from pajbot.models.moderation_action import Ban, Timeout, Unban
+
+    queue = moderation_queue
+
+    queue.add("spammer", Timeout(60, "spam"))
+    queue.add("spammer", Timeout(600, "more spam"))
+    queue.add("other", Timeout(60, "spam"))
+    assert len(queue.pending) == 2
+    assert queue.pending["login:spammer"].action.duration == 600
+
+    # A ban wins over a queued timeout, an unban from a later message overrides the punishment
+    queue.add("spammer", Ban("spam"))
+    assert isinstance(queue.pending["login:spammer"].action, Ban)
+    queue.add("spammer", Unban())
+    assert isinstance(queue.pending["login:spammer"].action, Unban)
+
+    _execute_pending(queue)
+    assert queue.api.calls == [("unban", "id-spammer"), ("timeout", "id-other", 60)]
+
+
+def test_moderation_queue_skips_covered_actions(moderation_queue, fake_clock):
+    from pajbot.managers.moderation import RECENT_ACTION_WINDOW
+    from pajbot.models.moderation_action import Ban, Timeout
+
+    queue = moderation_queue
+
+    queue.add("spammer", Timeout(600, "spam"))
+    _execute_pending(queue)
+
+    # The same spam wave hitting the same user again doesn't send anything new
+    queue.add("spammer", Timeout(600, "spam"))
+    _execute_pending(queue)
+    queue.add("spammer", Timeout(60, "spam"))
+    _execute_pending(queue)
+    assert queue.api.calls == [("timeout", "id-spammer", 600)]
+    assert queue.num_skipped == 2
+
+    # A longer timeout or a ban escalates the punishment
+    queue.add("spammer", Timeout(1200, "spam"))
+    _execute_pending(queue)
+    queue.add("spammer", Ban("spam"))
+    _execute_pending(queue)
+    queue.add("spammer", Ban("spam"))
+    _execute_pending(queue)
+    assert queue.api.calls[1:] == [("timeout", "id-spammer", 1200), ("ban", "id-spammer")]
+
+    # Once the window has passed, the action is sent again
+    fake_clock.now += RECENT_ACTION_WINDOW + 1
+    queue.add("spammer", Ban("spam"))
+    _execute_pending(queue)
+    assert queue.api.calls[-1] == ("ban", "id-spammer")
+    assert queue.num_executed == 4
+    assert queue.num_skipped == 3
+    assert queue.num_failed == 0
+
+
+def test_moderation_queue_unban_clears_recent_action(moderation_queue):
+    from pajbot.models.moderation_action import Timeout, Unban
+
+    queue = moderation_queue
+
+    queue.add("spammer", Timeout(600, "spam"))
+    _execute_pending(queue)
+    queue.add("spammer", Unban())
+    _execute_pending(queue)
+    queue.add("spammer", Timeout(600, "spam"))
+    _execute_pending(queue)
+
+    assert queue.api.calls == [
+        ("timeout", "id-spammer", 600),
+        ("unban", "id-spammer"),
+        ("timeout", "id-spammer", 600),
+    ]
+
+
+def test_moderation_queue_coalesces_deletes(moderation_queue):
+    queue = moderation_queue
+
+    queue.delete_message("msg-1", "11")
+    queue.delete_message("msg-1", "11")
+    queue.delete_message("msg-2", "11")
+    assert len(queue.pending) == 2
+
+    _execute_pending(queue)
+    assert queue.api.calls == [("delete", "msg-1"), ("delete", "msg-2")]
+
+
+def test_moderation_queue_waits_for_in_flight_user(moderation_queue):
+    from pajbot.models.moderation_action import Timeout
+
+    queue = moderation_queue
+
+    queue.add("spammer", Timeout(60, "spam"))
+    with queue.condition:
+        first = queue._pop_next()
+
+    # A new action for a user with a request in flight waits until that request is done
+    queue.add("spammer", Timeout(600, "spam"))
+    queue.add("other", Timeout(60, "spam"))
+    with queue.condition:
+        assert queue._pop_next().key == "login:other"
+        assert queue._pop_next() is None
+
+    queue._execute(first)
+    with queue.condition:
+        assert queue._pop_next().key == "login:spammer"
+
+
+def test_moderation_queue_follows_rate_limit_headers(moderation_queue):
+    from pajbot.managers.moderation import HELIX_RATE_LIMIT_POINTS
+
+    queue = moderation_queue
+    assert queue.bucket.available == HELIX_RATE_LIMIT_POINTS
+
+    # GET requests don't use the bot's token, so they don't tell us about its bucket
+    queue._on_response(FakeResponse("GET", {"Ratelimit-Remaining": "5"}))
+    assert queue.bucket.available == HELIX_RATE_LIMIT_POINTS
+
+    queue._on_response(FakeResponse("POST", {"Ratelimit-Remaining": "5"}))
+    assert queue.bucket.available == 5
+
+    queue._on_response(FakeResponse("DELETE", {"Ratelimit-Remaining": "not a number"}))
+    queue._on_response(FakeResponse("DELETE", {}))
+    assert queue.bucket.available == 5
+
+
+def test_moderation_queue_publishes_stats(moderation_queue, fake_clock):
+    from pajbot.managers.redis import RedisManager
+    from pajbot.models.moderation_action import Timeout
+
+    queue = moderation_queue
+
+    queue.add("spammer", Timeout(60, "spam"))
+    queue.add("other", Timeout(60, "spam"))
+    with queue.condition:
+        item = queue._pop_next()
+    fake_clock.now += 0.5
+    queue._execute(item)
+
+    queue.publish_stats()
+    data = json.loads(RedisManager.redis.values["pajlada:moderation_queue:stats"])
+    assert data["queue_depth"] == 1
+    assert data["in_flight"] == 0
+    assert data["executed"] == 1
+    assert data["skipped"] == 0
+    assert data["failed"] == 0
+    assert data["latency_max_ms"] == 500.0
+    assert "published_at" in data
@@ -0,0 +1,60 @@
+import datetime
+
+
+def test_recent_chatters_counts_logins_and_display_names(fake_clock):
+    from pajbot.managers.recent_chatters import RecentChattersIndex
+
+    index = RecentChattersIndex(clock=fake_clock)
+    index.add("1", "testaccount_420", "테스트계정420")
+    index.add("2", "pajlada", "PajladA")
+
+    assert index.count_known_users([]) == 0
+    assert index.count_known_users(["pajlada", "testaccount_420", "someone"]) == 2
+    assert index.count_known_users(["테스트계정420"]) == 1
+    # Both names of the same user only count once
+    assert index.count_known_users(["testaccount_420", "테스트계정420"]) == 1
+
+
+def test_recent_chatters_age_out(fake_clock):
+    from pajbot.managers.recent_chatters import RecentChattersIndex
+
+    clock = fake_clock
+    index = RecentChattersIndex(max_age=datetime.timedelta(days=1), clock=clock)
+    index.add("1", "pajlada", "pajlada")
+    clock.now += 60 * 60
+    index.add_many([_basics("2", "randers", "Randers")])
+
+    clock.now += 23 * 60 * 60 + 1
+    assert index.count_known_users(["pajlada", "randers"]) == 1
+
+    index.prune()
+    assert len(index) == 1
+    assert "pajlada" not in index.user_ids
+
+    # Seeing the user again keeps them around
+    index.add("2", "randers", "Randers")
+    clock.now += 23 * 60 * 60
+    index.prune()
+    assert index.count_known_users(["randers"]) == 1
+
+
+def test_recent_chatters_rename(fake_clock):
+    from pajbot.managers.recent_chatters import RecentChattersIndex
+
+    index = RecentChattersIndex(clock=fake_clock)
+    index.add("1", "oldname", "OldName")
+    index.add("1", "newname", "NewName")
+
+    assert index.count_known_users(["oldname"]) == 0
+    assert index.count_known_users(["newname"]) == 1
+
+    # Someone else took the old name
+    index.add("2", "oldname", "oldname")
+    index.add("1", "newname", "NewName")
+    assert index.count_known_users(["oldname", "newname"]) == 2
+
+
+def _basics(id, login, name):
+    from pajbot.models.user import UserBasics
+
+    return UserBasics(id, login, name)
@@ -0,0 +1,40 @@
+def test_rolling_counter_counts_last_window(fake_clock):
+    from pajbot.managers.emote import RollingCounter
+
+    clock = fake_clock
+    counter = RollingCounter(60, clock=clock)
+
+    assert counter.get("Kappa") is None
+    assert counter.add("Kappa", 2) == 2
+
+    clock.now += 30
+    assert counter.add("Kappa", 3) == 5
+    assert counter.add("PogChamp", 1) == 1
+
+    clock.now += 29.5
+    assert counter.get("Kappa") == 5
+
+    # The first two uses leave the window
+    clock.now += 0.5
+    assert counter.get("Kappa") == 3
+
+    clock.now += 30
+    assert counter.get("Kappa") == 0
+    assert counter.get("PogChamp") == 0
+
+
+def test_rolling_counter_long_gap(fake_clock):
+    from pajbot.managers.emote import RollingCounter
+
+    clock = fake_clock
+    counter = RollingCounter(60, clock=clock)
+
+    for _ in range(120):
+        clock.now += 1
+        counter.add("Kappa", 1)
+
+    assert counter.get("Kappa") == 60
+
+    clock.now += 3600
+    assert counter.get("Kappa") == 0
+    assert counter.add("Kappa", 4) == 4
@@ -0,0 +1,125 @@
+def test_timing_wheel_returns_items_when_due():
+    from pajbot.managers.schedule import TimingWheel
+
+    wheel = TimingWheel(bits=2, num_levels=2)
+    wheel.add("a", 3)
+    wheel.add("b", 1)
+    wheel.add("c", 9)
+    wheel.add("d", 15)
+    # Further away than the top level reaches
+    wheel.add("e", 40)
+    assert len(wheel) == 5
+
+    assert wheel.advance(1) == ["b"]
+    assert wheel.advance(8) == ["a"]
+    assert wheel.advance(9) == ["c"]
+    assert wheel.advance(39) == ["d"]
+    assert wheel.advance(40) == ["e"]
+    assert len(wheel) == 0
+
+
+def test_timing_wheel_every_tick():
+    import random
+
+    from pajbot.managers.schedule import TimingWheel
+
+    wheel = TimingWheel(bits=2, num_levels=3)
+    rng = random.Random(1337)
+    due_ticks = {}
+    for item in range(500):
+        due_ticks[item] = rng.randint(1, 200)
+        wheel.add(item, due_ticks[item])
+
+    for tick in range(1, 201):
+        due = wheel.advance(tick)
+        assert sorted(due) == sorted(item for item, due_tick in due_ticks.items() if due_tick == tick)
+
+
+def test_timing_wheel_items_already_due_run_on_next_tick():
+    from pajbot.managers.schedule import TimingWheel
+
+    wheel = TimingWheel(bits=2, num_levels=2)
+    wheel.advance(10)
+    wheel.add("late", 3)
+    assert wheel.advance(11) == ["late"]
+
+
+def _make_scheduler(clock):
+    from pajbot.managers.schedule import Scheduler
+
+    return Scheduler(clock=clock, tick_length=1.0)
+
+
+def test_scheduler_runs_delayed_and_periodic_jobs(fake_clock):
+    clock = fake_clock
+    scheduler = _make_scheduler(clock)
+    calls = []
+
+    scheduler.add_job(calls.append, args=["delayed"], delay=5, executor="reactor")
+    scheduler.add_job(calls.append, args=["every"], delay=2, interval=2, executor="reactor")
+
+    for _ in range(6):
+        clock.now += 1
+        scheduler.run_due()
+        scheduler.run_reactor_jobs()
+
+    assert calls == ["every", "every", "delayed", "every"]
+
+
+def test_scheduler_cancel_and_pause(fake_clock):
+    clock = fake_clock
+    scheduler = _make_scheduler(clock)
+    calls = []
+
+    cancelled = scheduler.add_job(calls.append, args=["cancelled"], delay=1, executor="reactor")
+    paused = scheduler.add_job(calls.append, args=["paused"], delay=1, executor="reactor")
+    cancelled.cancel()
+    paused.pause()
+
+    clock.now += 2
+    scheduler.run_due()
+    scheduler.run_reactor_jobs()
+    assert calls == []
+
+    # A one-off job that was due while it was paused runs once it's resumed
+    paused.resume()
+    clock.now += 1
+    scheduler.run_due()
+    scheduler.run_reactor_jobs()
+    assert calls == ["paused"]
+
+
+def test_scheduler_records_lag_and_failures(fake_clock):
+    clock = fake_clock
+    scheduler = _make_scheduler(clock)
+
+    def fail() -> None:
+        raise ValueError("xd")
+
+    scheduler.add_job(fail, delay=1, executor="reactor", name="fail")
+    clock.now += 1
+    scheduler.run_due()
+    clock.now += 3
+    scheduler.run_reactor_jobs()
+
+    stats = scheduler.get_stats()["fail"]
+    assert stats["runs"] == 1
+    assert stats["failures"] == 1
+    assert stats["max_lag"] == 3
+
+
+def test_scheduler_skips_runs_of_a_job_that_is_still_running(fake_clock):
+    clock = fake_clock
+    scheduler = _make_scheduler(clock)
+    calls = []
+
+    scheduler.add_job(calls.append, args=["every"], delay=1, interval=1, executor="reactor", name="every")
+    clock.now += 1
+    scheduler.run_due()
+    clock.now += 1
+    # The first run is still waiting for the reactor
+    scheduler.run_due()
+    scheduler.run_reactor_jobs()
+
+    assert calls == ["every"]
+    assert scheduler.get_stats()["every"]["skipped"] == 1
@@ -0,0 +1,68 @@
+def test_send_queue_paces_by_window(fake_clock):
+    from pajbot.managers.irc import SendQueue
+    from pajbot.tmi import SendPriority, TMIRateLimits
+
+    clock = fake_clock
+    clock.now = 0.0
+    queue = SendQueue(TMIRateLimits(privmsg_per_30=2, whispers_per_second=3, whispers_per_minute=100), clock=clock)
+
+    queue.push("PRIVMSG #a :1", SendPriority.COMMAND)
+    queue.push("PRIVMSG #a :2", SendPriority.COMMAND)
+    queue.push("PRIVMSG #a :3", SendPriority.COMMAND)
+
+    assert queue.pop_sendable() == ["PRIVMSG #a :1", "PRIVMSG #a :2"]
+    assert queue.pop_sendable() == []
+    assert queue.time_until_next_send() == 31
+
+    clock.now = 31
+    assert queue.pop_sendable() == ["PRIVMSG #a :3"]
+    assert queue.time_until_next_send() is None
+
+
+def test_send_queue_priority_and_coalescing(fake_clock):
+    from pajbot.managers.irc import SendQueue
+    from pajbot.tmi import SendPriority, TMIRateLimits
+
+    clock = fake_clock
+    clock.now = 0.0
+    queue = SendQueue(TMIRateLimits(privmsg_per_30=1, whispers_per_second=3, whispers_per_minute=100), clock=clock)
+
+    assert queue.push("PRIVMSG #a :timer", SendPriority.TIMER)
+    assert queue.push("PRIVMSG #a :command", SendPriority.COMMAND)
+    assert not queue.push("PRIVMSG #a :command", SendPriority.COMMAND)
+    assert queue.push("PRIVMSG #a :moderation", SendPriority.MODERATION)
+    assert len(queue) == 3
+    assert queue.num_coalesced == 1
+
+    assert queue.pop_sendable() == ["PRIVMSG #a :moderation"]
+    clock.now = 31
+    assert queue.pop_sendable() == ["PRIVMSG #a :command"]
+    clock.now = 62
+    assert queue.pop_sendable() == ["PRIVMSG #a :timer"]
+
+
+def test_send_queue_drops_stale_and_overflowing_messages(fake_clock):
+    from pajbot.managers.irc import MAX_BACKLOG, SendQueue
+    from pajbot.tmi import SendPriority, TMIRateLimits
+
+    clock = fake_clock
+    clock.now = 0.0
+    queue = SendQueue(TMIRateLimits(privmsg_per_30=0, whispers_per_second=3, whispers_per_minute=100), clock=clock)
+
+    for i in range(MAX_BACKLOG):
+        assert queue.push(f"PRIVMSG #a :timer {i}", SendPriority.TIMER)
+
+    # A full queue makes room for more important messages by dropping the oldest timer message
+    assert queue.push("PRIVMSG #a :command", SendPriority.COMMAND)
+    assert "PRIVMSG #a :timer 0" not in queue.queued
+    assert len(queue) == MAX_BACKLOG
+
+    # Within the same lane, the newest message wins
+    assert queue.push("PRIVMSG #a :timer new", SendPriority.TIMER)
+    assert "PRIVMSG #a :timer 1" not in queue.queued
+    assert len(queue) == MAX_BACKLOG
+
+    clock.now = 61
+    queue.pop_sendable()
+    assert "PRIVMSG #a :command" not in queue.queued
+    assert len(queue) == MAX_BACKLOG - 1
@@ -0,0 +1,185 @@
+import pytest
+
+
+def test_timer_queue_pops_in_due_order(fake_clock):
+    from pajbot.models.timer import TimerQueue
+
+    clock = fake_clock
+    queue = TimerQueue(clock=clock)
+    queue.schedule(1, 300)
+    queue.schedule(2, 100)
+    queue.schedule(3, 200)
+
+    assert queue.pop_due() is None
+
+    clock.now += 250
+    assert queue.pop_due() == 2
+    assert queue.pop_due() == 3
+    assert queue.pop_due() is None
+    assert len(queue) == 1
+
+    clock.now += 50
+    assert queue.pop_due() == 1
+    assert len(queue) == 0
+
+
+def test_timer_queue_reschedule_and_remove(fake_clock):
+    from pajbot.models.timer import TimerQueue
+
+    clock = fake_clock
+    queue = TimerQueue(clock=clock)
+    queue.schedule(1, 100)
+    queue.schedule(2, 200)
+
+    # Rescheduling replaces the old due time
+    queue.schedule(1, 300)
+    queue.remove(2)
+    assert 2 not in queue
+    assert queue.time_until_due(1) == 300
+
+    clock.now += 299
+    assert queue.pop_due() is None
+    clock.now += 1
+    assert queue.pop_due() == 1
+
+
+def test_timer_queue_pause_and_resume(fake_clock):
+    from pajbot.models.timer import TimerQueue
+
+    clock = fake_clock
+    queue = TimerQueue(clock=clock)
+    queue.schedule(1, 100)
+
+    clock.now += 40
+    queue.pause()
+    clock.now += 1000
+    assert queue.pop_due() is None
+    assert queue.time_until_due(1) == 60
+
+    # Timers scheduled while the queue is paused start counting once it's resumed
+    queue.schedule(2, 30)
+
+    queue.resume()
+    clock.now += 30
+    assert queue.pop_due() == 2
+    assert queue.pop_due() is None
+    clock.now += 30
+    assert queue.pop_due() == 1
+
+
+class FakeTimerBot:
+    def __init__(self) -> None:
+        self.is_online = False
+        self.runs: list[int] = []
+
+    def execute_every(self, *args, **kwargs) -> None:
+        pass
+
+    @property
+    def socket_manager(self):
+        return self
+
+    def add_handler(self, *args, **kwargs) -> None:
+        pass
+
+
+def _make_timer(timer_id, interval_online=0, interval_offline=0, min_lines=0):
+    from pajbot.models.timer import Timer
+
+    timer = Timer()
+    timer.id = timer_id
+    timer.interval_online = interval_online
+    timer.interval_offline = interval_offline
+    timer.min_lines = min_lines
+    return timer
+
+
+@pytest.fixture
+def timer_manager(fake_clock, monkeypatch):
+    from pajbot.managers.handler import HandlerManager
+    from pajbot.models.timer import Timer, TimerManager
+
+    monkeypatch.setattr(HandlerManager, "add_handler", lambda *args, **kwargs: None)
+    monkeypatch.setattr(Timer, "run", lambda timer, bot: bot.runs.append(timer.id))
+    return TimerManager(FakeTimerBot(), clock=fake_clock)  # type: ignore[arg-type]
+
+
+def _run_for(timer_manager, clock, seconds):
+    for _ in range(seconds):
+        clock.now += 1
+        timer_manager.tick()
+
+
+def test_timer_manager_min_lines_gate(timer_manager, fake_clock):
+    timer_manager.timers = {1: _make_timer(1, interval_offline=1, min_lines=3)}
+    timer_manager.redistribute_timers()
+    bot = timer_manager.bot
+
+    # Not enough chat activity, the timer checks again every 30 seconds
+    _run_for(timer_manager, fake_clock, 60)
+    assert bot.runs == []
+    assert timer_manager.offline_timers.time_until_due(1) == 30
+
+    for _ in range(3):
+        timer_manager.on_message(whisper=False)
+    timer_manager.on_message(whisper=True)
+    _run_for(timer_manager, fake_clock, 30)
+    assert bot.runs == [1]
+
+    # The lines counted before the last run don't count again
+    timer_manager.on_message(whisper=False)
+    _run_for(timer_manager, fake_clock, 120)
+    assert bot.runs == [1]
+
+
+def test_timer_manager_switches_queues_with_stream_status(timer_manager, fake_clock):
+    timer_manager.timers = {1: _make_timer(1, interval_online=2), 2: _make_timer(2, interval_offline=1)}
+    timer_manager.redistribute_timers()
+    bot = timer_manager.bot
+
+    _run_for(timer_manager, fake_clock, 60)
+    assert bot.runs == [2]
+
+    # The offline timer stops counting down while the stream is online. The stream status is checked on the next
+    # tick, so one more second counts towards the offline timer
+    bot.is_online = True
+    _run_for(timer_manager, fake_clock, 30)
+    assert timer_manager.online_timers.time_until_due(1) == 90
+    assert timer_manager.offline_timers.time_until_due(2) == 59
+    _run_for(timer_manager, fake_clock, 90)
+    assert bot.runs == [2, 1]
+
+    bot.is_online = False
+    _run_for(timer_manager, fake_clock, 60)
+    assert bot.runs == [2, 1, 2]
+    assert timer_manager.online_timers.time_until_due(1) == 119
+
+
+def test_timer_manager_update_only_reschedules_the_changed_timer(timer_manager, fake_clock):
+    timer_manager.timers = {1: _make_timer(1, interval_offline=10), 2: _make_timer(2, interval_offline=10)}
+    timer_manager.redistribute_timers()
+    queue = timer_manager.offline_timers
+    assert queue.time_until_due(1) == 300
+    assert queue.time_until_due(2) == 600
+
+    # Shortening an interval only moves that timer
+    timer_manager.timers[2].interval_offline = 2
+    timer_manager.update_schedule(timer_manager.timers[2])
+    assert queue.time_until_due(1) == 300
+    assert queue.time_until_due(2) == 120
+
+    # Other changes keep the timer's schedule
+    timer_manager.timers[2].interval_offline = 20
+    timer_manager.update_schedule(timer_manager.timers[2])
+    assert queue.time_until_due(2) == 120
+
+    # Adding or removing a timer spreads out its queue again
+    timer_manager.timers[3] = _make_timer(3, interval_online=5)
+    timer_manager.update_schedule(timer_manager.timers[3])
+    assert queue.time_until_due(1) == 300
+    assert 3 in timer_manager.online_timers
+
+    removed = timer_manager.timers.pop(1)
+    timer_manager.update_schedule(removed)
+    assert 1 not in queue
+    assert queue.time_until_due(2) == 1200
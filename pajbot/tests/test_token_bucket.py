@@ -0,0 +1,43 @@
+def test_token_bucket_drains_and_refills(fake_clock):
+    from pajbot.utils import TokenBucket
+
+    clock = fake_clock
+    clock.now = 0.0
+    bucket = TokenBucket(3, 1, clock=clock)
+
+    assert bucket.try_acquire()
+    assert bucket.try_acquire()
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+    assert bucket.time_until_available() == 1.0
+
+    clock.now = 1.5
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+    assert bucket.time_until_available() == 0.5
+
+
+def test_token_bucket_never_exceeds_capacity(fake_clock):
+    from pajbot.utils import TokenBucket
+
+    clock = fake_clock
+    clock.now = 0.0
+    bucket = TokenBucket(2, 10, clock=clock)
+
+    clock.now = 100
+    assert bucket.available == 2
+
+
+def test_token_bucket_limit(fake_clock):
+    from pajbot.utils import TokenBucket
+
+    clock = fake_clock
+    clock.now = 0.0
+    bucket = TokenBucket(800, 800 / 60, clock=clock)
+
+    bucket.limit(5)
+    assert bucket.available == 5
+
+    # limit never adds tokens
+    bucket.limit(100)
+    assert bucket.available == 5
@@ -57,3 +57,46 @@ def test_find_unique_urls() -> None:
 
     assert find_unique_urls("omg this isn't chatting, this is meme-ing...my vanity") == set()
     assert find_unique_urls("foo 1.40 bar") == set()
+
+
+def test_find_unique_urls_prefilter() -> None:
+    from pajbot.modules.linkchecker import URL_CANDIDATE_REGEX, _find_unique_urls, extractor, find_unique_urls
+
+    # Every TLD URLExtract looks for must be matched by the pre-filter
+    for tld in extractor._load_cached_tlds():
+        assert URL_CANDIDATE_REGEX.search(tld) is not None, tld
+
+    corpus = [
+        "",
+        "hello chat",
+        "Kappa Keepo PogChamp",
+        "omg this isn't chatting, this is meme-ing...my vanity",
+        "foo 1.40 bar",
+        "version 3.10 is out. nice",
+        "a.b. c... d.",
+        "pajlada.se test http://pajlada.se",
+        "pajlada.se pajlada.com foobar.se",
+        "https://pajlada.se/ https://pajlada.se",
+        "check out www.foobar.com/abc?def=1#ghi, it's great!",
+        "foo 192.168.0.1 bar",
+        "http://localhost:8080/test and localhost",
+        "LOCALHOST",
+        "http://foo https:// ://",
+        "pajlada.SE EXAMPLE.COM",
+        "xn--80ak6aa92e.com пример.рф",
+        "spam spam bit.ly/abc spam",
+        "(pajlada.se)",
+        "email me at foo@example.com",
+        "🎉🎉 twitch.tv/pajlada 🎉🎉",
+    ]
+    for message in corpus + corpus:
+        _find_unique_urls.cache_clear()
+        expected = set(_find_unique_urls.__wrapped__(message))
+        assert find_unique_urls(message) == expected, message
+        # Cached result
+        assert find_unique_urls(message) == expected, message
+
+    # Callers get their own copy of the result
+    urls = find_unique_urls("pajlada.se")
+    urls.add("http://foobar.se")
+    assert find_unique_urls("pajlada.se") == {"http://pajlada.se"}
@@ -0,0 +1,153 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        server = self.server
+        with server.lock:  # type: ignore
+            server.num_requests += 1  # type: ignore
+            count = server.num_requests  # type: ignore
+        server.release.wait(5)  # type: ignore
+
+        if self.path == "/error":
+            self.send_response(500)
+            self.send_header("Content-Type", "text/html")
+            self.end_headers()
+            self.wfile.write(b"<html>oops</html>")
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.end_headers()
+        self.wfile.write(f"  response {count}\r\n".encode("utf-8"))
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.num_requests = 0  # type: ignore
+    server.lock = threading.Lock()  # type: ignore
+    server.release = threading.Event()  # type: ignore
+    server.release.set()  # type: ignore
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_urlfetch_caches_responses(stub_server):
+    from pajbot.managers.urlfetch import URLFetcher
+
+    url = f"http://127.0.0.1:{stub_server.server_port}/song"
+    fetcher = URLFetcher("test", 60)
+
+    assert fetcher.fetch(url) == "response 1"
+    assert fetcher.fetch(url) == "response 1"
+    assert fetcher.fetch(url, cache_ttl=0) == "response 2"
+    assert stub_server.num_requests == 2
+
+
+def test_urlfetch_does_not_cache_errors(stub_server):
+    from pajbot.managers.urlfetch import URLFetcher
+
+    url = f"http://127.0.0.1:{stub_server.server_port}/error"
+    fetcher = URLFetcher("test", 60)
+
+    assert fetcher.fetch(url) == "urlfetch error 500"
+    assert fetcher.fetch(url) == "urlfetch error 500"
+    assert stub_server.num_requests == 2
+
+
+def test_urlfetch_coalesces_concurrent_requests(stub_server):
+    from pajbot.managers.urlfetch import URLFetcher
+
+    url = f"http://127.0.0.1:{stub_server.server_port}/weather"
+    fetcher = URLFetcher("test", 0)
+    stub_server.release.clear()
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(fetcher.fetch(url))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+
+    # Wait for the first request to reach the server before letting it respond
+    for _ in range(100):
+        if stub_server.num_requests > 0 and len(fetcher.in_flight) > 0:
+            break
+        threading.Event().wait(0.01)
+    threading.Event().wait(0.1)
+    stub_server.release.set()
+
+    for thread in threads:
+        thread.join(5)
+
+    assert stub_server.num_requests == 1
+    assert results == ["response 1"] * 5
+
+
+def test_urlfetch_connection_error():
+    from pajbot.managers.urlfetch import URLFetcher, URLFetchError
+
+    fetcher = URLFetcher("test", 60)
+
+    with pytest.raises(URLFetchError):
+        # Nothing listens on port 9 (discard) here
+        fetcher.fetch("http://127.0.0.1:9/")
+
+
+class FakeURLFetchRedis:
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def setex(self, key, ttl, value):
+        self.values[key] = value
+
+
+def test_urlfetch_cache_ttl_is_per_caller(stub_server, fake_clock):
+    from pajbot.managers.urlfetch import URLFetcher
+
+    url = f"http://127.0.0.1:{stub_server.server_port}/song"
+    fetcher = URLFetcher("test", 60, clock=fake_clock)
+
+    assert fetcher.fetch(url, cache_ttl=600) == "response 1"
+    fake_clock.now += 30
+
+    # A response cached by a command with a long cache duration is too old for a command with a short one
+    assert fetcher.fetch(url, cache_ttl=10) == "response 2"
+    assert fetcher.fetch(url, cache_ttl=600) == "response 2"
+    assert fetcher.fetch(url, cache_ttl=10) == "response 2"
+    assert stub_server.num_requests == 2
+
+
+def test_urlfetch_shares_responses_through_redis(stub_server, fake_clock):
+    from pajbot.managers.urlfetch import URLFetcher
+
+    url = f"http://127.0.0.1:{stub_server.server_port}/song"
+    redis = FakeURLFetchRedis()
+    fetcher = URLFetcher("test", 60, redis=redis, clock=fake_clock)  # type: ignore
+    other_fetcher = URLFetcher("test", 60, redis=redis, clock=fake_clock)  # type: ignore
+
+    assert fetcher.fetch(url, cache_ttl=600) == "response 1"
+    assert other_fetcher.fetch(url, cache_ttl=600) == "response 1"
+    assert stub_server.num_requests == 1
+
+    # The fetch time is stored with the response in redis, so its age is known to other processes too
+    fake_clock.now += 30
+    other_fetcher = URLFetcher("test", 60, redis=redis, clock=fake_clock)  # type: ignore
+    assert other_fetcher.fetch(url, cache_ttl=10) == "response 2"
+    assert fetcher.fetch(url, cache_ttl=10) == "response 2"
+    assert stub_server.num_requests == 2
+
+    # Entries written before the fetch time was stored are ignored
+    redis.values[URLFetcher.redis_key(url)] = "response 0"
+    assert URLFetcher("test", 60, redis=redis, clock=fake_clock).fetch(url) == "response 3"  # type: ignore
@@ -0,0 +1,192 @@
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+USER_TABLE = """
+CREATE TABLE "user" (
+    id TEXT PRIMARY KEY,
+    login TEXT,
+    login_last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    name TEXT,
+    level INTEGER,
+    points BIGINT,
+    subscriber BOOLEAN,
+    moderator BOOLEAN,
+    time_in_chat_online INTERVAL,
+    time_in_chat_offline INTERVAL,
+    num_lines BIGINT,
+    tokens INTEGER,
+    last_seen TIMESTAMP,
+    last_active TIMESTAMP,
+    ignored BOOLEAN,
+    banned BOOLEAN,
+    timeout_end TIMESTAMP,
+    vip BOOLEAN,
+    founder BOOLEAN
+)
+"""
+
+
+@pytest.fixture
+def user_cache(monkeypatch):
+    from pajbot.managers.db import DBManager
+    from pajbot.managers.user_cache import UserCache
+    from pajbot.models.user import User
+
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    with engine.begin() as connection:
+        connection.execute(text(USER_TABLE))
+    monkeypatch.setattr(DBManager, "_sessionmaker", sessionmaker(bind=engine, autoflush=False))
+
+    cache = UserCache({"main": {}})
+    cache.statements = []  # type: ignore[attr-defined]
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def on_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+        cache.statements.append(statement)  # type: ignore[attr-defined]
+
+    yield cache
+
+    event.remove(User, "after_update", cache._on_user_updated)
+    event.remove(User, "after_delete", cache._on_user_deleted)
+
+
+def _chat(user_cache, user_id="1", login="pajlada"):
+    from pajbot.models.user import UserBasics
+
+    with user_cache.user_scope(UserBasics(user_id, login, login)) as user:
+        user.num_lines += 1
+        return user
+
+
+def test_user_cache_hit_and_miss(user_cache):
+    from pajbot.models.user import UserBasics
+
+    # Miss, the new user is inserted
+    _chat(user_cache)
+    assert "1" in user_cache.entries
+    assert any(statement.startswith("INSERT") for statement in user_cache.statements)
+
+    # Hit, nothing is read from or written to the database
+    user_cache.statements.clear()
+    with user_cache.user_scope(UserBasics("1", "pajlada", "PAJLADA")) as user:
+        user.num_lines += 1
+        assert user.name == "PAJLADA"
+    assert user_cache.statements == []
+    assert user_cache.pending["1"].add_num_lines == 1
+    assert user_cache.pending["1"].name == "PAJLADA"
+
+    # Points are never cached, they're read from the database when used
+    with user_cache.user_scope(UserBasics("1", "pajlada", "PAJLADA")) as user:
+        assert user.points == 0
+    assert len(user_cache.statements) == 1
+    assert user_cache.statements[0].startswith("SELECT")
+
+
+def test_user_cache_overlays_pending_writes(user_cache):
+    from pajbot.managers.db import DBManager
+    from pajbot.models.user import User, UserBasics
+
+    _chat(user_cache)
+    _chat(user_cache)
+    _chat(user_cache)
+    assert user_cache.pending["1"].add_num_lines == 2
+
+    # A user reloaded from the database includes the writes that haven't been flushed yet
+    user_cache.invalidate("1")
+    with user_cache.user_scope(UserBasics("1", "pajlada", "pajlada")) as user:
+        assert user.num_lines == 3
+
+    user_cache.commit()
+    assert user_cache.pending == {}
+    with DBManager.create_session_scope() as db_session:
+        assert db_session.query(User).filter_by(id="1").one().num_lines == 3
+
+
+def test_user_cache_invalidation_during_scope(user_cache):
+    from pajbot.managers.db import DBManager
+    from pajbot.models.user import User, UserBasics
+
+    _chat(user_cache)
+    assert "1" in user_cache.entries
+
+    with user_cache.user_scope(UserBasics("1", "pajlada", "pajlada")):
+        # e.g. the user was edited on the web interface while the bot handled their message
+        user_cache.invalidate("1")
+
+    # The user we had might be stale, so it's not put back into the cache
+    assert "1" not in user_cache.entries
+    assert user_cache.open_scopes == {}
+    assert user_cache.invalidations == {}
+
+    _chat(user_cache)
+    assert "1" in user_cache.entries
+
+    # Updates made through the ORM evict the user
+    with DBManager.create_session_scope() as db_session:
+        db_session.query(User).filter_by(id="1").one().level = 500
+    assert "1" not in user_cache.entries
+    with user_cache.user_scope(UserBasics("1", "pajlada", "pajlada")) as user:
+        assert user.level == 500
+
+
+def test_user_cache_clear_during_scope(user_cache):
+    from pajbot.models.user import UserBasics
+
+    _chat(user_cache, "1", "pajlada")
+    _chat(user_cache, "2", "forsen")
+    assert set(user_cache.entries) == {"1", "2"}
+
+    with user_cache.user_scope(UserBasics("1", "pajlada", "pajlada")):
+        # e.g. the moderators were refreshed while the bot handled a message
+        user_cache.clear()
+
+    assert user_cache.entries == {}
+    assert user_cache.invalidations == {}
+
+
+def test_publish_user_updates(user_cache, monkeypatch):
+    from pajbot.managers.db import DBManager
+    from pajbot.managers.user_cache import (
+        _forget_user_updates,
+        _queue_user_update,
+        _send_user_updates,
+        publish_user_updates,
+    )
+    from pajbot.models.sock import SocketClientManager
+    from pajbot.models.user import User
+
+    from sqlalchemy.orm import Session
+
+    _chat(user_cache)
+    sent = []
+    monkeypatch.setattr(SocketClientManager, "send", lambda topic, data: sent.append((topic, data)))
+
+    publish_user_updates()
+    try:
+        with DBManager.create_session_scope() as db_session:
+            db_session.query(User).filter_by(id="1").one().level = 500
+            db_session.flush()
+            # Nothing is sent before the change is committed
+            assert sent == []
+        assert sent == [("user.update", {"user_id": "1"})]
+
+        sent.clear()
+        with pytest.raises(ValueError):
+            with DBManager.create_session_scope() as db_session:
+                db_session.query(User).filter_by(id="1").one().level = 1000
+                db_session.flush()
+                raise ValueError()
+        assert sent == []
+    finally:
+        event.remove(User, "after_update", _queue_user_update)
+        event.remove(User, "after_delete", _queue_user_update)
+        event.remove(Session, "after_commit", _send_user_updates)
+        event.remove(Session, "after_rollback", _forget_user_updates)
+
+    # The bot evicts the user when it receives the update
+    _chat(user_cache)
+    assert "1" in user_cache.entries
+    user_cache.on_user_update({"user_id": "1"})
+    assert "1" not in user_cache.entries
@@ -0,0 +1,49 @@
+import threading
+
+
+def test_user_ranks_refresh_survives_a_full_background_pool(fake_clock, monkeypatch):
+    from pajbot.action_queue import ActionQueue, PoolOptions, ShedPolicy
+    from pajbot.managers.schedule import ScheduleManager, Scheduler
+    from pajbot.managers.user_ranks_refresh import UserRanksRefreshManager
+
+    clock = fake_clock
+    scheduler = Scheduler(clock=clock, tick_length=1.0)
+    monkeypatch.setattr(ScheduleManager, "scheduler", scheduler)
+
+    action_queue = ActionQueue(
+        {"background": PoolOptions(max_workers=1, max_queued=1, shed_policy=ShedPolicy.REJECT_NEW)}
+    )
+    release = threading.Event()
+    started = threading.Event()
+
+    def block() -> None:
+        started.set()
+        release.wait(5)
+
+    # Fill up the background pool
+    blocker = action_queue.submit_to("background", block)
+    assert started.wait(5)
+    action_queue.submit_to("background", lambda: None)
+
+    manager = UserRanksRefreshManager({"main": {"rank_refresh_delay": "5"}})
+    refreshed = threading.Event()
+    manager._refresh = refreshed.set  # type: ignore[method-assign]
+    manager.start(action_queue)
+
+    def run_until(seconds: float) -> None:
+        for _ in range(int(seconds)):
+            clock.now += 1
+            scheduler.run_due()
+            scheduler.run_reactor_jobs()
+
+    # The initial refresh is rejected
+    run_until(manager.jitter + 1)
+    assert action_queue.get_stats()["background"]["tasks"]["Event.set"]["rejected"] == 1
+    assert not refreshed.is_set()
+
+    release.set()
+    blocker.result(5)
+
+    # The periodic refresh still happens
+    run_until(manager.delay + manager.jitter)
+    assert refreshed.wait(5)
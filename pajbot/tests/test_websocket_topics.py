@@ -0,0 +1,21 @@
+def test_parse_topics_from_query_string():
+    from pajbot.managers.websocket import parse_topics
+
+    assert parse_topics("new_sub,resub") == frozenset({"new_sub", "resub"})
+    assert parse_topics(" new_sub , ,resub") == frozenset({"new_sub", "resub"})
+    assert parse_topics("") == frozenset()
+
+
+def test_parse_topics_from_list():
+    from pajbot.managers.websocket import parse_topics
+
+    assert parse_topics(["play_sound"]) == frozenset({"play_sound"})
+    assert parse_topics([]) == frozenset()
+
+
+def test_parse_topics_invalid():
+    from pajbot.managers.websocket import parse_topics
+
+    assert parse_topics(None) is None
+    assert parse_topics({"new_sub": True}) is None
+    assert parse_topics(["new_sub", 5]) is None
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from enum import Enum
+from enum import Enum, IntEnum
 
 
 class WhisperOutputMode(Enum):
@@ -19,6 +19,15 @@ class WhisperOutputMode(Enum):
             )
 
 
+class SendPriority(IntEnum):
+    """Outgoing chat messages are sent in this order when the bot is rate limited (lowest value first)"""
+
+    MODERATION = 0
+    COMMAND = 1
+    # Timers & alerts
+    TIMER = 2
+
+
 class TMIRateLimits:
     BASE: TMIRateLimits
 
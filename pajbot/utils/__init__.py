@@ -1,6 +1,8 @@
+from .aho_corasick import AhoCorasick
 from .clean_up_message import clean_up_message
 from .datetime_from_utc_milliseconds import datetime_from_utc_milliseconds
 from .dump_threads import dump_threads
+from .emoji_matcher import EmojiMatcher
 from .extend_version_with_git_data import extend_version_if_possible, extend_version_with_git_data
 from .find import find
 from .get_class_that_defined_method import get_class_that_defined_method
@@ -20,12 +22,15 @@ from .time_ago import time_ago
 from .time_limit import time_limit
 from .time_method import time_method
 from .time_since import time_since
+from .token_bucket import TokenBucket
 from .wait_for_redis_data_loaded import wait_for_redis_data_loaded
 
 __all__ = [
+    "AhoCorasick",
     "clean_up_message",
     "datetime_from_utc_milliseconds",
     "dump_threads",
+    "EmojiMatcher",
     "extend_version_if_possible",
     "extend_version_with_git_data",
     "find",
@@ -46,6 +51,7 @@ __all__ = [
     "time_limit",
     "time_method",
     "time_since",
+    "TokenBucket",
     "tweet_provider_stringify_tweet",
     "wait_for_redis_data_loaded",
 ]
@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+from typing import Generic, Iterable, Iterator, TypeVar
+
+from collections import deque
+
+T = TypeVar("T")
+
+
+class AhoCorasick(Generic[T]):
+    """
+    Finds every occurrence of a fixed set of strings in a single pass over the text.
+    Each string is associated with a value, which is yielded together with the position of the occurrence.
+    Empty strings are not supported.
+    """
+
+    def __init__(self, patterns: Iterable[tuple[str, T]]) -> None:
+        # State 0 is the root. goto[state] maps a character to the next state
+        self.goto: list[dict[str, int]] = [{}]
+        self.fail: list[int] = [0]
+        # (pattern length, value) for every pattern that ends in this state, including through fail links
+        self.output: list[list[tuple[int, T]]] = [[]]
+
+        for pattern, value in patterns:
+            if not pattern:
+                raise ValueError("AhoCorasick does not support empty patterns")
+            self._add(pattern, value)
+
+        self._link()
+
+    def _add(self, pattern: str, value: T) -> None:
+        state = 0
+        for char in pattern:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            state = next_state
+
+        self.output[state].append((len(pattern), value))
+
+    def _link(self) -> None:
+        queue: deque[int] = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def iter(self, text: str) -> Iterator[tuple[int, int, T]]:
+        """Yields (start, end, value) for every occurrence of every pattern in the text"""
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+
+            for length, value in output[state]:
+                yield index + 1 - length, index + 1, value
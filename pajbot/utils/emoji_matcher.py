@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+from typing import Any, Iterable, Iterator
+
+
+class EmojiMatcher:
+    """
+    Finds emoji in text by walking a trie of all known emoji.
+    Matches never overlap, and the longest emoji wins (e.g. a flag or a skin tone variant is matched as one emoji,
+    not as the emoji it starts with). Text that is pure ASCII can't contain emoji, and is rejected immediately.
+    """
+
+    # Key that marks the end of an emoji in a trie node. Never a character, so it can't clash with one
+    TERMINAL = ""
+
+    def __init__(self, all_emoji: Iterable[str]) -> None:
+        self.root: dict[str, Any] = {}
+        for emoji in all_emoji:
+            if not emoji:
+                continue
+
+            node = self.root
+            for char in emoji:
+                node = node.setdefault(char, {})
+            node[self.TERMINAL] = emoji
+
+    def iter(self, text: str) -> Iterator[tuple[int, int, str]]:
+        """Yields (start, end, emoji) for every emoji in the text, from left to right"""
+        if text.isascii():
+            return
+
+        root = self.root
+        terminal = self.TERMINAL
+        length = len(text)
+
+        index = 0
+        while index < length:
+            node = root.get(text[index])
+            if node is None:
+                index += 1
+                continue
+
+            match_end = -1
+            match = None
+            end = index + 1
+            while True:
+                emoji = node.get(terminal)
+                if emoji is not None:
+                    match_end = end
+                    match = emoji
+
+                if end >= length:
+                    break
+
+                node = node.get(text[end])
+                if node is None:
+                    break
+
+                end += 1
+
+            if match is None:
+                index += 1
+                continue
+
+            yield index, match_end, match
+            index = match_end
+
+    def find(self, text: str) -> list[tuple[int, int, str]]:
+        """Returns (start, end, emoji) for every emoji in the text"""
+        return list(self.iter(text))
+
+    def count(self, text: str) -> int:
+        """Returns the number of emoji in the text"""
+        return sum(1 for _ in self.iter(text))
+
+    def contains(self, text: str) -> bool:
+        return next(self.iter(text), None) is not None
@@ -0,0 +1,82 @@
+from typing import Callable, Optional
+
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter.
+
+    The bucket holds up to `capacity` tokens and regains `refill_rate` tokens per second.
+    Every rate-limited operation takes one (or more) tokens out of the bucket.
+    """
+
+    def __init__(self, capacity: float, refill_rate: float, clock: Callable[[], float] = time.monotonic) -> None:
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        if refill_rate <= 0:
+            raise ValueError("refill_rate must be positive")
+
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.clock = clock
+
+        self.tokens = capacity
+        self.last_refill = clock()
+        self.lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = self.clock()
+        elapsed = now - self.last_refill
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_rate)
+        self.last_refill = now
+
+    @property
+    def available(self) -> float:
+        with self.lock:
+            self._refill()
+            return self.tokens
+
+    def try_acquire(self, amount: float = 1) -> bool:
+        """Take `amount` tokens out of the bucket if they are available right now"""
+        with self.lock:
+            self._refill()
+            if self.tokens < amount:
+                return False
+
+            self.tokens -= amount
+            return True
+
+    def time_until_available(self, amount: float = 1) -> float:
+        """Returns how many seconds it takes until `amount` tokens are available (0 if they are available now)"""
+        with self.lock:
+            self._refill()
+            missing = amount - self.tokens
+            if missing <= 0:
+                return 0.0
+
+            return missing / self.refill_rate
+
+    def acquire(self, amount: float = 1, timeout: Optional[float] = None) -> bool:
+        """Block until `amount` tokens could be taken out of the bucket.
+        Returns False if that was not possible within `timeout` seconds."""
+        deadline = None if timeout is None else self.clock() + timeout
+
+        while not self.try_acquire(amount):
+            wait = self.time_until_available(amount)
+            if deadline is not None:
+                remaining = deadline - self.clock()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+        return True
+
+    def limit(self, remaining: float) -> None:
+        """Lower the amount of available tokens to what an external authority (e.g. a rate limit header) reported"""
+        with self.lock:
+            self._refill()
+            self.tokens = max(0.0, min(self.tokens, remaining))
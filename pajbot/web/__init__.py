@@ -58,6 +58,7 @@ def init(config_path: str) -> None:
     import pajbot.web.routes
     from pajbot.managers.db import DBManager
     from pajbot.managers.redis import RedisManager
+    from pajbot.managers.user_cache import publish_user_updates
     from pajbot.models.module import ModuleManager
     from pajbot.models.sock import SocketClientManager
     from pajbot.streamhelper import StreamHelper
@@ -118,6 +119,8 @@ def init(config_path: str) -> None:
             log.exception("Error downloading the streamers subscriber badge")
 
     SocketClientManager.init(app.streamer.login)
+    # Users edited on the web interface are evicted from the bot's user cache
+    publish_user_updates()
 
     if config["web"].get("modules") is not None:
         log.warning(
@@ -141,8 +144,9 @@ def init(config_path: str) -> None:
     pajbot.web.routes.api.init(app)
     pajbot.web.routes.base.init(app)
 
-    # Make a CSRF exemption for the /api/v1/banphrases/test endpoint
+    # Make a CSRF exemption for the /api/v1/banphrases/test endpoints
     csrf.exempt("pajbot.web.routes.api.banphrases.banphrases_test")
+    csrf.exempt("pajbot.web.routes.api.banphrases.banphrases_test_batch")
 
     pajbot.web.common.filters.init(app)
     pajbot.web.common.assets.init(app)
@@ -8,7 +8,7 @@ from pajbot.managers.adminlog import AdminLogManager
 from pajbot.managers.db import DBManager
 from pajbot.models.banphrase import Banphrase, BanphraseData
 from pajbot.models.sock import SocketClientManager
-from pajbot.web.utils import requires_level
+from pajbot.web.utils import invalidate_banphrase_matcher, requires_level
 
 from flask import abort, redirect, render_template, request, session
 from flask.typing import ResponseReturnValue
@@ -112,6 +112,7 @@ def init(page) -> None:
                 final_banphrase = banphrase
 
             SocketClientManager.send("banphrase.update", {"id": final_banphrase.id})
+            invalidate_banphrase_matcher()
             if id is None:
                 session["banphrase_created_id"] = final_banphrase.id
             else:
@@ -6,7 +6,7 @@ from pajbot.managers.db import DBManager
 from pajbot.models.command import Command, CommandData
 from pajbot.models.module import ModuleManager
 from pajbot.models.sock import SocketClientManager
-from pajbot.web.utils import requires_level
+from pajbot.web.utils import invalidate_cached_commands, requires_level
 
 from flask import abort, redirect, render_template, request, session
 from flask.typing import ResponseReturnValue
@@ -179,5 +179,6 @@ def init(page) -> None:
             db_session.expunge(command.data)
 
         SocketClientManager.send("command.update", {"command_id": command.id})
+        invalidate_cached_commands()
         session["command_created_id"] = command.id
         return redirect("/admin/commands", 303)
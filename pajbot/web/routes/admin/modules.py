@@ -7,7 +7,7 @@ from pajbot.managers.db import DBManager
 from pajbot.models.module import Module, ModuleManager
 from pajbot.models.sock import SocketClientManager
 from pajbot.utils import find
-from pajbot.web.utils import requires_level
+from pajbot.web.utils import invalidate_cached_modules, requires_level
 
 from flask import render_template, request
 from flask.typing import ResponseReturnValue
@@ -89,6 +89,7 @@ def init(page) -> None:
             payload = {"id": current_module.db_module.id}
 
             SocketClientManager.send("module.update", payload)
+            invalidate_cached_modules()
 
             AdminLogManager.post("Module edited", user, current_module.NAME)
 
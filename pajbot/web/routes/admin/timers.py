@@ -53,12 +53,13 @@ def init(page) -> None:
             name = request.form["name"].strip()
             interval_online = int(request.form["interval_online"])
             interval_offline = int(request.form["interval_offline"])
+            min_lines = int(request.form.get("min_lines", 0))
             message_type = request.form["message_type"]
             message = request.form["message"].strip()
         except (KeyError, ValueError):
             abort(403)
 
-        if interval_online < 0 or interval_offline < 0:
+        if interval_online < 0 or interval_offline < 0 or min_lines < 0:
             abort(403)
 
         if message_type not in ["say", "me", "announce"]:
@@ -77,6 +78,7 @@ def init(page) -> None:
             "name": name,
             "interval_online": interval_online,
             "interval_offline": interval_offline,
+            "min_lines": min_lines,
             "action": action,
         }
 
@@ -1,6 +1,8 @@
+import pajbot.web.routes.api.action_queue
 import pajbot.web.routes.api.banphrases
 import pajbot.web.routes.api.commands
 import pajbot.web.routes.api.common
+import pajbot.web.routes.api.moderation_queue
 import pajbot.web.routes.api.modules
 import pajbot.web.routes.api.playsound
 import pajbot.web.routes.api.social
@@ -40,6 +42,12 @@ def init(app) -> None:
     # /modules
     pajbot.web.routes.api.modules.init(bp)
 
+    # /action_queue/stats
+    pajbot.web.routes.api.action_queue.init(bp)
+
+    # /moderation_queue/stats
+    pajbot.web.routes.api.moderation_queue.init(bp)
+
     # /playsound/:name
     # /playsound/:name/play
     pajbot.web.routes.api.playsound.init(bp)
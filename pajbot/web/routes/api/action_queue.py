@@ -0,0 +1,21 @@
+from typing import Optional, cast
+
+import json
+
+import pajbot.web.utils
+from pajbot.action_queue import get_stats_key
+from pajbot.managers.redis import RedisManager
+
+from flask import Blueprint
+from flask.typing import ResponseReturnValue
+
+
+def init(bp: Blueprint) -> None:
+    @bp.route("/action_queue/stats")
+    @pajbot.web.utils.requires_level(500)
+    def action_queue_stats(**options) -> ResponseReturnValue:
+        data = cast(Optional[str], RedisManager.get().get(get_stats_key()))
+        if data is None:
+            return {"error": "The bot hasn't published any action queue or scheduler stats recently"}, 404
+
+        return json.loads(data)
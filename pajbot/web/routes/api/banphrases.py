@@ -1,5 +1,8 @@
+from typing import Any
+
 import json
 import logging
+import time
 from dataclasses import dataclass
 
 import pajbot.modules
@@ -7,9 +10,10 @@ import pajbot.utils
 import pajbot.web.utils
 from pajbot.managers.adminlog import AdminLogManager
 from pajbot.managers.db import DBManager
-from pajbot.models.banphrase import Banphrase, BanphraseManager
+from pajbot.models.banphrase import Banphrase, CompiledBanphrases
 from pajbot.models.sock import SocketClientManager
 from pajbot.web.schemas.toggle_state import ToggleState, ToggleStateSchema
+from pajbot.web.utils import get_cached_banphrase_matcher, invalidate_banphrase_matcher
 
 import marshmallow_dataclass
 from flask import Blueprint, request
@@ -17,6 +21,9 @@ from marshmallow import Schema, ValidationError
 
 log = logging.getLogger(__name__)
 
+# Maximum number of messages that can be tested in one batch request
+MAX_BATCH_SIZE = 100
+
 
 def filter_message(message: str) -> str:
     """
@@ -39,6 +46,25 @@ class TestBanphrase(Schema):
 TestBanphraseSchema = marshmallow_dataclass.class_schema(TestBanphrase)
 
 
+@dataclass
+class TestBanphraseBatch(Schema):
+    messages: list[str]
+
+
+TestBanphraseBatchSchema = marshmallow_dataclass.class_schema(TestBanphraseBatch)
+
+
+def check_banphrase_message(matcher: CompiledBanphrases, message: str) -> dict[str, Any]:
+    ret: dict[str, Any] = {"banned": False, "input_message": message}
+
+    res = matcher.check_message(message, None)
+    if res is not False:
+        ret["banned"] = True
+        ret["banphrase_data"] = res.jsonify()
+
+    return ret
+
+
 def init(bp: Blueprint) -> None:
     @bp.route("/banphrases/remove/<int:banphrase_id>", methods=["POST"])
     @pajbot.web.utils.requires_level(500)
@@ -50,8 +76,10 @@ def init(bp: Blueprint) -> None:
             AdminLogManager.post("Banphrase removed", options["user"], banphrase.id, banphrase.phrase)
             db_session.delete(banphrase)
             db_session.delete(banphrase.data)
-            SocketClientManager.send("banphrase.remove", {"id": banphrase.id})
-            return {"success": "good job"}, 200
+
+        SocketClientManager.send("banphrase.remove", {"id": banphrase_id})
+        invalidate_banphrase_matcher()
+        return {"success": "good job"}, 200
 
     @bp.route("/banphrases/toggle/<int:row_id>", methods=["POST"])
     @pajbot.web.utils.requires_level(500)
@@ -78,6 +106,7 @@ def init(bp: Blueprint) -> None:
                 "Banphrase toggled", options["user"], "Enabled" if data.new_state else "Disabled", row.id, row.phrase
             )
             SocketClientManager.send("banphrase.update", payload)
+            invalidate_banphrase_matcher()
             return {"success": "successful toggle", "new_state": data.new_state}
 
     @bp.route("/banphrases/test", methods=["POST"])
@@ -108,19 +137,33 @@ def init(bp: Blueprint) -> None:
         if not message:
             return {"error": "Parameter `message` cannot be empty."}, 400
 
-        ret = {"banned": False, "input_message": message}
+        return check_banphrase_message(get_cached_banphrase_matcher(), message)
 
-        banphrase_manager = BanphraseManager(None).load()
+    @bp.route("/banphrases/test/batch", methods=["POST"])
+    def banphrases_test_batch():
+        # Example request:
+        # curl --json '{"messages": ["xD", "xD2"]}'  http://localhost:7070/api/v1/banphrases/test/batch
+        start = time.perf_counter()
+
+        json_data = request.get_json(silent=True)
+        if not json_data:
+            return {"error": "Missing json body"}, 400
         try:
-            res = banphrase_manager.check_message(message, None)
-        finally:
-            banphrase_manager.db_session.close()
+            data: TestBanphraseBatch = TestBanphraseBatchSchema().load(json_data)
+        except ValidationError as err:
+            return {"error": f"Did not match schema: {json.dumps(err.messages)}"}, 400
+
+        if len(data.messages) > MAX_BATCH_SIZE:
+            return {"error": f"Parameter `messages` cannot contain more than {MAX_BATCH_SIZE} messages."}, 400
+
+        messages = [filter_message(message) for message in data.messages]
+        if not all(messages):
+            return {"error": "Parameter `messages` cannot contain empty messages."}, 400
 
-        if res is not False:
-            ret["banned"] = True
-            ret["banphrase_data"] = res.jsonify()
+        matcher = get_cached_banphrase_matcher()
+        results = [check_banphrase_message(matcher, message) for message in messages]
 
-        return ret
+        return {"results": results, "took_ms": round((time.perf_counter() - start) * 1000, 3)}
 
     # @bp.route("/banphrases/dump")
     # def banphrases_dump():
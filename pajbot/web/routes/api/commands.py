@@ -93,6 +93,7 @@ def init(bp: Blueprint) -> None:
             db_session.delete(command.data)
             db_session.delete(command)
 
+        pajbot.web.utils.invalidate_cached_commands()
         if SocketClientManager.send("command.remove", {"command_id": command_id}) is True:
             return {"success": "good job"}, 200
         else:
@@ -171,6 +172,7 @@ def init(bp: Blueprint) -> None:
                 data={"old_message": old_message, "new_message": new_message},
             )
 
+        pajbot.web.utils.invalidate_cached_commands()
         if SocketClientManager.send("command.update", {"command_id": command_id}) is True:
             return {"success": "good job"}, 200
         else:
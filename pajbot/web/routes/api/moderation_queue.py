@@ -0,0 +1,21 @@
+from typing import Optional, cast
+
+import json
+
+import pajbot.web.utils
+from pajbot.managers.moderation import get_stats_key
+from pajbot.managers.redis import RedisManager
+
+from flask import Blueprint
+from flask.typing import ResponseReturnValue
+
+
+def init(bp: Blueprint) -> None:
+    @bp.route("/moderation_queue/stats")
+    @pajbot.web.utils.requires_level(500)
+    def moderation_queue_stats(**options) -> ResponseReturnValue:
+        data = cast(Optional[str], RedisManager.get().get(get_stats_key()))
+        if data is None:
+            return {"error": "The bot hasn't published any moderation queue stats recently"}, 404
+
+        return json.loads(data)
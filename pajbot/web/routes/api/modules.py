@@ -54,5 +54,6 @@ def init(bp: Blueprint) -> None:
             payload = {"id": row.id, "new_state": data.new_state}
             AdminLogManager.post("Module toggled", options["user"], "Enabled" if row.enabled else "Disabled", row.id)
             SocketClientManager.send("module.update", payload)
+            pajbot.web.utils.invalidate_cached_modules()
             log.info(f"new state: {data} - {data.new_state}")
             return {"success": "successful toggle", "new_state": data.new_state}
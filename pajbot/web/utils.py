@@ -1,10 +1,12 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Any
+from typing import TYPE_CHECKING, Any, Callable, Optional
 
 import datetime
 import json
 import logging
+import threading
+import time
 from functools import update_wrapper, wraps
 
 import pajbot.exc
@@ -12,8 +14,11 @@ import pajbot.managers
 from pajbot import utils
 from pajbot.apiwrappers.base import BaseAPI
 from pajbot.managers.db import DBManager
+from pajbot.managers.emote import EcountManager
 from pajbot.managers.redis import RedisManager
+from pajbot.models.banphrase import Banphrase, CompiledBanphrases
 from pajbot.models.module import ModuleManager
+from pajbot.models.sock import SocketManager
 from pajbot.models.user import User
 from pajbot.streamhelper import StreamHelper
 from pajbot.utils import time_method
@@ -115,38 +120,81 @@ def download_sub_badge(twitch_helix_api: TwitchHelixAPI, streamer: UserBasics, s
 
 
 def get_top_emotes() -> list[dict[str, str]]:
+    return [
+        {"emote_name": emote_code, "emote_count": str(emote_count)}
+        for emote_code, emote_count in EcountManager.get_top_emotes(100)
+    ]
+
+
+# A cached value is served without being regenerated for this many seconds, unless it was invalidated.
+# After that it's regenerated by one request, while the others keep serving the stale value
+CACHE_FRESH_TIME = 5 * 60
+# A cached value is never served when it's older than this, in seconds
+CACHE_MAX_AGE = 24 * 60 * 60
+# How long a request waits for another request to generate a value that isn't cached at all, in seconds
+CACHE_GENERATE_WAIT_TIME = 10
+
+
+def invalidate_cached_value(cache_key: str) -> None:
+    RedisManager.get().set(f"{cache_key}:invalidated_at", time.time(), ex=CACHE_MAX_AGE)
+
+
+def get_cached_value(cache_key: str, generate: Callable[[], Any]) -> Any:
+    """
+    Returns the value cached in redis under the given key, generating it with generate() if needed.
+    Only one request in all web processes generates the value at a time, and stale values are served while it does.
+    """
+
+    # Make sure this process is notified about changes that invalidate the cache
+    get_web_socket_manager()
+
     redis = RedisManager.get()
-    streamer = StreamHelper.get_streamer()
-
-    top_emotes_list: list[dict[str, str]] = []
-    top_emotes = {  # noqa: C416
-        emote: emote_count
-        for emote, emote_count in sorted(
-            redis.zscan_iter(f"{streamer}:emotes:count"), key=lambda e_ecount_pair: e_ecount_pair[1], reverse=True
-        )[:100]
-    }
-
-    if top_emotes:
-        top_emotes_list.extend(
-            {"emote_name": emote, "emote_count": str(int(emote_count))} for emote, emote_count in top_emotes.items()
+    with redis.pipeline() as pipeline:
+        pipeline.get(cache_key)
+        pipeline.get(f"{cache_key}:invalidated_at")
+        cached_entry, invalidated_at = pipeline.execute()
+
+    stale_value = None
+    entry = json.loads(cached_entry) if cached_entry is not None else None
+    if isinstance(entry, dict):
+        is_fresh = entry["generated_at"] + CACHE_FRESH_TIME > time.time() and (
+            invalidated_at is None or entry["generated_at"] > float(invalidated_at)
         )
+        if is_fresh:
+            return entry["value"]
 
-    return top_emotes_list
+        stale_value = entry["value"]
 
+    lock = redis.lock(f"{cache_key}:lock", timeout=60, blocking_timeout=CACHE_GENERATE_WAIT_TIME)
+    if not lock.acquire(blocking=stale_value is None):
+        # Someone else is already regenerating the value
+        if stale_value is not None:
+            return stale_value
 
-@time_method
-def get_cached_commands() -> list[dict[str, Any]]:
-    CACHE_TIME = 30  # seconds
+        log.warning(f"Gave up waiting for {cache_key} to be generated, generating it anyway")
+
+    try:
+        if stale_value is None:
+            # The request that held the lock before us might have just generated the value
+            cached_entry = redis.get(cache_key)
+            entry = json.loads(cached_entry) if cached_entry is not None else None
+            if isinstance(entry, dict):
+                return entry["value"]
+
+        generated_at = time.time()
+        value = generate()
+        redis.set(
+            cache_key,
+            json.dumps({"generated_at": generated_at, "value": value}, separators=(",", ":")),
+            ex=CACHE_MAX_AGE,
+        )
+        return value
+    finally:
+        if lock.owned():
+            lock.release()
 
-    redis = RedisManager.get()
-    commands_key = f"{StreamHelper.get_streamer()}:cache:commands"
-    commands = redis.get(commands_key)
-    if commands is not None:
-        cached_bot_command_list = json.loads(commands)
-        if not isinstance(cached_bot_command_list, list):
-            return []
-        return cached_bot_command_list
 
+def generate_commands() -> list[dict[str, Any]]:
     log.debug("Updating commands...")
     bot_commands = pajbot.managers.command.CommandManager(
         socket_manager=None, module_manager=ModuleManager(None).load(), bot=None
@@ -154,35 +202,110 @@ def get_cached_commands() -> list[dict[str, Any]]:
     bot_commands_list = bot_commands.parse_for_web()
 
     bot_commands_list.sort(key=lambda x: (x.id or -1, x.main_alias))
-    jsonified_bot_commands_list = [c.jsonify() for c in bot_commands_list]
-    redis.setex(commands_key, value=json.dumps(jsonified_bot_commands_list, separators=(",", ":")), time=CACHE_TIME)
+    return [c.jsonify() for c in bot_commands_list]
 
-    return jsonified_bot_commands_list
+
+def generate_enabled_modules() -> list[str]:
+    log.debug("Updating enabled modules...")
+    module_manager = ModuleManager(None).load()
+    return [module.ID for module in module_manager.modules]
+
+
+@time_method
+def get_cached_commands() -> list[dict[str, Any]]:
+    cached_bot_command_list = get_cached_value(f"{StreamHelper.get_streamer()}:cache:commands", generate_commands)
+    if not isinstance(cached_bot_command_list, list):
+        return []
+    return cached_bot_command_list
 
 
 @time_method
 def get_cached_enabled_modules() -> set[str]:
-    CACHE_TIME = 30  # seconds
-    CACHE_KEY = f"{StreamHelper.get_streamer()}:cache:enabled_modules"
+    cached_enabled_modules = get_cached_value(
+        f"{StreamHelper.get_streamer()}:cache:enabled_modules", generate_enabled_modules
+    )
+    if not isinstance(cached_enabled_modules, list):
+        log.warning("Poorly cached module states")
+        return set()
+    return set(cached_enabled_modules)
 
-    enabled_modules: set[str] = set()
 
-    redis = RedisManager.get()
-    redis_enabled_modules = redis.get(CACHE_KEY)
-    if redis_enabled_modules is not None:
-        cached_enabled_modules = json.loads(redis_enabled_modules)
-        if not isinstance(cached_enabled_modules, list):
-            log.warning("Poorly cached module states")
-            return enabled_modules
-        return set(cached_enabled_modules)
+def invalidate_cached_commands(data: Any = None) -> None:
+    invalidate_cached_value(f"{StreamHelper.get_streamer()}:cache:commands")
 
-    log.debug("Updating enabled modules...")
-    module_manager = ModuleManager(None).load()
-    for module in module_manager.modules:
-        enabled_modules.add(module.ID)
-    redis.setex(CACHE_KEY, value=json.dumps(list(enabled_modules)), time=CACHE_TIME)
 
-    return enabled_modules
+def invalidate_cached_modules(data: Any = None) -> None:
+    # The command list depends on which modules are enabled
+    invalidate_cached_value(f"{StreamHelper.get_streamer()}:cache:enabled_modules")
+    invalidate_cached_commands()
+
+
+# Created the first time something in this web process needs to know about changes made by the bot or other web
+# processes, so it's never inherited by a forked worker process
+web_socket_manager: Optional[SocketManager] = None
+web_socket_manager_lock = threading.Lock()
+
+
+def get_web_socket_manager() -> SocketManager:
+    global web_socket_manager
+
+    with web_socket_manager_lock:
+        if web_socket_manager is None:
+            # Handlers are invoked on the socket manager thread
+            socket_manager = SocketManager(StreamHelper.get_streamer(), lambda handler, data: handler(data))
+            socket_manager.add_handler("banphrase.update", invalidate_banphrase_matcher)
+            socket_manager.add_handler("banphrase.remove", invalidate_banphrase_matcher)
+            socket_manager.add_handler("command.update", invalidate_cached_commands)
+            socket_manager.add_handler("command.remove", invalidate_cached_commands)
+            socket_manager.add_handler("module.update", invalidate_cached_modules)
+            web_socket_manager = socket_manager
+
+        return web_socket_manager
+
+
+cached_banphrase_matcher: Optional[CompiledBanphrases] = None
+# Bumped on every invalidation, so a matcher that was being built while a banphrase changed is not cached
+banphrase_matcher_generation = 0
+banphrase_matcher_lock = threading.Lock()
+
+
+def invalidate_banphrase_matcher(data: Any = None) -> None:
+    global cached_banphrase_matcher, banphrase_matcher_generation
+
+    banphrase_matcher_generation += 1
+    cached_banphrase_matcher = None
+
+
+def get_cached_banphrase_matcher() -> CompiledBanphrases:
+    """
+    Returns the enabled banphrases compiled into one matcher. The matcher is shared by all requests of this web process,
+    and rebuilt after a banphrase is changed by the bot or the web interface
+    """
+
+    global cached_banphrase_matcher
+
+    get_web_socket_manager()
+
+    matcher = cached_banphrase_matcher
+    if matcher is not None:
+        return matcher
+
+    with banphrase_matcher_lock:
+        matcher = cached_banphrase_matcher
+        if matcher is not None:
+            return matcher
+
+        log.debug("Updating banphrases...")
+        generation = banphrase_matcher_generation
+        with DBManager.create_session_scope(expire_on_commit=False) as db_session:
+            banphrases = db_session.query(Banphrase).filter_by(enabled=True).all()
+            db_session.expunge_all()
+
+        matcher = CompiledBanphrases(banphrases)
+        if generation == banphrase_matcher_generation:
+            cached_banphrase_matcher = matcher
+
+        return matcher
 
 
 def json_serial(obj):
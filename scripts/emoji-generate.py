@@ -46,4 +46,8 @@ if __name__ == "__main__":
     all_emoji = parse_emoji_data(emoji_data_text)
 
     list_str = json.dumps(all_emoji, ensure_ascii=False, indent=4)
+    print("from pajbot.utils import EmojiMatcher")
+    print()
     print("ALL_EMOJI = " + list_str)
+    print()
+    print("EMOJI_MATCHER = EmojiMatcher(ALL_EMOJI)")
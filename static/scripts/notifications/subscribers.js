@@ -28,6 +28,10 @@ function connect_to_ws() {
     socket.onopen = function() {
         console.log('Connected!');
         isopen = true;
+        // Only the sub events are used on this page
+        socket.send(
+            JSON.stringify({ type: 'subscribe', topics: ['new_sub', 'resub'] })
+        );
     };
 
     socket.onmessage = function(e) {